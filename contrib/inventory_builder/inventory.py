@@ -29,6 +29,19 @@
 #    group2:
 #      host2:
 #        ip: X.X.X.X
+#
+# Large host lists can be loaded from CSV or JSON lines files, which are read
+# one line at a time: inventory.py load hosts.csv hosts.jsonl
+# CSV files need a header row, groups are separated by spaces, commas or
+# semicolons and every other column is a host var:
+#    hostname,ip,groups,var
+#    host1,X.X.X.X,kube-node etcd,val
+# JSON lines files hold one host per line:
+#    {"hostname": "host1", "ip": "X.X.X.X", "groups": ["kube-node"]}
+#
+# Assign roles to loaded hosts: inventory.py place
+# etcd, kube-master and calico-rr hosts are spread across the zone and rack
+# host vars, preferring hosts with a higher capacity host var.
 
 from collections import OrderedDict
 try:
@@ -36,14 +49,21 @@ try:
 except ImportError:
     import ConfigParser as configparser
 
+import csv
 import os
 import re
+import shlex
 import sys
 
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
 ROLES = ['all', 'kube-master', 'kube-node', 'etcd', 'k8s-cluster:children',
          'calico-rr', 'vault']
 PROTECTED_NAMES = ROLES
-AVAILABLE_COMMANDS = ['help', 'print_cfg', 'print_ips', 'load']
+AVAILABLE_COMMANDS = ['help', 'print_cfg', 'print_ips', 'load', 'place']
 _boolean_states = {'1': True, 'yes': True, 'true': True, 'on': True,
                    '0': False, 'no': False, 'false': False, 'off': False}
 
@@ -52,27 +72,124 @@ def get_var_as_bool(name, default):
     value = os.environ.get(name, '')
     return _boolean_states.get(value.lower(), default)
 
+
+def inventory_config():
+    '''Returns an empty ConfigParser for an INI inventory.'''
+    config = configparser.ConfigParser(allow_no_value=True,
+                                       delimiters=('\t', ' '),
+                                       interpolation=None)
+    # Host names and vars are case sensitive.
+    config.optionxform = str
+    return config
+
+
+def is_host_group(group):
+    '''Returns False for the group:children and group:vars sections.'''
+    return ':' not in group
+
 # Configurable as shell vars start
 
 CONFIG_FILE = os.environ.get("CONFIG_FILE", "./inventory/sample/hosts.ini")
 # Reconfigures cluster distribution at scale
 SCALE_THRESHOLD = int(os.environ.get("SCALE_THRESHOLD", 50))
-MASSIVE_SCALE_THRESHOLD = int(os.environ.get("SCALE_THRESHOLD", 200))
+MASSIVE_SCALE_THRESHOLD = int(os.environ.get("MASSIVE_SCALE_THRESHOLD", 200))
+# JSON or YAML file replacing the DEFAULT_SIZING tiers below
+SIZING_FILE = os.environ.get("SIZING_FILE")
 
 DEBUG = get_var_as_bool("DEBUG", True)
 HOST_PREFIX = os.environ.get("HOST_PREFIX", "node")
 
 # Configurable as shell vars end
 
+# Control plane size by cluster size. A tier applies from min_nodes hosts,
+# or from min_capacity summed over the capacity host vars (CPU cores) of all
+# hosts; keys missing in a tier are taken from the one before it.
+# separate_etcd keeps etcd members off kube-master and kube-node hosts,
+# separate_master keeps kube-master hosts off kube-node.
+DEFAULT_SIZING = [
+    {'min_nodes': 0, 'etcd': 3, 'kube-master': 2, 'calico-rr': 0,
+     'separate_etcd': False, 'separate_master': False},
+    {'min_nodes': SCALE_THRESHOLD, 'calico-rr': 3, 'separate_etcd': True},
+    {'min_nodes': MASSIVE_SCALE_THRESHOLD, 'min_capacity': 3200, 'etcd': 5,
+     'kube-master': 3, 'separate_master': True},
+    {'min_nodes': 500, 'min_capacity': 8000, 'kube-master': 5},
+    {'min_nodes': 1000, 'min_capacity': 16000, 'etcd': 7},
+]
+
+
+class Host(object):
+    '''An inventory host: its address vars, other host vars and groups.
+
+    Options are parsed once when the inventory is read and serialized again
+    only when it is written.'''
+
+    __slots__ = ('name', 'ip', 'access_ip', 'ansible_host', 'hostvars',
+                 'roles')
+
+    ADDRESS_VARS = ('ansible_host', 'ip', 'access_ip')
+
+    def __init__(self, name, ip=None, access_ip=None, ansible_host=None,
+                 hostvars=None, roles=None):
+        self.name = name
+        self.ip = ip
+        self.access_ip = access_ip
+        self.ansible_host = ansible_host
+        self.hostvars = OrderedDict(hostvars or ())
+        self.roles = set(roles or ())
+
+    @classmethod
+    def from_opts(cls, name, optstring):
+        host = cls(name)
+        host.update_opts(optstring)
+        return host
+
+    def update_opts(self, optstring):
+        '''Sets the vars of an INI host line, "k1=v1 k2='v 2' ...".'''
+        optstring = optstring or ''
+        opts = optstring.split()
+        if '"' in optstring or "'" in optstring or '\\' in optstring:
+            try:
+                opts = shlex.split(optstring)
+            except ValueError:
+                pass
+        for opt in opts:
+            key, sep, value = opt.partition('=')
+            if sep:
+                self.set_var(key, value)
+
+    def set_var(self, key, value):
+        if key in self.ADDRESS_VARS:
+            setattr(self, key, None if value is None else str(value))
+        else:
+            self.hostvars[key] = value
+
+    def opts(self):
+        opts = [(key, getattr(self, key)) for key in self.ADDRESS_VARS
+                if getattr(self, key) is not None]
+        opts.extend(self.hostvars.items())
+        return ' '.join('{0}={1}'.format(key, quote(str(value)))
+                        for key, value in opts)
+
+    def __eq__(self, other):
+        return (isinstance(other, Host) and
+                all(getattr(self, attr) == getattr(other, attr)
+                    for attr in self.__slots__))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'Host({0!r}, {1!r})'.format(self.name, self.opts())
+
 
 class KubesprayInventory(object):
 
     def __init__(self, changed_hosts=None, config_file=None):
-        self.config = configparser.ConfigParser(allow_no_value=True,
-                                                delimiters=('\t', ' '))
+        self.config = inventory_config()
         self.config_file = config_file
         if self.config_file:
             self.config.read(self.config_file)
+        self.read_config()
 
         if changed_hosts and changed_hosts[0] in AVAILABLE_COMMANDS:
             self.parse_command(changed_hosts[0], changed_hosts[1:])
@@ -84,25 +201,56 @@ class KubesprayInventory(object):
             self.hosts = self.build_hostnames(changed_hosts)
             self.purge_invalid_hosts(self.hosts.keys(), PROTECTED_NAMES)
             self.set_all(self.hosts)
-            self.set_k8s_cluster()
-            self.set_etcd(list(self.hosts.keys())[:3])
-            if len(self.hosts) >= SCALE_THRESHOLD:
-                self.set_kube_master(list(self.hosts.keys())[3:5])
-            else:
-                self.set_kube_master(list(self.hosts.keys())[:2])
-            self.set_kube_node(self.hosts.keys())
-            if len(self.hosts) >= SCALE_THRESHOLD:
-                self.set_calico_rr(list(self.hosts.keys())[:3])
+            self.place_roles()
         else:  # Show help if no options
             self.show_help()
             sys.exit(0)
 
         self.write_config(self.config_file)
 
+    def read_config(self):
+        '''Parses the hosts of the "all" section of self.config into Host
+        records, indexed by name in self.hosts and by ip in self.ip_index.
+
+        The lines of every other section are kept as read in self.groups,
+        and the hosts of the "all" section get the groups they are listed
+        in as roles. :children and :vars sections are not parsed.'''
+        self.hosts = OrderedDict()
+        self.ip_index = {}
+        self.groups = OrderedDict()
+        if self.config.has_section('all'):
+            for name, opts in self.config.items('all'):
+                self.update_host(self.get_host(name), opts)
+        for group in self.config.sections():
+            self.groups[group] = OrderedDict()
+            if group == 'all':
+                continue
+            for name, value in self.config.items(group):
+                self.groups[group][name] = value
+                if is_host_group(group) and name in self.hosts:
+                    self.hosts[name].roles.add(group)
+
+    def build_config(self):
+        '''Returns a ConfigParser with the INI serialization of the
+        inventory.'''
+        config = inventory_config()
+        members = OrderedDict((group, OrderedDict(lines))
+                              for group, lines in self.groups.items())
+        members.setdefault('all', OrderedDict())
+        for name, host in self.hosts.items():
+            members['all'][name] = host.opts()
+            for role in host.roles:
+                members.setdefault(role, OrderedDict()).setdefault(name, "")
+        for group, lines in members.items():
+            config.add_section(group)
+            for name, value in lines.items():
+                config.set(group, name, value)
+        return config
+
     def write_config(self, config_file):
         if config_file:
             with open(config_file, 'w') as f:
-                self.config.write(f)
+                self.build_config().write(f)
         else:
             print("WARNING: Unable to save config. Make sure you set "
                   "CONFIG_FILE env var.")
@@ -112,22 +260,16 @@ class KubesprayInventory(object):
             print("DEBUG: {0}".format(msg))
 
     def get_ip_from_opts(self, optstring):
-        opts = optstring.split(' ')
-        for opt in opts:
-            if '=' not in opt:
-                continue
-            k, v = opt.split('=')
-            if k == "ip":
-                return v
-        raise ValueError("IP parameter not found in options")
+        ip = Host.from_opts(None, optstring).ip
+        if ip is None:
+            raise ValueError("IP parameter not found in options")
+        return ip
 
     def ensure_required_groups(self, groups):
         for group in groups:
-            try:
+            if group not in self.groups:
                 self.debug("Adding group {0}".format(group))
-                self.config.add_section(group)
-            except configparser.DuplicateSectionError:
-                pass
+                self.groups[group] = OrderedDict()
 
     def get_host_id(self, host):
         '''Returns integer host ID (without padding) from a given hostname.'''
@@ -138,82 +280,276 @@ class KubesprayInventory(object):
             raise ValueError("Host name must end in an integer")
 
     def build_hostnames(self, changed_hosts):
-        existing_hosts = OrderedDict()
         highest_host_id = 0
-        try:
-            for host, opts in self.config.items('all'):
-                existing_hosts[host] = opts
-                host_id = self.get_host_id(host)
-                if host_id > highest_host_id:
-                    highest_host_id = host_id
-        except configparser.NoSectionError:
-            pass
+        for host in self.hosts:
+            host_id = self.get_host_id(host)
+            if host_id > highest_host_id:
+                highest_host_id = host_id
 
         # FIXME(mattymo): Fix condition where delete then add reuses highest id
         next_host_id = highest_host_id + 1
 
-        all_hosts = existing_hosts.copy()
         for host in changed_hosts:
             if host[0] == "-":
                 realhost = host[1:]
-                if self.exists_hostname(all_hosts, realhost):
+                if self.exists_hostname(realhost):
                     self.debug("Marked {0} for deletion.".format(realhost))
-                    all_hosts.pop(realhost)
-                elif self.exists_ip(all_hosts, realhost):
+                    self.delete_host(realhost)
+                elif self.exists_ip(realhost):
                     self.debug("Marked {0} for deletion.".format(realhost))
-                    self.delete_host_by_ip(all_hosts, realhost)
+                    self.delete_host_by_ip(realhost)
             elif host[0].isdigit():
-                if self.exists_hostname(all_hosts, host):
+                if self.exists_hostname(host):
                     self.debug("Skipping existing host {0}.".format(host))
                     continue
-                elif self.exists_ip(all_hosts, host):
+                elif self.exists_ip(host):
                     self.debug("Skipping existing host {0}.".format(host))
                     continue
 
                 next_host = "{0}{1}".format(HOST_PREFIX, next_host_id)
                 next_host_id += 1
-                all_hosts[next_host] = "ansible_host={0} ip={1}".format(
-                    host, host)
+                self.add_host(Host(next_host, ip=host, ansible_host=host))
             elif host[0].isalpha():
                 raise Exception("Adding hosts by hostname is not supported.")
 
-        return all_hosts
-
-    def exists_hostname(self, existing_hosts, hostname):
-        return hostname in existing_hosts.keys()
-
-    def exists_ip(self, existing_hosts, ip):
-        for host_opts in existing_hosts.values():
-            if ip == self.get_ip_from_opts(host_opts):
-                return True
-        return False
-
-    def delete_host_by_ip(self, existing_hosts, ip):
-        for hostname, host_opts in existing_hosts.items():
-            if ip == self.get_ip_from_opts(host_opts):
-                del existing_hosts[hostname]
-                return
-        raise ValueError("Unable to find host by IP: {0}".format(ip))
+        return self.hosts
+
+    def get_host(self, name):
+        '''Returns the Host called name, adding it to the inventory if
+        needed.'''
+        host = self.hosts.get(name)
+        if host is None:
+            host = self.hosts[name] = Host(name)
+        return host
+
+    def add_host(self, host):
+        self.hosts[host.name] = host
+        if host.ip is not None:
+            self.ip_index[host.ip] = host.name
+
+    def update_host(self, host, opts=None, hostvars=None):
+        '''Sets the vars of host from an options string or a dict, keeping
+        its ip indexed.'''
+        if self.ip_index.get(host.ip) == host.name:
+            del self.ip_index[host.ip]
+        if opts:
+            host.update_opts(opts)
+        for key, val in (hostvars or {}).items():
+            host.set_var(key, val)
+        if host.ip is not None:
+            self.ip_index[host.ip] = host.name
+
+    def exists_hostname(self, hostname):
+        return hostname in self.hosts
+
+    def exists_ip(self, ip):
+        return ip in self.ip_index
+
+    def delete_host(self, hostname):
+        host = self.hosts.pop(hostname)
+        if self.ip_index.get(host.ip) == hostname:
+            del self.ip_index[host.ip]
+        for group, lines in self.groups.items():
+            if is_host_group(group):
+                lines.pop(hostname, None)
+
+    def delete_host_by_ip(self, ip):
+        if ip not in self.ip_index:
+            raise ValueError("Unable to find host by IP: {0}".format(ip))
+        self.delete_host(self.ip_index[ip])
 
     def purge_invalid_hosts(self, hostnames, protected_names=[]):
-        for role in self.config.sections():
-            for host, _ in self.config.items(role):
+        for host in list(self.hosts):
+            if host not in hostnames and host not in protected_names:
+                self.debug("Host {0} removed from inventory".format(host))
+                self.delete_host(host)
+        for group, lines in self.groups.items():
+            if not is_host_group(group):
+                continue
+            for host in list(lines):
                 if host not in hostnames and host not in protected_names:
-                    self.debug("Host {0} removed from role {1}".format(host,
-                               role))
-                    self.config.remove_option(role, host)
+                    self.debug("Host {0} removed from role {1}".format(
+                               host, group))
+                    del lines[host]
 
     def add_host_to_group(self, group, host, opts=""):
         self.debug("adding host {0} to group {1}".format(host, group))
-        self.config.set(group, host, opts)
+        self.ensure_required_groups([group])
+        if group == 'all':
+            self.update_host(self.get_host(host), opts)
+        else:
+            self.join_group(group, host)
+
+    def add_hosts_to_group(self, group, hosts):
+        self.debug("adding {0} hosts to group {1}".format(len(hosts), group))
+        self.ensure_required_groups([group])
+        for host in hosts:
+            self.join_group(group, host)
+
+    def join_group(self, group, host):
+        if group == 'all':
+            self.get_host(host)
+            return
+        if is_host_group(group) and host in self.hosts:
+            self.hosts[host].roles.add(group)
+            if host not in self.groups[group]:
+                return
+        self.groups[group][host] = ""
+
+    def in_group(self, group, host):
+        if host in self.groups.get(group, ()):
+            return True
+        if host not in self.hosts:
+            return False
+        return group == 'all' or group in self.hosts[host].roles
+
+    def place_roles(self):
+        '''Assigns the etcd, kube-master, kube-node and calico-rr roles.'''
+        hosts = list(self.hosts.keys())
+        tier = self.sizing()
+        self.set_k8s_cluster()
+        etcd = self.place(hosts, tier['etcd'], 'etcd')
+        self.set_etcd(etcd)
+        if tier['separate_etcd']:
+            masters = [host for host in hosts if host not in etcd]
+        else:
+            masters = hosts
+        self.set_kube_master(self.place(masters, tier['kube-master'],
+                                        'kube-master'))
+        self.set_kube_node(hosts, tier)
+        if tier['calico-rr']:
+            reflectors = [host for host in hosts
+                          if not self.in_group('kube-master', host) and
+                          not self.in_group('kube-node', host)]
+            self.set_calico_rr(self.place(reflectors, tier['calico-rr'],
+                                          'calico-rr'))
+        print(self.sizing_report(tier))
+
+    def load_sizing(self, sizing_file=None):
+        '''Returns the sizing tiers from sizing_file, or DEFAULT_SIZING.'''
+        if not sizing_file:
+            return DEFAULT_SIZING
+        import json
+        import yaml
+
+        with open(sizing_file) as f:
+            try:
+                tiers = json.load(f)
+            except ValueError:
+                f.seek(0)
+                tiers = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader',
+                                                    yaml.SafeLoader))
+        if not isinstance(tiers, list) or not tiers:
+            raise Exception("{0} must hold a list of sizing "
+                            "tiers".format(sizing_file))
+        return tiers
+
+    def sizing(self):
+        '''Returns the sizing tier for the hosts in the inventory, with
+        the hosts, capacity and reason it was chosen for.'''
+        num_hosts = len(self.hosts)
+        capacity = sum(self.capacity(host) for host in self.hosts)
+        tier = {'source': SIZING_FILE or 'defaults', 'hosts': num_hosts,
+                'capacity': capacity, 'reason': 'smallest tier'}
+        merged = {}
+        tiers = self.load_sizing(SIZING_FILE)
+        for step in sorted(tiers, key=lambda t: t.get('min_nodes', 0)):
+            merged = dict(merged)
+            merged.update(step)
+            if num_hosts >= step.get('min_nodes', 0):
+                reason = "{0} hosts >= {1}".format(num_hosts,
+                                                   step.get('min_nodes', 0))
+            elif capacity >= step.get('min_capacity', float('inf')):
+                reason = "capacity {0:g} >= {1}".format(capacity,
+                                                        step['min_capacity'])
+            else:
+                continue
+            tier.update(merged)
+            tier['reason'] = reason
+        for key in ('etcd', 'kube-master', 'calico-rr'):
+            tier[key] = int(tier.get(key, 0))
+        for key in ('separate_etcd', 'separate_master'):
+            tier[key] = bool(tier.get(key, False))
+        if tier['etcd'] % 2 == 0:
+            raise Exception("etcd needs an odd number of members, sizing "
+                            "from {0} asks for {1}".format(tier['source'],
+                                                           tier['etcd']))
+        return tier
+
+    def capacity(self, host):
+        try:
+            return float(self.hosts[host].hostvars.get('capacity', 0))
+        except ValueError:
+            return 0.0
+
+    def sizing_report(self, tier):
+        '''Returns a text report of the control plane sizing and placement
+        of the inventory.'''
+        lines = ["Sizing: {0} hosts, capacity {1:g}, tier from {2} "
+                 "({3})".format(tier['hosts'], tier['capacity'],
+                                tier['source'], tier['reason'])]
+        roles = ('etcd', 'kube-master', 'calico-rr', 'kube-node')
+        for role in roles[:3]:
+            hosts = [host for host in self.hosts if self.in_group(role, host)]
+            zones = set(self.hosts[host].hostvars.get('zone')
+                        for host in hosts)
+            shared = [other for other in roles if other != role and
+                      any(self.in_group(other, host) for host in hosts)]
+            line = "  {0}: {1} of {2} wanted".format(role, len(hosts),
+                                                     tier[role])
+            if hosts:
+                line += ", {0}, {1} zone(s), hosts: {2}".format(
+                    'shared with ' + ', '.join(shared) if shared
+                    else 'dedicated', len(zones), ', '.join(hosts))
+            lines.append(line)
+            if len(hosts) < tier[role]:
+                lines.append("  WARNING: not enough hosts for {0}".format(
+                    role))
+        return '\n'.join(lines)
+
+    def place(self, hosts, count, role):
+        '''Returns count hosts out of hosts for role.
+
+        Current members of role are kept. The other hosts are picked one at
+        a time from the zone, then the rack, with the fewest hosts picked so
+        far, preferring the highest capacity and then the order of hosts.
+        Zone, rack and capacity are read from the host vars; without them
+        this picks the first hosts.'''
+        chosen = [host for host in hosts if self.in_group(role, host)][:count]
+        zones = {}
+        racks = {}
+
+        def domains(host):
+            hostvars = self.hosts[host].hostvars
+            zone = hostvars.get('zone')
+            return zone, (zone, hostvars.get('rack'))
+
+        for host in chosen:
+            zone, rack = domains(host)
+            zones[zone] = zones.get(zone, 0) + 1
+            racks[rack] = racks.get(rack, 0) + 1
+        candidates = [(domains(host), -self.capacity(host), index, host)
+                      for index, host in enumerate(hosts)
+                      if host not in chosen]
+        while len(chosen) < count and candidates:
+            best = min(candidates, key=lambda c: (zones.get(c[0][0], 0),
+                                                  racks.get(c[0][1], 0),
+                                                  c[1], c[2]))
+            candidates.remove(best)
+            (zone, rack), _, _, host = best
+            zones[zone] = zones.get(zone, 0) + 1
+            racks[rack] = racks.get(rack, 0) + 1
+            chosen.append(host)
+        self.debug("Placed {0} on {1}".format(role, ', '.join(chosen)))
+        return chosen
 
     def set_kube_master(self, hosts):
         for host in hosts:
             self.add_host_to_group('kube-master', host)
 
     def set_all(self, hosts):
-        for host, opts in hosts.items():
-            self.add_host_to_group('all', host, opts)
+        for host in hosts.values():
+            self.add_host(host)
 
     def set_k8s_cluster(self):
         self.add_host_to_group('k8s-cluster:children', 'kube-node')
@@ -221,26 +557,27 @@ class KubesprayInventory(object):
 
     def set_calico_rr(self, hosts):
         for host in hosts:
-            if host in self.config.items('kube-master'):
+            if self.in_group('kube-master', host):
                     self.debug("Not adding {0} to calico-rr group because it "
                                "conflicts with kube-master group".format(host))
                     continue
-            if host in self.config.items('kube-node'):
+            if self.in_group('kube-node', host):
                     self.debug("Not adding {0} to calico-rr group because it "
                                "conflicts with kube-node group".format(host))
                     continue
             self.add_host_to_group('calico-rr', host)
 
-    def set_kube_node(self, hosts):
+    def set_kube_node(self, hosts, tier=None):
+        tier = tier or self.sizing()
         for host in hosts:
-            if len(self.config['all']) >= SCALE_THRESHOLD:
-                if self.config.has_option('etcd', host):
+            if tier['separate_etcd']:
+                if self.in_group('etcd', host):
                     self.debug("Not adding {0} to kube-node group because of "
                                "scale deployment and host is in etcd "
                                "group.".format(host))
                     continue
-            if len(self.config['all']) >= MASSIVE_SCALE_THRESHOLD:
-                if self.config.has_option('kube-master', host):
+            if tier['separate_master']:
+                if self.in_group('kube-master', host):
                     self.debug("Not adding {0} to kube-node group because of "
                                "scale deployment and host is in kube-master "
                                "group.".format(host))
@@ -253,42 +590,95 @@ class KubesprayInventory(object):
             self.add_host_to_group('vault', host)
 
     def load_file(self, files=None):
-        '''Directly loads JSON, or YAML file to inventory.'''
+        '''Loads hosts from CSV, JSON lines, JSON or YAML files into the
+        inventory and writes it once all files are read.'''
 
         if not files:
             raise Exception("No input file specified.")
 
+        self.ensure_required_groups(ROLES)
+        self.set_k8s_cluster()
+        members = OrderedDict()
+        for filename in list(files):
+            for name, groups, hostvars in self.read_hosts(filename):
+                host = self.get_host(name)
+                if 'ip' in hostvars:
+                    host.ansible_host = str(hostvars['ip'])
+                self.update_host(host, hostvars=hostvars)
+                for group in groups:
+                    members.setdefault(group, []).append(name)
+        for group, hosts in members.items():
+            self.add_hosts_to_group(group, hosts)
+        self.write_config(self.config_file)
+
+    def read_hosts(self, filename):
+        '''Yields (hostname, groups, hostvars) for every host entry in
+        filename. CSV (.csv) and JSON lines (.jsonl, .ndjson) files are
+        streamed line by line, other files are read as grouped JSON or
+        YAML.'''
+        extension = os.path.splitext(filename)[1].lower()
+        if extension == '.csv':
+            return self.read_csv(filename)
+        elif extension in ('.jsonl', '.ndjson'):
+            return self.read_json_lines(filename)
+        return self.read_grouped(filename)
+
+    def read_csv(self, filename):
+        '''Reads a CSV file with a header row naming the hostname, ip and
+        groups columns; every other non-empty column is a host var.'''
+        with open(filename) as f:
+            for row in csv.DictReader(f):
+                yield self.host_entry(row, filename)
+
+    def read_json_lines(self, filename):
+        '''Reads a file with one {"hostname": .., "ip": .., "groups": [..],
+        ..} object per line.'''
+        import json
+
+        with open(filename) as f:
+            for line in f:
+                if line.strip():
+                    yield self.host_entry(
+                        json.loads(line, object_pairs_hook=OrderedDict),
+                        filename)
+
+    def read_grouped(self, filename):
+        '''Reads a JSON or YAML file mapping groups to hosts to host vars.'''
         import json
         import yaml
 
-        for filename in list(files):
+        with open(filename, 'r') as f:
             # Try JSON, then YAML
             try:
-                with open(filename, 'r') as f:
-                    data = json.load(f)
+                data = json.load(f, object_pairs_hook=OrderedDict)
             except ValueError:
+                f.seek(0)
                 try:
-                    with open(filename, 'r') as f:
-                        data = yaml.load(f)
-                        print("yaml")
-                except ValueError:
-                    raise Exception("Cannot read %s as JSON, YAML, or CSV",
-                                    filename)
-
-            self.ensure_required_groups(ROLES)
-            self.set_k8s_cluster()
-            for group, hosts in data.items():
-                self.ensure_required_groups([group])
-                for host, opts in hosts.items():
-                    optstring = "ansible_host={0} ip={0}".format(opts['ip'])
-                    for key, val in opts.items():
-                        if key == "ip":
-                            continue
-                        optstring += " {0}={1}".format(key, val)
-
-                    self.add_host_to_group('all', host, optstring)
-                    self.add_host_to_group(group, host)
-            self.write_config(self.config_file)
+                    data = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader',
+                                                       yaml.SafeLoader))
+                except yaml.YAMLError:
+                    raise Exception("Cannot read {0} as JSON, YAML, or "
+                                    "CSV".format(filename))
+
+        for group, hosts in data.items():
+            for name, opts in (hosts or {}).items():
+                yield name, [group], opts or {}
+
+    def host_entry(self, entry, filename):
+        '''Splits a host entry of a CSV or JSON lines file into hostname,
+        groups and host vars.'''
+        hostvars = OrderedDict(entry)
+        name = hostvars.pop('hostname', None)
+        if not name:
+            raise Exception("Host entry without hostname in {0}: "
+                            "{1}".format(filename, entry))
+        groups = hostvars.pop('groups', None) or []
+        if not isinstance(groups, (list, tuple)):
+            groups = re.split(r'[\s,;]+', groups.strip())
+        for key, val in list(hostvars.items()):
+            if val is None or val == '':
+                del hostvars[key]
+        return name, [group for group in groups if group], hostvars
 
     def parse_command(self, command, args=None):
         if command == 'help':
@@ -299,6 +689,10 @@ class KubesprayInventory(object):
             self.print_ips()
         elif command == 'load':
             self.load_file(args)
+        elif command == 'place':
+            self.ensure_required_groups(ROLES)
+            self.place_roles()
+            self.write_config(self.config_file)
         else:
             raise Exception("Invalid command specified.")
 
@@ -310,6 +704,9 @@ Available commands:
 help - Display this message
 print_cfg - Write inventory file to stdout
 print_ips - Write a space-delimited list of IPs from "all" group
+load - Load hosts from CSV, JSON lines, JSON or YAML files
+place - Assign etcd, kube-master, kube-node and calico-rr roles, spreading
+        them across the zone and rack host vars of the loaded hosts
 
 Advanced usage:
 Add another host after initial creation: inventory.py 10.10.1.5
@@ -322,16 +719,16 @@ CONFIG_FILE             File to write config to Default: ./inventory/sample/host
 HOST_PREFIX             Host prefix for generated hosts. Default: node
 SCALE_THRESHOLD         Separate ETCD role if # of nodes >= 50
 MASSIVE_SCALE_THRESHOLD Separate K8s master and ETCD if # of nodes >= 200
+SIZING_FILE             JSON or YAML list of sizing tiers replacing the
+                        defaults. Default: none
 '''
         print(help_text)
 
     def print_config(self):
-        self.config.write(sys.stdout)
+        self.build_config().write(sys.stdout)
 
     def print_ips(self):
-        ips = []
-        for host, opts in self.config.items('all'):
-            ips.append(self.get_ip_from_opts(opts))
+        ips = [host.ip for host in self.hosts.values() if host.ip is not None]
         print(' '.join(ips))
 
 
@@ -13,6 +13,9 @@
 # under the License.
 
 import mock
+import os
+import shutil
+import tempfile
 import unittest
 
 from collections import OrderedDict
@@ -25,6 +28,10 @@ if path not in sys.path:
 import inventory
 
 
+def host_opts(hosts):
+    return OrderedDict((name, host.opts()) for name, host in hosts.items())
+
+
 class TestInventory(unittest.TestCase):
     @mock.patch('inventory.sys')
     def setUp(self, sys_mock):
@@ -33,6 +40,10 @@ class TestInventory(unittest.TestCase):
         self.data = ['10.90.3.2', '10.90.3.3', '10.90.3.4']
         self.inv = inventory.KubesprayInventory()
 
+    def load_hosts(self, hosts):
+        self.inv.config['all'] = hosts
+        self.inv.read_config()
+
     def test_get_ip_from_opts(self):
         optstring = "ansible_host=10.90.3.2 ip=10.90.3.2"
         expected = "10.90.3.2"
@@ -48,7 +59,7 @@ class TestInventory(unittest.TestCase):
         groups = ['group1', 'group2']
         self.inv.ensure_required_groups(groups)
         for group in groups:
-            self.assertTrue(group in self.inv.config.sections())
+            self.assertTrue(group in self.inv.groups)
 
     def test_get_host_id(self):
         hostnames = ['node99', 'no99de01', '01node01', 'node1.domain',
@@ -69,35 +80,47 @@ class TestInventory(unittest.TestCase):
         expected = OrderedDict([('node1',
                                'ansible_host=10.90.0.2 ip=10.90.0.2')])
         result = self.inv.build_hostnames(changed_hosts)
-        self.assertEqual(expected, result)
+        self.assertEqual(expected, host_opts(result))
 
     def test_build_hostnames_add_duplicate(self):
         changed_hosts = ['10.90.0.2']
         expected = OrderedDict([('node1',
                                'ansible_host=10.90.0.2 ip=10.90.0.2')])
-        self.inv.config['all'] = expected
+        self.load_hosts(expected)
         result = self.inv.build_hostnames(changed_hosts)
-        self.assertEqual(expected, result)
+        self.assertEqual(expected, host_opts(result))
 
     def test_build_hostnames_add_two(self):
         changed_hosts = ['10.90.0.2', '10.90.0.3']
         expected = OrderedDict([
             ('node1', 'ansible_host=10.90.0.2 ip=10.90.0.2'),
             ('node2', 'ansible_host=10.90.0.3 ip=10.90.0.3')])
-        self.inv.config['all'] = OrderedDict()
+        self.load_hosts(OrderedDict())
         result = self.inv.build_hostnames(changed_hosts)
-        self.assertEqual(expected, result)
+        self.assertEqual(expected, host_opts(result))
 
     def test_build_hostnames_delete_first(self):
         changed_hosts = ['-10.90.0.2']
         existing_hosts = OrderedDict([
             ('node1', 'ansible_host=10.90.0.2 ip=10.90.0.2'),
             ('node2', 'ansible_host=10.90.0.3 ip=10.90.0.3')])
-        self.inv.config['all'] = existing_hosts
+        self.load_hosts(existing_hosts)
         expected = OrderedDict([
             ('node2', 'ansible_host=10.90.0.3 ip=10.90.0.3')])
         result = self.inv.build_hostnames(changed_hosts)
-        self.assertEqual(expected, result)
+        self.assertEqual(expected, host_opts(result))
+
+    def test_build_hostnames_delete_by_hostname_then_add_ip(self):
+        changed_hosts = ['-node1', '10.90.0.2']
+        existing_hosts = OrderedDict([
+            ('node1', 'ansible_host=10.90.0.2 ip=10.90.0.2'),
+            ('node2', 'ansible_host=10.90.0.3 ip=10.90.0.3')])
+        self.load_hosts(existing_hosts)
+        expected = OrderedDict([
+            ('node2', 'ansible_host=10.90.0.3 ip=10.90.0.3'),
+            ('node3', 'ansible_host=10.90.0.2 ip=10.90.0.2')])
+        result = self.inv.build_hostnames(changed_hosts)
+        self.assertEqual(expected, host_opts(result))
 
     def test_exists_hostname_positive(self):
         hostname = 'node1'
@@ -105,7 +128,8 @@ class TestInventory(unittest.TestCase):
         existing_hosts = OrderedDict([
             ('node1', 'ansible_host=10.90.0.2 ip=10.90.0.2'),
             ('node2', 'ansible_host=10.90.0.3 ip=10.90.0.3')])
-        result = self.inv.exists_hostname(existing_hosts, hostname)
+        self.load_hosts(existing_hosts)
+        result = self.inv.exists_hostname(hostname)
         self.assertEqual(expected, result)
 
     def test_exists_hostname_negative(self):
@@ -114,7 +138,8 @@ class TestInventory(unittest.TestCase):
         existing_hosts = OrderedDict([
             ('node1', 'ansible_host=10.90.0.2 ip=10.90.0.2'),
             ('node2', 'ansible_host=10.90.0.3 ip=10.90.0.3')])
-        result = self.inv.exists_hostname(existing_hosts, hostname)
+        self.load_hosts(existing_hosts)
+        result = self.inv.exists_hostname(hostname)
         self.assertEqual(expected, result)
 
     def test_exists_ip_positive(self):
@@ -123,7 +148,8 @@ class TestInventory(unittest.TestCase):
         existing_hosts = OrderedDict([
             ('node1', 'ansible_host=10.90.0.2 ip=10.90.0.2'),
             ('node2', 'ansible_host=10.90.0.3 ip=10.90.0.3')])
-        result = self.inv.exists_ip(existing_hosts, ip)
+        self.load_hosts(existing_hosts)
+        result = self.inv.exists_ip(ip)
         self.assertEqual(expected, result)
 
     def test_exists_ip_negative(self):
@@ -132,7 +158,8 @@ class TestInventory(unittest.TestCase):
         existing_hosts = OrderedDict([
             ('node1', 'ansible_host=10.90.0.2 ip=10.90.0.2'),
             ('node2', 'ansible_host=10.90.0.3 ip=10.90.0.3')])
-        result = self.inv.exists_ip(existing_hosts, ip)
+        self.load_hosts(existing_hosts)
+        result = self.inv.exists_ip(ip)
         self.assertEqual(expected, result)
 
     def test_delete_host_by_ip_positive(self):
@@ -142,16 +169,19 @@ class TestInventory(unittest.TestCase):
         existing_hosts = OrderedDict([
             ('node1', 'ansible_host=10.90.0.2 ip=10.90.0.2'),
             ('node2', 'ansible_host=10.90.0.3 ip=10.90.0.3')])
-        self.inv.delete_host_by_ip(existing_hosts, ip)
-        self.assertEqual(expected, existing_hosts)
+        self.load_hosts(existing_hosts)
+        self.inv.delete_host_by_ip(ip)
+        self.assertEqual(expected, host_opts(self.inv.hosts))
+        self.assertFalse(self.inv.exists_ip(ip))
 
     def test_delete_host_by_ip_negative(self):
         ip = '10.90.0.200'
         existing_hosts = OrderedDict([
             ('node1', 'ansible_host=10.90.0.2 ip=10.90.0.2'),
             ('node2', 'ansible_host=10.90.0.3 ip=10.90.0.3')])
+        self.load_hosts(existing_hosts)
         self.assertRaisesRegexp(ValueError, "Unable to find host",
-                                self.inv.delete_host_by_ip, existing_hosts, ip)
+                                self.inv.delete_host_by_ip, ip)
 
     def test_purge_invalid_hosts(self):
         proper_hostnames = ['node1', 'node2']
@@ -160,34 +190,40 @@ class TestInventory(unittest.TestCase):
             ('node1', 'ansible_host=10.90.0.2 ip=10.90.0.2'),
             ('node2', 'ansible_host=10.90.0.3 ip=10.90.0.3'),
             ('doesnotbelong2', 'whateveropts=ilike')])
-        self.inv.config['all'] = existing_hosts
+        self.load_hosts(existing_hosts)
         self.inv.purge_invalid_hosts(proper_hostnames)
-        self.assertTrue(bad_host not in self.inv.config['all'].keys())
+        self.assertTrue(bad_host not in self.inv.hosts)
+        self.assertTrue(bad_host not in self.inv.build_config()['all'])
 
     def test_add_host_to_group(self):
         group = 'etcd'
         host = 'node1'
         opts = 'ip=10.90.0.2'
 
-        self.inv.add_host_to_group(group, host, opts)
-        self.assertEqual(self.inv.config[group].get(host), opts)
+        self.inv.add_host_to_group('all', host, opts)
+        self.inv.add_host_to_group(group, host)
+        self.assertEqual(self.inv.hosts[host].ip, '10.90.0.2')
+        self.assertTrue(self.inv.in_group(group, host))
+        self.assertEqual(self.inv.build_config()['all'].get(host), opts)
+        self.assertTrue(host in self.inv.build_config()[group])
 
     def test_set_kube_master(self):
         group = 'kube-master'
         host = 'node1'
 
         self.inv.set_kube_master([host])
-        self.assertTrue(host in self.inv.config[group])
+        self.assertTrue(self.inv.in_group(group, host))
 
     def test_set_all(self):
         group = 'all'
         hosts = OrderedDict([
-            ('node1', 'opt1'),
-            ('node2', 'opt2')])
+            ('node1', inventory.Host('node1', ip='10.90.0.2')),
+            ('node2', inventory.Host('node2', ip='10.90.0.3'))])
 
         self.inv.set_all(hosts)
-        for host, opt in hosts.items():
-            self.assertEqual(self.inv.config[group].get(host), opt)
+        for host, record in hosts.items():
+            self.assertTrue(self.inv.in_group(group, host))
+            self.assertEqual(self.inv.ip_index[record.ip], host)
 
     def test_set_k8s_cluster(self):
         group = 'k8s-cluster:children'
@@ -195,46 +231,211 @@ class TestInventory(unittest.TestCase):
 
         self.inv.set_k8s_cluster()
         for host in expected_hosts:
-            self.assertTrue(host in self.inv.config[group])
+            self.assertTrue(self.inv.in_group(group, host))
 
     def test_set_kube_node(self):
         group = 'kube-node'
         host = 'node1'
 
         self.inv.set_kube_node([host])
-        self.assertTrue(host in self.inv.config[group])
+        self.assertTrue(self.inv.in_group(group, host))
 
     def test_set_etcd(self):
         group = 'etcd'
         host = 'node1'
 
         self.inv.set_etcd([host])
-        self.assertTrue(host in self.inv.config[group])
+        self.assertTrue(self.inv.in_group(group, host))
 
     def test_scale_scenario_one(self):
         num_nodes = 50
         hosts = OrderedDict()
 
         for hostid in range(1, num_nodes+1):
-            hosts["node" + str(hostid)] = ""
+            hosts["node" + str(hostid)] = inventory.Host("node" + str(hostid))
 
         self.inv.set_all(hosts)
-        self.inv.set_etcd(hosts.keys()[0:3])
-        self.inv.set_kube_master(hosts.keys()[0:2])
+        self.inv.set_etcd(list(hosts.keys())[0:3])
+        self.inv.set_kube_master(list(hosts.keys())[0:2])
         self.inv.set_kube_node(hosts.keys())
         for h in range(3):
-            self.assertFalse(hosts.keys()[h] in self.inv.config['kube-node'])
+            self.assertFalse(
+                self.inv.in_group('kube-node', list(hosts.keys())[h]))
 
     def test_scale_scenario_two(self):
         num_nodes = 500
         hosts = OrderedDict()
 
         for hostid in range(1, num_nodes+1):
-            hosts["node" + str(hostid)] = ""
+            hosts["node" + str(hostid)] = inventory.Host("node" + str(hostid))
 
         self.inv.set_all(hosts)
-        self.inv.set_etcd(hosts.keys()[0:3])
-        self.inv.set_kube_master(hosts.keys()[3:5])
+        self.inv.set_etcd(list(hosts.keys())[0:3])
+        self.inv.set_kube_master(list(hosts.keys())[3:5])
         self.inv.set_kube_node(hosts.keys())
         for h in range(5):
-            self.assertFalse(hosts.keys()[h] in self.inv.config['kube-node'])
+            self.assertFalse(
+                self.inv.in_group('kube-node', list(hosts.keys())[h]))
+
+    def test_host_opts_round_trip(self):
+        optstring = ("ansible_host=10.90.0.2 ip=10.90.0.2 "
+                     "flags='--a --b' labels=a=b,c=d")
+        host = inventory.Host.from_opts('node1', optstring)
+        self.assertEqual('10.90.0.2', host.ip)
+        self.assertEqual('10.90.0.2', host.ansible_host)
+        self.assertEqual(OrderedDict([('flags', '--a --b'),
+                                      ('labels', 'a=b,c=d')]), host.hostvars)
+        self.assertEqual(host, inventory.Host.from_opts('node1',
+                                                        host.opts()))
+
+    @mock.patch('inventory.sys')
+    def test_write_and_read_config(self, sys_mock):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        config_file = os.path.join(tmpdir, 'hosts.ini')
+        self.inv.build_hostnames(self.data)
+        self.inv.hosts['node1'].hostvars['flags'] = '--a --b'
+        self.inv.set_etcd(['node1'])
+        self.inv.set_k8s_cluster()
+        self.inv.write_config(config_file)
+
+        inv = inventory.KubesprayInventory(None, config_file)
+        self.assertEqual(list(self.inv.hosts.values()),
+                         list(inv.hosts.values()))
+        self.assertTrue(inv.in_group('k8s-cluster:children', 'kube-node'))
+        self.assertEqual(self.inv.ip_index, inv.ip_index)
+
+    def test_load_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        files = {'hosts.csv': 'hostname,ip,groups,flags\n'
+                              'node1,10.90.0.2,kube-node;etcd,--a --b\n'
+                              'node2,10.90.0.3,kube-node,\n',
+                 'hosts.jsonl': '{"hostname": "node3", "ip": "10.90.0.4", '
+                                '"groups": ["kube-master"]}\n\n',
+                 'hosts.yml': 'kube-master:\n'
+                              '  node1:\n'
+                              '    ip: 10.90.0.2\n'
+                              '    access_ip: 192.168.0.2\n'}
+        for name, content in files.items():
+            with open(os.path.join(tmpdir, name), 'w') as f:
+                f.write(content)
+
+        with mock.patch.object(self.inv, 'write_config') as write_config:
+            self.inv.load_file([os.path.join(tmpdir, name)
+                                for name in sorted(files)])
+        write_config.assert_called_once_with(self.inv.config_file)
+
+        self.assertEqual(OrderedDict([
+            ('node1', "ansible_host=10.90.0.2 ip=10.90.0.2 "
+                      "access_ip=192.168.0.2 flags='--a --b'"),
+            ('node2', 'ansible_host=10.90.0.3 ip=10.90.0.3'),
+            ('node3', 'ansible_host=10.90.0.4 ip=10.90.0.4')]),
+            host_opts(self.inv.hosts))
+        self.assertEqual(set(['kube-node', 'etcd', 'kube-master']),
+                         self.inv.hosts['node1'].roles)
+        self.assertEqual(set(['kube-node']), self.inv.hosts['node2'].roles)
+        self.assertEqual(set(['kube-master']), self.inv.hosts['node3'].roles)
+
+    def test_place_spreads_across_zones_and_racks(self):
+        topology = [('a', 'r1', 8), ('a', 'r1', 16), ('a', 'r2', 8),
+                    ('b', 'r3', 8), ('b', 'r3', 8), ('c', 'r4', 8)]
+        for hostid, (zone, rack, capacity) in enumerate(topology, 1):
+            self.inv.add_host(inventory.Host(
+                'node{0}'.format(hostid), ip='10.90.0.{0}'.format(hostid),
+                hostvars=[('zone', zone), ('rack', rack),
+                          ('capacity', str(capacity))]))
+        hosts = list(self.inv.hosts.keys())
+
+        self.assertEqual(['node2', 'node4', 'node6'],
+                         self.inv.place(hosts, 3, 'etcd'))
+        self.assertEqual(['node2', 'node4', 'node6', 'node3', 'node5'],
+                         self.inv.place(hosts, 5, 'etcd'))
+
+    def test_place_keeps_current_members(self):
+        for hostid in range(1, 5):
+            self.inv.add_host(inventory.Host(
+                'node{0}'.format(hostid), ip='10.90.0.{0}'.format(hostid),
+                hostvars=[('zone', 'a' if hostid < 3 else 'b')]))
+        hosts = list(self.inv.hosts.keys())
+        self.assertEqual(['node1', 'node3'],
+                         self.inv.place(hosts, 2, 'kube-master'))
+        self.inv.set_kube_master(['node2'])
+
+        self.assertEqual(['node2', 'node3'],
+                         self.inv.place(hosts, 2, 'kube-master'))
+
+    def test_sizing(self):
+        for hostid in range(1, 601):
+            self.inv.add_host(inventory.Host('node{0}'.format(hostid)))
+        tier = self.inv.sizing()
+        self.assertEqual((5, 5, 3), (tier['etcd'], tier['kube-master'],
+                                     tier['calico-rr']))
+        self.assertTrue(tier['separate_etcd'] and tier['separate_master'])
+
+        self.inv.place_roles()
+        report = self.inv.sizing_report(tier)
+        self.assertTrue('600 hosts >= 500' in report)
+        self.assertTrue('kube-master: 5 of 5 wanted, dedicated' in report)
+        self.assertTrue('calico-rr: 3 of 3 wanted, shared with etcd' in report)
+        self.assertFalse(self.inv.in_group('kube-node', 'node1'))
+
+    def test_sizing_by_capacity(self):
+        for hostid in range(1, 11):
+            self.inv.add_host(inventory.Host(
+                'node{0}'.format(hostid), hostvars=[('capacity', '400')]))
+        tier = self.inv.sizing()
+        self.assertEqual((5, 3, 3), (tier['etcd'], tier['kube-master'],
+                                     tier['calico-rr']))
+        self.assertEqual('capacity 4000 >= 3200', tier['reason'])
+
+    def test_sizing_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        sizing_file = os.path.join(tmpdir, 'sizing.yml')
+        with open(sizing_file, 'w') as f:
+            f.write('- {min_nodes: 0, etcd: 1, kube-master: 1}\n'
+                    '- {min_nodes: 3, etcd: 4}\n')
+        for hostid in range(1, 4):
+            self.inv.add_host(inventory.Host('node{0}'.format(hostid)))
+
+        with mock.patch('inventory.SIZING_FILE', sizing_file):
+            self.assertRaisesRegexp(Exception, "odd number",
+                                    self.inv.sizing)
+            self.inv.delete_host('node3')
+            tier = self.inv.sizing()
+        self.assertEqual((1, 1, 0), (tier['etcd'], tier['kube-master'],
+                                     tier['calico-rr']))
+
+    @mock.patch('inventory.sys')
+    def test_vars_and_role_only_hosts_kept(self, sys_mock):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        config_file = os.path.join(tmpdir, 'hosts.ini')
+        with open(config_file, 'w') as f:
+            f.write('[all]\n'
+                    'node1 ansible_host=10.90.0.1 ip=10.90.0.1\n'
+                    'node2 ansible_host=10.90.0.2 ip=10.90.0.2\n\n'
+                    '[all:vars]\nansible_user=Ubuntu\n\n'
+                    '[calico-rr]\nrr0\n\n'
+                    '[rack0]\nrr0\nnode2\n\n'
+                    '[rack0:vars]\ncluster_id="1.0.0.1"\n')
+
+        inv = inventory.KubesprayInventory(None, config_file)
+        self.assertEqual(['node1', 'node2'], list(inv.hosts))
+        self.assertTrue(inv.in_group('rack0', 'node2'))
+        self.assertTrue(inv.in_group('calico-rr', 'rr0'))
+        config = inventory.inventory_config()
+        config.read(config_file)
+        self.assertEqual(['ansible_user=Ubuntu'], config.options('all:vars'))
+        self.assertEqual(['rr0'], config.options('calico-rr'))
+
+        inv = inventory.KubesprayInventory(['10.90.0.3'], config_file)
+        self.assertEqual(['node1', 'node2', 'node3'], list(inv.hosts))
+        config = inventory.inventory_config()
+        config.read(config_file)
+        self.assertEqual(['node1', 'node2', 'node3'], config.options('all'))
+        self.assertEqual(['ansible_user=Ubuntu'], config.options('all:vars'))
+        self.assertEqual(['cluster_id="1.0.0.1"'],
+                         config.options('rack0:vars'))
+        self.assertEqual(['node2'], config.options('rack0'))
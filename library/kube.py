@@ -6,14 +6,15 @@ DOCUMENTATION = """
 module: kube
 short_description: Manage Kubernetes Cluster
 description:
-  - Create, replace, remove, and stop resources within a Kubernetes Cluster
+  - Create, replace, remove, and scale resources within a Kubernetes Cluster
 version_added: "2.0"
 options:
   name:
     required: false
     default: null
     description:
-      - The name associated with resource
+      - The name associated with resource. Several names can be given as a
+        comma separated list.
   filename:
     required: false
     default: null
@@ -21,6 +22,17 @@ options:
       - The path and filename of the resource(s) definition file(s).
       - To operate on several files this can accept a comma separated list of files or a list of files.
     aliases: [ 'files', 'file', 'filenames' ]
+  definition:
+    required: false
+    default: null
+    description:
+      - Inline resource definition, used instead of filename. Either an
+        object, a list of objects or (multi-document) YAML text, e.g. the
+        output of a template lookup, so no manifest has to be written on the
+        master. kubectl reads it from stdin, the api engine sends the objects
+        directly.
+      - Without PyYAML on the target only YAML text can be given, and it is
+        always applied (see notes).
   kubectl:
     required: false
     default: null
@@ -36,6 +48,9 @@ options:
     default: null
     description:
       - The resource to perform an action on. pods (po), replicationControllers (rc), services (svc)
+      - Several resources can be given as a comma separated list, e.g. deploy,svc.
+        Existence checks list every resource once per namespace instead of
+        getting every object.
   label:
     required: false
     default: null
@@ -46,33 +61,178 @@ options:
     default: null
     description:
       - The url for the API server that commands are executed against.
+  kubeconfig:
+    required: false
+    default: null
+    description:
+      - The kubeconfig file used to reach the API server. Defaults to
+        C($KUBECONFIG) or C(~/.kube/config).
+  cache_dir:
+    required: false
+    default: null
+    description:
+      - Directory of the discovery cache shared by consecutive kube tasks.
+        Passed to kubectl as --cache-dir, which keeps its discovery and
+        OpenAPI cache there. The api engine writes the discovery documents
+        to C(<cache_dir>/discovery/<host>_<port>.json), defaulting to
+        C(~/.kube/cache), and discards them when the server version changes
+        or a kind cannot be found in them.
+  engine:
+    required: false
+    choices: ['kubectl', 'api']
+    default: kubectl
+    description:
+      - kubectl runs one kubectl process per operation.
+      - api talks to the API server directly over a single keep-alive
+        connection and caches the discovery documents on disk, see
+        cache_dir. It requires PyYAML on the target and falls back to kubectl when
+        the kubeconfig cannot be loaded.
+  session:
+    required: false
+    default: false
+    description:
+      - With engine=api, send the requests through a session proxy shared by
+        the kube tasks that use the same server and credentials, e.g. the
+        items of a loop delegated to a master. The first task starts it as a
+        background process listening on a unix socket in
+        C(<cache_dir>/sessions), readable only by its owner, and the proxy
+        keeps its keep-alive connections to the API server open so later
+        tasks skip the TCP and TLS handshakes. Watches connect directly.
+  session_timeout:
+    required: false
+    default: 300
+    description:
+      - Seconds the session proxy waits for a request before it exits.
   force:
     required: false
     default: false
     description:
-      - A flag to indicate to force delete, replace, or stop.
+      - A flag to indicate to force delete or replace.
   all:
     required: false
     default: false
     description:
-      - A flag to indicate delete all, stop all, or all namespaces when checking exists.
+      - A flag to indicate delete all, scale all, or all namespaces when checking exists.
   log_level:
     required: false
     default: 0
     description:
       - Indicates the level of verbosity of logging by kubectl.
+  items:
+    required: false
+    default: null
+    description:
+      - A list of resources to apply in a single task call. Each entry is a
+        dict with a required C(filename) and optional C(name), C(resource) and
+        C(namespace) keys (C(file) and C(type) are accepted as aliases).
+      - Entries are grouped by namespace and every group is applied with one
+        kubectl invocation. A per-entry status is returned in C(item_results).
+      - Only valid with state present, latest or reloaded.
+  parallelism:
+    required: false
+    default: 1
+    description:
+      - Number of workers applying files concurrently when filename holds
+        several files. Files are applied in phases, namespaces and CRDs
+        first, then RBAC and configuration, then workloads; a phase only
+        starts when the previous one succeeded. Requires PyYAML.
+  wait:
+    required: false
+    default: false
+    description:
+      - Wait until the applied resources are ready before returning.
+        Deployments must have all replicas updated and available, DaemonSets
+        and StatefulSets must be rolled out, Jobs must complete and Pods must
+        be Ready. A failed Job or Pod fails the task right away.
+      - The api engine watches the resources, one watch per kind and
+        namespace; the kubectl engine polls them with one kubectl get per
+        round. Both back off exponentially between rounds.
+  wait_condition:
+    required: false
+    default: null
+    description:
+      - Instead of the per kind rules, wait for this status condition to be
+        True, e.g. Available or Established.
+  wait_timeout:
+    required: false
+    default: 300
+    description:
+      - Overall number of seconds to wait for all resources.
+  wait_max_unavailable:
+    required: false
+    default: null
+    description:
+      - Number or percentage (e.g. 2%) of the replicas or pods of every
+        Deployment, DaemonSet, StatefulSet or ReplicaSet that may still be
+        outdated or unavailable for the rollout to count as done, so a few
+        broken nodes do not hold up a CNI DaemonSet on a large cluster.
+  prune:
+    required: false
+    default: false
+    description:
+      - With state present, latest or reloaded, delete the objects matching
+        label that an earlier apply created but that are no longer in
+        filename, definition or items. Only the kinds listed in resource, or
+        else the kinds of the applied manifests, are considered. Objects
+        without the last-applied annotation, i.e. not created by an apply,
+        are never pruned. Namespaced kinds are only looked up in the
+        namespaces of the applied namespaced objects. Requires label and
+        PyYAML.
+  replicas:
+    required: false
+    default: null
+    description:
+      - Number of replicas for state=scaled. Workloads are selected by
+        filename, by resource and name, or by resource and label (or all)
+        across many workloads at once; named workloads that do not exist are
+        skipped. Every workload is scaled through its scale subresource
+        unless it already runs replicas.
+      - With wait, the task waits until the controllers have observed the new
+        count and all replicas are ready or terminated.
+  retries:
+    required: false
+    default: 3
+    description:
+      - Number of times a request failing with a transient error is retried
+        inside the task: connection errors, throttling (429), server errors
+        (5xx, e.g. during an etcd leader election or an apiserver restart)
+        and update conflicts, which re-read the object first.
+  retry_delay:
+    required: false
+    default: 0.5
+    description:
+      - Initial backoff in seconds between retries. It doubles with every
+        retry, up to retry_max_delay, and is jittered.
+  retry_max_delay:
+    required: false
+    default: 10
+    description:
+      - Upper bound in seconds of the backoff between retries.
   state:
     required: false
-    choices: ['present', 'absent', 'latest', 'reloaded', 'stopped']
+    choices: ['present', 'absent', 'latest', 'reloaded', 'scaled', 'stopped']
     default: present
     description:
       - present handles checking existence or creating if definition file provided,
         absent handles deleting resource(s) based on other options,
         latest handles creating or updating based on existence,
         reloaded handles updating resource(s) definition using definition file,
-        stopped handles stopping resource(s) based on other options.
+        scaled sets the replicas of resource(s) based on other options,
+        stopped scales resource(s) down to 0 replicas.
+notes:
+  - With state present, latest or reloaded, objects whose manifest matches
+    the last-applied configuration of the live object are not written again
+    and C(changed) only reflects objects that were created or updated.
+    Detecting unchanged objects with the kubectl engine requires PyYAML.
+  - Check mode is supported. Applies are planned against the live objects,
+    read with one call per file batch, and rendered by the API server with a
+    server side dry run when the server (and kubectl) are 1.13 or newer;
+    older servers ignore the dry run flag, so the change is merged locally
+    instead. One diff per file is returned, shown with --diff. Deletes and
+    scales only report the objects they would touch. Requires PyYAML.
 requirements:
   - kubectl
+  - PyYAML (for engine=api)
 author: "Kenny Jones (@kenjones-cisco)"
 """
 
@@ -83,12 +243,39 @@ EXAMPLES = """
 - name: test nginx is stopped
   kube: name=nginx resource=rc state=stopped
 
+- name: apply the DNS addon and remove the objects it no longer ships
+  kube:
+    namespace: kube-system
+    filename: "{{ dns_manifests }}"
+    resource: deploy,svc,configmap,sa
+    label: k8s-app=kube-dns
+    prune: true
+    state: latest
+
+- name: scale the DNS and ingress addons down for an upgrade
+  kube:
+    namespace: kube-system
+    resource: deploy,sts
+    label: kubespray.io/upgrade-drain=true
+    replicas: 0
+    state: scaled
+    wait: true
+
 - name: test nginx is absent
   kube: name=nginx resource=rc state=absent
 
 - name: test nginx is present
   kube: filename=/tmp/nginx.yml
 
+- name: remove the coredns deployment, configmap and service
+  kube: name=coredns namespace=kube-system resource=deploy,configmap,svc state=absent
+
+- name: render and apply the coredns manifests in one task
+  kube:
+    namespace: kube-system
+    definition: "{{ lookup('template', 'coredns-deployment.yml.j2') }}"
+    state: latest
+
 - name: test nginx and postgresql are present
   kube: files=/tmp/nginx.yml,/tmp/postgresql.yml
 
@@ -97,102 +284,1147 @@ EXAMPLES = """
     files:
       - /tmp/nginx.yml
       - /tmp/postgresql.yml
+
+- name: test nginx is present, talking to the API server directly
+  kube:
+    engine: api
+    filename: /tmp/nginx.yml
+    state: latest
+
+- name: label the nodes, reusing the API server connections across items
+  kube:
+    engine: api
+    session: true
+    definition:
+      apiVersion: v1
+      kind: Node
+      metadata:
+        name: "{{ item }}"
+        labels:
+          node-role.kubernetes.io/node: "true"
+    state: present
+  with_items: "{{ groups['kube-node'] }}"
+  delegate_to: "{{ groups['kube-master'][0] }}"
+
+- name: start tiller and wait for its deployment to be available
+  kube:
+    name: tiller-deploy
+    namespace: kube-system
+    resource: deploy
+    filename: /etc/kubernetes/tiller.yml
+    state: latest
+    wait: true
+    wait_timeout: 120
+
+- name: bring up an addon made of many manifests with 4 workers
+  kube:
+    filename: "{{ efk_manifests }}"
+    parallelism: 4
+    state: latest
+
+- name: apply several manifests with one kubectl call per namespace
+  kube:
+    kubectl: /usr/local/bin/kubectl
+    namespace: kube-system
+    state: latest
+    items:
+      - { name: kube-dns, resource: sa, filename: /etc/kubernetes/kubedns-sa.yml }
+      - { name: kube-dns, resource: deploy, filename: /etc/kubernetes/kubedns-deploy.yml }
+      - { name: netchecker-server, resource: svc, filename: /etc/kubernetes/netchecker-server-svc.yml, namespace: default }
 """
 
+RETURN = """
+objects:
+  description: Every object the task created, updated, left unchanged or
+    deleted, with the time and number of API requests it took. Objects
+    handled by one kubectl call share its duration_ms; api_calls is only
+    known with engine=api.
+  returned: always
+  type: list
+  sample:
+    - kind: deployment
+      namespace: kube-system
+      name: coredns
+      action: configured
+      duration_ms: 41
+      api_calls: 2
+rollout:
+  description: With wait, how long the rollout took overall and, for every
+    object, its final state and the seconds it took to become ready, the
+    slowest last.
+  returned: when wait is set
+  type: dict
+  sample:
+    duration_s: 312.4
+    objects:
+      - kind: daemonset
+        namespace: kube-system
+        name: calico-node
+        state: ready
+        message: 498 of 500 pods available
+        ready_after_s: 311.9
+"""
+
+import json
+import re
+import ssl
+import time
+from multiprocessing.pool import ThreadPool
+
+# Short names accepted by kubectl for the resource kinds used in this repo,
+# and plurals that resource_kind cannot singularize by dropping a suffix,
+# used when the API discovery does not know a resource name.
+RESOURCE_ALIASES = {
+    'alertmanagers': 'alertmanager',
+    'cm': 'configmap',
+    'crd': 'customresourcedefinition',
+    'cronjob': 'cronjob',
+    'deploy': 'deployment',
+    'ds': 'daemonset',
+    'ep': 'endpoints',
+    'ing': 'ingress',
+    'no': 'node',
+    'ns': 'namespace',
+    'pdb': 'poddisruptionbudget',
+    'po': 'pod',
+    'prometheus': 'prometheus',
+    'prometheuses': 'prometheus',
+    'psp': 'podsecuritypolicy',
+    'pv': 'persistentvolume',
+    'pvc': 'persistentvolumeclaim',
+    'rc': 'replicationcontroller',
+    'rs': 'replicaset',
+    'sa': 'serviceaccount',
+    'sc': 'storageclass',
+    'statuses': 'status',
+    'sts': 'statefulset',
+    'svc': 'service',
+}
+
+# Matches both `deployment.apps "name" configured` and
+# `deployment.apps/name configured` styles of kubectl apply output.
+APPLY_LINE_RE = re.compile(r'^(?P<kind>[\w.-]+)(?:/| ")(?P<name>[^"\s]+)"? (?P<verb>\w+)')
+
+# Kinds other manifests depend on, applied before everything else (workloads)
+# when several files are applied in parallel.
+APPLY_PHASES = [
+    ('Namespace', 'CustomResourceDefinition'),
+    ('ServiceAccount', 'Secret', 'ConfigMap', 'ClusterRole', 'ClusterRoleBinding',
+     'Role', 'RoleBinding', 'PodSecurityPolicy', 'PriorityClass', 'StorageClass',
+     'PersistentVolume', 'PersistentVolumeClaim', 'LimitRange', 'ResourceQuota'),
+]
+
+# kubectl errors worth retrying: the API server or etcd is briefly unavailable
+# or throttling, or an update conflicted with a concurrent writer (kubectl
+# re-reads the object on the next run).
+RETRYABLE_KUBECTL_RE = re.compile(
+    r'connection refused|connection reset|i/o timeout|TLS handshake timeout|unexpected EOF|'
+    r'Unable to connect to the server|the server is currently unable to handle the request|'
+    r'Too many requests|Internal error occurred|etcdserver: (leader changed|request timed out)|'
+    r'the object has been modified|unable to return a response in the time allotted',
+    re.IGNORECASE)
+
+# Stands for the inline definition wherever a filename is expected; kubectl
+# reads it from stdin.
+STDIN = '-'
+
+# Cascade to dependents in the background, like kubectl delete does.
+DELETE_OPTIONS = {'kind': 'DeleteOptions', 'apiVersion': 'v1',
+                  'propagationPolicy': 'Background'}
+
+
+def normalize_kind(kind):
+    """Returns the lower case kind of a manifest kind or of a kind.group
+    printed by kubectl."""
+    if not kind:
+        return None
+    return kind.lower().split('.')[0]
+
+
+def resource_kind(resource):
+    """Returns the lower case singular kind for a kubectl resource name
+    given by the user, such as deploy or daemonsets."""
+    kind = normalize_kind(resource)
+    if not kind:
+        return None
+    if kind in RESOURCE_ALIASES:
+        return RESOURCE_ALIASES[kind]
+    if kind == 'endpoints' or kind.endswith('ss'):
+        return kind
+    if kind.endswith('ies'):
+        return kind[:-3] + 'y'
+    if kind.endswith('sses'):
+        return kind[:-2]
+    if kind.endswith('s'):
+        return kind[:-1]
+    return kind
+
+
+def apply_phase(kind):
+    for phase, kinds in enumerate(APPLY_PHASES):
+        if kind in kinds:
+            return phase
+    return len(APPLY_PHASES)
+
+
+def apply_phases(filenames):
+    """Groups filenames into the phases they have to be applied in.
+
+    A file belongs to the earliest phase of any object it defines; the order
+    of the files inside a phase is kept.
+    """
+    phases = [[] for _ in range(len(APPLY_PHASES) + 1)]
+    for filename in filenames:
+        kinds = [obj.get('kind') for obj in load_manifests([filename])]
+        phases[min([apply_phase(k) for k in kinds] or [len(APPLY_PHASES)])].append(filename)
+    return [phase for phase in phases if phase]
+
+
+def kubectl_error(args, rc, out, err):
+    """Returns the message reporting a kubectl command that exited with rc."""
+    return 'error running kubectl (%s) command (rc=%d), out=\'%s\', err=\'%s\'' % (
+        ' '.join(args), rc, out, err)
+
+
+def parse_json_objects(out):
+    """Returns the objects printed by kubectl -o json: a single object, the
+    items of a List or, as kubectl apply prints them, one document per
+    object."""
+    decoder = json.JSONDecoder()
+    out = out.strip()
+    objects, pos = [], 0
+    while pos < len(out):
+        obj, pos = decoder.raw_decode(out, pos)
+        while pos < len(out) and out[pos].isspace():
+            pos += 1
+        if obj.get('kind') == 'List':
+            objects.extend(obj.get('items') or [])
+        else:
+            objects.append(obj)
+    return objects
+
+
+def elapsed_ms(start):
+    return int((time.time() - start) * 1000)
+
+
+def parse_apply_output(lines):
+    """Parses kubectl apply output into (kind, name, verb) tuples."""
+    parsed = []
+    for line in lines:
+        match = APPLY_LINE_RE.match(line.strip())
+        if match:
+            parsed.append((normalize_kind(match.group('kind')),
+                           match.group('name'), match.group('verb')))
+    return parsed
+
+
+class ResourceIndex(object):
+    """In-memory index of live objects keyed by (kind, namespace, name).
+
+    list_func(kinds, namespace) is called at most once per kind and namespace
+    and must return the live objects of those kinds.
+    """
+
+    def __init__(self, list_func):
+        self.list_func = list_func
+        self.loaded = set()
+        self.objects = {}
+
+    def load(self, kinds, namespace):
+        kinds = [normalize_kind(k) for k in kinds]
+        missing = sorted(set(k for k in kinds if (k, namespace) not in self.loaded))
+        if not missing:
+            return
+        for obj in self.list_func(missing, namespace):
+            meta = obj.get('metadata', {})
+            key = (normalize_kind(obj.get('kind')), meta.get('name'))
+            self.objects.setdefault(key, {})[meta.get('namespace')] = obj
+        self.loaded.update((k, namespace) for k in missing)
+
+    def clear(self):
+        self.loaded.clear()
+        self.objects.clear()
+
+    def get(self, kind, namespace, name):
+        kind = normalize_kind(kind)
+        self.load([kind], namespace)
+        found = self.objects.get((kind, name)) or {}
+        if namespace is None or None in found:
+            return next(iter(found.values()), None)
+        return found.get(namespace)
+
 
 class KubeManager(object):
 
     def __init__(self, module):
 
         self.module = module
+        self.retries = module.params.get('retries') or 0
+        self.retry_delay = module.params.get('retry_delay') or 0.5
+        self.retry_max_delay = module.params.get('retry_max_delay') or 10
+
+        self.client = None
+        if module.params.get('engine') == 'api':
+            self.client = self._api_client()
 
         self.kubectl = module.params.get('kubectl')
         if self.kubectl is None:
-            self.kubectl =  module.get_bin_path('kubectl', True)
+            self.kubectl =  module.get_bin_path('kubectl', self.client is None)
         self.base_cmd = [self.kubectl]
 
+        if module.params.get('kubeconfig'):
+            self.base_cmd.append('--kubeconfig=' + module.params.get('kubeconfig'))
+
         if module.params.get('server'):
             self.base_cmd.append('--server=' + module.params.get('server'))
 
+        if module.params.get('cache_dir'):
+            self.base_cmd.append('--cache-dir=' + module.params.get('cache_dir'))
+
         if module.params.get('log_level'):
             self.base_cmd.append('--v=' + str(module.params.get('log_level')))
 
-        if module.params.get('namespace'):
-            self.base_cmd.append('--namespace=' + module.params.get('namespace'))
-
+        self.namespace = module.params.get('namespace')
         self.all = module.params.get('all')
         self.force = module.params.get('force')
         self.name = module.params.get('name')
+        self.names = [n.strip() for n in (self.name or '').split(',') if n.strip()]
         self.filename = [f.strip() for f in module.params.get('filename') or []]
+        self.definition, self.definition_text = None, None
+        if module.params.get('definition'):
+            try:
+                self.definition, self.definition_text = load_definition(module.params.get('definition'))
+            except Exception as exc:
+                module.fail_json(msg='error parsing definition: %s' % str(exc))
+            self.filename = [STDIN]
         self.resource = module.params.get('resource')
+        self.resources = [r.strip() for r in (self.resource or '').split(',') if r.strip()]
         self.label = module.params.get('label')
+        self.index = ResourceIndex(self._list_kinds)
+        self.results = []
+        self.check_mode = module.check_mode
+        self.diffs = []
+        self._dry_run_flag = None
+        self._api_resources = None
+        self.items = module.params.get('items') or []
+        self.wait_condition = module.params.get('wait_condition')
+        self.wait_timeout = module.params.get('wait_timeout') or 300
+        self.max_unavailable = module.params.get('wait_max_unavailable')
+        self.ready_times = {}
+        self.rollout = None
+        self.parallelism = module.params.get('parallelism') or 1
+        if self.parallelism < 1:
+            module.fail_json(msg='parallelism must be at least 1')
+
+    def _api_client(self):
+        if not HAS_YAML:
+            self.module.warn('PyYAML is required by the api engine, falling back to kubectl')
+            return None
+        try:
+            config, basedir = read_kubeconfig(self.module.params.get('kubeconfig'))
+            cache_dir = self.module.params.get('cache_dir') or DEFAULT_CACHE_DIR
+            client = KubeApiClient.from_kubeconfig(
+                config, basedir, server=self.module.params.get('server'),
+                cache_dir=cache_dir, retries=self.retries,
+                backoff=self.retry_delay, max_backoff=self.retry_max_delay)
+        except (IOError, OSError, ValueError, KeyError, ssl.SSLError) as exc:
+            self.module.warn('unable to load kubeconfig for the api engine, '
+                             'falling back to kubectl: %s' % str(exc))
+            return None
+        if self.module.params.get('session') and not client.use_session(
+                cache_dir, self.module.params.get('session_timeout') or DEFAULT_SESSION_TIMEOUT):
+            self.module.warn('unable to start the session proxy, connecting to the API server directly')
+        return client
+
+    def _api_fail(self, action, exc):
+        self.module.fail_json(msg='error %s through the API server (%s): %s' % (
+            action, self.client.server, str(exc)))
+
+    def _record(self, kind, namespace, name, action, duration_ms, api_calls=None):
+        self.results.append({'kind': normalize_kind(kind), 'namespace': namespace,
+                             'name': name, 'action': action,
+                             'duration_ms': duration_ms, 'api_calls': api_calls})
+
+    def _api_apply(self, filenames, namespace=None):
+        lines = []
+        for obj in self._manifests(filenames):
+            start, calls = time.time(), self.client.thread_calls()
+            verb = self.client.apply(obj, namespace or self.namespace)
+            meta = obj['metadata']
+            self._record(obj['kind'], meta.get('namespace') or namespace or self.namespace,
+                         meta['name'], verb, elapsed_ms(start),
+                         self.client.thread_calls() - calls)
+            lines.append('%s/%s %s' % (obj['kind'].lower(), meta['name'], verb))
+        return lines
+
+    def _api_selected(self, list_all=False):
+        """Returns (resource, namespace, name) of the objects selected by the
+        resource, label and all options."""
+        namespace = None if self.all and list_all else self.namespace or 'default'
+        selected = []
+        for resource in [self.client.resource_for_name(r) for r in self.resources]:
+            selected.extend((resource, obj['metadata'].get('namespace'), obj['metadata']['name'])
+                            for obj in self.client.list(resource, namespace, self.label))
+        return selected
+
+    def _list_kinds(self, kinds, namespace, selector=None):
+        if self.client:
+            found = []
+            for kind in kinds:
+                resource = self.client.resource_for_name(kind)
+                found.extend(self.client.list(resource, (namespace or 'default')
+                                              if resource.get('namespaced') else None,
+                                              selector))
+            return found
+
+        cmd = ['get', ','.join(kinds), '-o', 'json']
+        if selector:
+            cmd.append('--selector=' + selector)
+        rc, out, err = self._run(self._args(cmd, namespace=namespace))
+        if rc != 0:
+            raise Exception('unable to list %s: %s' % (','.join(kinds), err))
+        return parse_json_objects(out)
+
+    def _named_targets(self):
+        """Returns (kind, namespace, name) of every object addressed by name,
+        either through filename or through resource and name, or None when
+        objects are selected by label or all."""
+        if self.filename:
+            if not HAS_YAML:
+                return None
+            try:
+                return [(obj['kind'], obj['metadata'].get('namespace') or self.namespace,
+                         obj['metadata']['name'])
+                        for obj in self._manifests(self.filename)]
+            except Exception:
+                return None
+        if self.resources and self.names and not self.label and not self.all:
+            return [(self._resource_kind(resource), self.namespace, name)
+                    for resource in self.resources for name in self.names]
+        return None
+
+    def _existing(self, targets):
+        """Filters targets down to the objects that exist, listing every kind
+        once per namespace. Returns None when the lookup fails."""
+        try:
+            for namespace in set(t[1] for t in targets):
+                self.index.load([t[0] for t in targets if t[1] == namespace], namespace)
+            return [t for t in targets if self.index.get(*t) is not None]
+        except Exception:
+            return None
+
+    def _delete_targets(self, targets):
+        self.index.clear()
+        if self.client:
+            lines = []
+            try:
+                for kind, namespace, name in targets:
+                    start, calls = time.time(), self.client.thread_calls()
+                    resource = self.client.resource_for_name(kind)
+                    if self.client.delete(resource, name, namespace or 'default',
+                                          body=DELETE_OPTIONS) is not None:
+                        self._record(kind, namespace, name, 'deleted', elapsed_ms(start),
+                                     self.client.thread_calls() - calls)
+                        lines.append('%s "%s" deleted' % (resource['kind'].lower(), name))
+            except Exception as exc:
+                self._api_fail('deleting', exc)
+            return lines
+
+        lines = []
+        for namespace in sorted(set(t[1] for t in targets), key=str):
+            objects = ['%s/%s' % (normalize_kind(kind), name)
+                       for kind, ns, name in targets if ns == namespace]
+            # A retried delete must not fail on the objects already gone.
+            args = self._args(['delete', '--ignore-not-found'] + objects, namespace=namespace)
+            start = time.time()
+            rc, out, err = self._run(args)
+            if rc != 0:
+                self.module.fail_json(msg=kubectl_error(args, rc, out, err))
+            for kind, name, verb in parse_apply_output(out.splitlines()):
+                self._record(kind, namespace, name, verb, elapsed_ms(start))
+            lines.extend(out.splitlines())
+        return lines
+
+    def _api_delete(self):
+        """Deletes the objects selected by label or all, with one
+        deletecollection call per resource."""
+        self.index.clear()
+        lines = []
+        try:
+            for resource in [self.client.resource_for_name(r) for r in self.resources]:
+                start, calls = time.time(), self.client.thread_calls()
+                deleted = self.client.delete_collection(
+                    resource, self.namespace or 'default', self.label, body=DELETE_OPTIONS)
+                for obj in deleted:
+                    self._record(resource['kind'], obj['metadata'].get('namespace'),
+                                 obj['metadata']['name'], 'deleted', elapsed_ms(start),
+                                 self.client.thread_calls() - calls)
+                lines.extend('%s "%s" deleted' % (resource['kind'].lower(), obj['metadata']['name'])
+                             for obj in deleted)
+        except Exception as exc:
+            self._api_fail('deleting', exc)
+        return lines
+
+    def _manifests(self, filenames):
+        """load_manifests that also understands STDIN, the inline definition."""
+        objects = []
+        for filename in filenames:
+            if filename == STDIN:
+                if self.definition is None:
+                    raise Exception('PyYAML is required to read definition')
+                objects.extend(json.loads(json.dumps(self.definition)))
+            else:
+                objects.extend(load_manifests([filename]))
+        return objects
+
+    def _run(self, args):
+        """Runs a kubectl command, feeding it the inline definition when it
+        reads --filename=- (STDIN).
+
+        Failures matching RETRYABLE_KUBECTL_RE are retried up to retries
+        times with jittered exponential backoff; every kubectl command the
+        module runs is idempotent.
+        """
+        attempt = 0
+        while True:
+            if '--filename=' + STDIN in args:
+                rc, out, err = self.module.run_command(args, data=self.definition_text)
+            else:
+                rc, out, err = self.module.run_command(args)
+            if rc == 0 or attempt >= self.retries or not RETRYABLE_KUBECTL_RE.search(err or ''):
+                return rc, out, err
+            time.sleep(retry_delay(attempt, self.retry_delay, self.retry_max_delay))
+            attempt += 1
+
+    def _args(self, cmd, namespace=None):
+        args = list(self.base_cmd)
+        namespace = namespace or self.namespace
+        if namespace:
+            args.append('--namespace=' + namespace)
+        return args + cmd
 
     def _execute(self, cmd):
-        args = self.base_cmd + cmd
+        args = self._args(cmd)
+        start = time.time()
         try:
-            rc, out, err = self.module.run_command(args)
+            rc, out, err = self._run(args)
             if rc != 0:
-                self.module.fail_json(
-                    msg='error running kubectl (%s) command (rc=%d), out=\'%s\', err=\'%s\'' % (' '.join(args), rc, out, err))
+                self.module.fail_json(msg=kubectl_error(args, rc, out, err))
         except Exception as exc:
             self.module.fail_json(
                 msg='error running kubectl (%s) command: %s' % (' '.join(args), str(exc)))
+        for kind, name, verb in parse_apply_output(out.splitlines()):
+            self._record(kind, self.namespace, name, verb, elapsed_ms(start))
         return out.splitlines()
 
     def _execute_nofail(self, cmd):
-        args = self.base_cmd + cmd
-        rc, out, err = self.module.run_command(args)
+        args = self._args(cmd)
+        rc, out, err = self._run(args)
         if rc != 0:
             return None
         return out.splitlines()
 
+    def _live_objects(self, filenames, namespace=None, ignore_not_found=True, refs=None):
+        """Returns the live objects defined by filenames, or named by refs
+        (kind/name), using one kubectl get.
+
+        Returns None when kubectl fails, e.g. because an object is missing and
+        ignore_not_found is False.
+        """
+        cmd = ['get'] + (refs or ['--filename=' + ','.join(filenames)]) + ['-o', 'json']
+        if ignore_not_found:
+            cmd.append('--ignore-not-found')
+        rc, out, err = self._run(self._args(cmd, namespace=namespace))
+        if rc != 0:
+            return None
+        return parse_json_objects(out)
+
+    def _plan_apply(self, filenames, namespace=None):
+        """Splits filenames into the ones that need to be applied and the
+        lines reporting objects left alone because their manifest matches the
+        last-applied configuration of the live object.
+
+        Also returns the resourceVersion of every live object, from which
+        _kubectl_apply tells created, configured and unchanged objects apart.
+        Without PyYAML, or when the live objects cannot be read, every file is
+        applied and the versions are None.
+        """
+        if not HAS_YAML:
+            return filenames, [], None
+        start = time.time()
+        try:
+            manifests = [(f, self._manifests([f])) for f in filenames]
+            live = self._live_objects(filenames, namespace)
+        except Exception:
+            return filenames, [], None
+        if live is None:
+            return filenames, [], None
+
+        hashes, versions = {}, {}
+        for obj in live:
+            meta = obj.get('metadata', {})
+            key = (obj.get('kind'), meta.get('namespace'), meta.get('name'))
+            hashes[key] = applied_hash(obj)
+            hashes.setdefault((obj.get('kind'), None, meta.get('name')), applied_hash(obj))
+            versions[key] = meta.get('resourceVersion')
+
+        def current(obj):
+            meta = obj.get('metadata', {})
+            live_hash = hashes.get((obj.get('kind'), meta.get('namespace'), meta.get('name')))
+            return live_hash is not None and live_hash == manifest_hash(obj)
+
+        to_apply, unchanged = [], []
+        for filename, objects in manifests:
+            if objects and all(current(obj) for obj in objects):
+                for obj in objects:
+                    meta = obj['metadata']
+                    self._record(obj['kind'], meta.get('namespace') or namespace or self.namespace,
+                                 meta['name'], 'unchanged', elapsed_ms(start))
+                    unchanged.append('%s/%s unchanged' % (obj['kind'].lower(), meta['name']))
+            else:
+                to_apply.append(filename)
+        return to_apply, unchanged, versions
+
+    def _kubectl_api_resources(self):
+        """Returns (kind by resource name, namespaced by kind) of the lower
+        case resource names and kinds, from one kubectl api-resources."""
+        if self._api_resources is None:
+            rc, out, err = self._run(self._args(['api-resources', '--no-headers']))
+            if rc != 0:
+                raise Exception('unable to list the API resources: %s' % err)
+            kinds, scopes = {}, {}
+            # NAME [SHORTNAMES] APIGROUP NAMESPACED KIND, with empty columns
+            # left out.
+            for fields in (line.split() for line in out.splitlines()):
+                if len(fields) >= 3:
+                    kind = fields[-1].lower()
+                    kinds[fields[0]] = kinds[kind] = kind
+                    scopes[kind] = fields[-2] == 'true'
+            self._api_resources = kinds, scopes
+        return self._api_resources
+
+    def _namespaced(self, kind):
+        """Tells whether kind, as returned by normalize_kind, is namespaced,
+        from the API discovery or one kubectl api-resources."""
+        if self.client:
+            return bool(self.client.resource_for_name(kind).get('namespaced'))
+        return self._kubectl_api_resources()[1].get(kind, True)
+
+    def _resource_kind(self, resource):
+        """Returns the lower case kind of a resource name given by the user,
+        such as deploy or prometheuses, from the API discovery or kubectl
+        api-resources, or else as guessed by resource_kind. The kubectl
+        engine takes the names of RESOURCE_ALIASES as they are, sparing the
+        kubectl call."""
+        if not resource:
+            return None
+        try:
+            if self.client:
+                return self.client.resource_for_name(resource)['kind'].lower()
+            if normalize_kind(resource) in RESOURCE_ALIASES:
+                return resource_kind(resource)
+            kind = self._kubectl_api_resources()[0].get(normalize_kind(resource))
+            if kind:
+                return kind
+        except Exception:
+            pass
+        return resource_kind(resource)
+
+    def _kubectl_dry_run_flag(self):
+        """Returns the kubectl apply flag for a server side dry run, or ''
+        when kubectl or the server predate 1.13 and a dry run could persist
+        the write."""
+        if self._dry_run_flag is None:
+            self._dry_run_flag = ''
+            rc, out, err = self._run(self._args(['version', '-o', 'json']))
+            try:
+                versions = json.loads(out) if rc == 0 else {}
+            except ValueError:
+                versions = {}
+            client = parse_version((versions.get('clientVersion') or {}).get('gitVersion'))
+            server = parse_version((versions.get('serverVersion') or {}).get('gitVersion'))
+            if min(client, server) >= (1, 18):
+                self._dry_run_flag = '--dry-run=server'
+            elif min(client, server) >= (1, 13):
+                self._dry_run_flag = '--server-dry-run'
+        return self._dry_run_flag
+
+    def _api_dry_run(self, manifests, namespace):
+        planned = []
+        for filename, objects in manifests:
+            entries = []
+            for obj in objects:
+                start, calls = time.time(), self.client.thread_calls()
+                verb, live, result = self.client.dry_run_apply(obj, namespace or self.namespace)
+                entries.append((obj['kind'], result['metadata'].get('namespace'),
+                                result['metadata']['name'], verb, live, result,
+                                elapsed_ms(start), self.client.thread_calls() - calls))
+            planned.append((filename, entries))
+        return planned
+
+    def _kubectl_dry_run(self, manifests, namespace):
+        """Plans the objects of all files from one kubectl get, then lets the
+        server render the changed files with one kubectl apply dry run when
+        both sides support it."""
+        filenames = [f for f, _ in manifests]
+        start = time.time()
+        live = self._live_objects(filenames, namespace)
+        if live is None:
+            raise Exception('unable to read the live objects of %s' % ','.join(filenames))
+        by_key = {}
+        for obj in live:
+            meta = obj.get('metadata', {})
+            by_key[(obj.get('kind'), meta.get('namespace'), meta.get('name'))] = obj
+            by_key.setdefault((obj.get('kind'), None, meta.get('name')), obj)
+
+        planned, changed = [], []
+        for filename, objects in manifests:
+            entries = []
+            for obj in objects:
+                meta = obj.get('metadata', {})
+                current = by_key.get((obj['kind'], meta.get('namespace'), meta['name']))
+                obj_namespace = meta.get('namespace') or (current or {}).get('metadata', {}).get('namespace')
+                desired = desired_object(obj, obj_namespace)
+                strategic = patch_type(obj.get('apiVersion')) == STRATEGIC_MERGE_PATCH
+                patch = apply_patch(desired, current, strategic)
+                if patch is None:
+                    verb, result = 'created', desired
+                elif not patch:
+                    verb, result = 'unchanged', current
+                else:
+                    merge = strategic_merge if strategic else merge_patch
+                    verb, result = 'configured', merge(json.loads(json.dumps(current)), patch)
+                entries.append([obj['kind'], obj_namespace, meta['name'], verb, current, result])
+                if verb != 'unchanged' and filename not in changed:
+                    changed.append(filename)
+            planned.append((filename, entries))
+
+        flag = self._kubectl_dry_run_flag() if changed else ''
+        if flag:
+            args = self._args(['apply', flag, '-o', 'json', '--filename=' + ','.join(changed)],
+                              namespace=namespace)
+            rc, out, err = self._run(args)
+            if rc != 0:
+                raise Exception(kubectl_error(args, rc, out, err))
+            rendered = dict(((o.get('kind'), o['metadata'].get('name')), o)
+                            for o in parse_json_objects(out))
+            for _, entries in planned:
+                for entry in entries:
+                    if entry[3] != 'unchanged':
+                        entry[5] = rendered.get((entry[0], entry[2]), entry[5])
+
+        duration = elapsed_ms(start)
+        return [(filename, [tuple(e) + (duration, None) for e in entries])
+                for filename, entries in planned]
+
+    def check_apply(self, filenames, namespace=None):
+        """Check mode apply: works out what applying filenames would do
+        without persisting anything and adds one diff per file.
+
+        Returns (filename, lines) in the order of filenames.
+        """
+        if not HAS_YAML:
+            self.module.fail_json(msg='check mode requires PyYAML')
+        try:
+            manifests = [(f, self._manifests([f])) for f in filenames]
+            if self.client:
+                planned = self._api_dry_run(manifests, namespace)
+            else:
+                planned = self._kubectl_dry_run(manifests, namespace)
+        except Exception as exc:
+            self.module.fail_json(msg='error running a dry run of %s: %s' % (','.join(filenames), str(exc)))
+
+        results = []
+        for filename, entries in planned:
+            lines, before, after = [], [], []
+            for kind, obj_namespace, name, verb, live, result, duration, calls in entries:
+                self._record(kind, obj_namespace, name, verb, duration, calls)
+                lines.append('%s/%s %s' % (kind.lower(), name, verb))
+                if verb != 'unchanged':
+                    before.append(diff_view(live))
+                    after.append(diff_view(result))
+            if before:
+                header = 'definition' if filename == STDIN else filename
+                self.diffs.append({'before_header': header, 'after_header': header,
+                                   'before': '---\n'.join(before), 'after': '---\n'.join(after)})
+            results.append((filename, lines))
+        return results
+
+    def _check_delete(self, targets):
+        """Check mode delete: reports the objects that would be deleted, the
+        named targets or the objects selected by label or all."""
+        if targets is None:
+            if not self.resources:
+                return []
+            try:
+                objects = self._list_kinds(self.resources, self.namespace, self.label)
+            except Exception as exc:
+                self.module.fail_json(msg='error looking up resources to delete: %s' % str(exc))
+            targets = [(o['kind'], o['metadata'].get('namespace'), o['metadata']['name'])
+                       for o in objects]
+        lines = []
+        for kind, namespace, name in targets:
+            self._record(kind, namespace, name, 'deleted', 0)
+            lines.append('%s "%s" deleted' % (normalize_kind(kind), name))
+        return lines
+
+    def _kubectl_apply(self, filenames, namespace=None, force=True, versions=None):
+        """Runs one kubectl apply and records every object it applied.
+
+        With the resourceVersions of the live objects the output is read as
+        JSON: objects that were not live were created, objects whose version
+        moved were configured. Otherwise the text output is parsed.
+        Returns the command, its return code and output, and the output as
+        `kind/name verb` lines.
+        """
+        cmd = ['apply'] + (['--force'] if force else [])
+        if versions is not None:
+            cmd.extend(['-o', 'json'])
+        cmd.append('--filename=' + ','.join(filenames))
+        args = self._args(cmd, namespace=namespace)
+        start = time.time()
+        rc, out, err = self._run(args)
+        duration = elapsed_ms(start)
+
+        try:
+            objects = parse_json_objects(out) if versions is not None else None
+        except ValueError:
+            objects = None
+        if objects is None:
+            lines = out.splitlines()
+            for kind, name, verb in parse_apply_output(lines):
+                self._record(kind, namespace or self.namespace, name, verb, duration)
+            return args, rc, out, err, lines
+
+        lines = []
+        for obj in objects:
+            meta = obj.get('metadata', {})
+            key = (obj.get('kind'), meta.get('namespace'), meta.get('name'))
+            if key not in versions:
+                verb = 'created'
+            elif versions[key] == meta.get('resourceVersion'):
+                verb = 'unchanged'
+            else:
+                verb = 'configured'
+            self._record(key[0], key[1], key[2], verb, duration)
+            lines.append('%s/%s %s' % (key[0].lower(), key[2], verb))
+        return args, rc, out, err, lines
+
+    def _apply_files(self, filenames, force=True):
+        """Applies filenames without failing the module.
+
+        Returns the output lines and an error message, or None on success.
+        """
+        if self.client:
+            try:
+                return self._api_apply(filenames), None
+            except Exception as exc:
+                return [], 'error applying %s through the API server: %s' % (
+                    ','.join(filenames), str(exc))
+
+        try:
+            to_apply, lines, versions = self._plan_apply(filenames)
+            if not to_apply:
+                return lines, None
+            args, rc, out, err, applied = self._kubectl_apply(to_apply, force=force,
+                                                              versions=versions)
+        except Exception as exc:
+            return [], 'error applying %s: %s' % (','.join(filenames), str(exc))
+        if rc != 0:
+            return lines, kubectl_error(args, rc, out, err)
+        return lines + applied, None
+
+    def _parallel_apply(self, filenames, force=True):
+        """Applies filenames phase by phase, spreading every phase over a pool
+        of parallelism workers.
+
+        A phase only starts once the previous one succeeded, so namespaces and
+        CRDs exist before the objects that use them. Errors of all workers of
+        a phase are reported together.
+        """
+        try:
+            phases = apply_phases(filenames)
+        except Exception as exc:
+            self.module.fail_json(msg='error reading %s: %s' % (','.join(filenames), str(exc)))
+
+        lines, errors = [], []
+        pool = ThreadPool(self.parallelism)
+        try:
+            for phase in phases:
+                # One kubectl per worker; the api engine spreads single files.
+                workers = len(phase) if self.client else min(self.parallelism, len(phase))
+                chunks = [phase[i::workers] for i in range(workers)]
+                for chunk_lines, error in pool.map(
+                        lambda chunk: self._apply_files(chunk, force=force), chunks):
+                    lines.extend(chunk_lines)
+                    if error:
+                        errors.append(error)
+                if errors:
+                    break
+        finally:
+            pool.close()
+            pool.join()
+
+        if errors:
+            self.module.fail_json(msg='%d apply worker(s) failed: %s' % (len(errors), '; '.join(errors)),
+                                  applied=lines, objects=self.results)
+        return lines
+
+    def _poll_statuses(self, filenames, namespace, deadline, refs=None):
+        """Polls the objects defined by filenames, or named by refs, with one
+        kubectl get per round, backing off exponentially, until none is
+        pending."""
+        delay = 1
+        while True:
+            live = self._live_objects(filenames, namespace, ignore_not_found=False, refs=refs)
+            statuses = {}
+            for obj in live or []:
+                meta = obj.get('metadata', {})
+                key = (obj.get('kind'), meta.get('namespace'), meta.get('name'))
+                statuses[key] = object_status(obj, self.wait_condition, self.max_unavailable)
+                if statuses[key][0] == READY:
+                    self.ready_times.setdefault(key, time.time())
+            done = live is not None and all(state != PENDING for state, _ in statuses.values())
+            if done or time.time() >= deadline:
+                if live is None:
+                    statuses[('', namespace, ','.join(refs or filenames))] = (PENDING, 'objects not found')
+                return statuses
+            time.sleep(max(0, min(delay, deadline - time.time())))
+            delay = min(delay * 2, 16)
+
+    def _wait_groups(self, targets):
+        """Returns what wait_ready waits for: (namespace, filenames, refs)
+        groups, refs naming the (kind, namespace, name) targets as kind/name."""
+        if targets is not None:
+            return [(namespace, [], ['%s/%s' % (normalize_kind(kind), name)
+                                     for kind, ns, name in targets if ns == namespace])
+                    for namespace in sorted(set(t[1] for t in targets), key=str)]
+        if self.items:
+            return [(namespace, [e['filename'] for e in entries], None)
+                    for namespace, entries in self._items_by_namespace()]
+        return [(self.namespace, self.filename, None)]
+
+    def _watch_objects(self, groups):
+        """Resolves wait groups to the (resource, namespace, name) objects of
+        KubeApiClient.wait_for."""
+        objects = []
+        for namespace, filenames, refs in groups:
+            for ref in refs or []:
+                kind, _, name = ref.partition('/')
+                objects.append((self.client.resource_for_name(kind), namespace or 'default', name))
+            for obj in self._manifests(filenames):
+                resource, obj_namespace = self.client.object_resource(obj, namespace or self.namespace)
+                objects.append((resource, obj_namespace, obj['metadata']['name']))
+        return objects
+
+    def wait_ready(self, targets=None):
+        """Tracks the rollout of every applied object, or every
+        (kind, namespace, name) of targets, until all are ready or
+        wait_timeout has passed.
+
+        The api engine opens one watch per kind and namespace for all objects
+        at once, the kubectl engine polls them. The time each object took to
+        become ready is summed up in self.rollout. Fails the module with the
+        objects still pending at the deadline or as soon as one of them
+        failed, e.g. a Job.
+        """
+        started = time.time()
+        deadline = started + self.wait_timeout
+        groups = self._wait_groups(targets)
+
+        statuses = {}
+        try:
+            if self.client:
+                statuses = self.client.wait_for(
+                    self._watch_objects(groups), self.wait_timeout, self.wait_condition,
+                    max_unavailable=self.max_unavailable, ready_times=self.ready_times)
+            else:
+                for namespace, filenames, refs in groups:
+                    statuses.update(self._poll_statuses(filenames, namespace, deadline, refs=refs))
+        except Exception as exc:
+            self.module.fail_json(msg='error waiting for resources: %s' % str(exc))
+
+        summary = []
+        for key, (state, message) in statuses.items():
+            ready_at = self.ready_times.get(key)
+            summary.append({'kind': normalize_kind(key[0]), 'namespace': key[1], 'name': key[2],
+                            'state': state, 'message': message,
+                            'ready_after_s': round(ready_at - started, 1) if ready_at else None})
+        summary.sort(key=lambda o: (o['ready_after_s'] is None, o['ready_after_s'], o['name']))
+        self.rollout = {'duration_s': round(time.time() - started, 1), 'objects': summary}
+
+        not_ready = sorted('%s/%s: %s' % (key[0].lower(), key[2], message)
+                           for key, (state, message) in statuses.items() if state != READY)
+        if any(state == FAILED for state, _ in statuses.values()):
+            self.module.fail_json(msg='resources failed: %s' % '; '.join(not_ready),
+                                  rollout=self.rollout)
+        if not_ready:
+            self.module.fail_json(msg='timed out after %ds waiting for: %s' % (
+                self.wait_timeout, '; '.join(not_ready)), rollout=self.rollout)
+
+    def _items_by_namespace(self):
+        groups = []
+        by_namespace = {}
+        for item in self.items:
+            filename = item.get('filename') or item.get('file')
+            if not filename:
+                self.module.fail_json(msg='filename required for every entry in items')
+            entry = {
+                'filename': filename.strip(),
+                'name': item.get('name'),
+                'resource': item.get('resource') or item.get('type'),
+                'namespace': item.get('namespace') or self.namespace,
+                'changed': False,
+                'failed': False,
+            }
+            if entry['namespace'] not in by_namespace:
+                by_namespace[entry['namespace']] = []
+                groups.append((entry['namespace'], by_namespace[entry['namespace']]))
+            by_namespace[entry['namespace']].append(entry)
+        return groups
+
+    def _item_status(self, entry, applied, err):
+        if '"%s"' % entry['filename'] in err:
+            entry['failed'] = True
+            entry['msg'] = err.strip()
+            return entry
+        kind = self._resource_kind(entry['resource'])
+        for applied_kind, name, verb in applied:
+            if entry['name'] and name != entry['name']:
+                continue
+            if kind and applied_kind != kind:
+                continue
+            if verb != 'unchanged':
+                entry['changed'] = True
+        return entry
+
+    def apply_items(self, force=True):
+        """Applies every entry of items with one kubectl call per namespace.
+
+        Returns the per-entry status, in the order the entries were given.
+        """
+        results = []
+        for namespace, entries in self._items_by_namespace():
+            if self.check_mode:
+                planned = dict(self.check_apply([e['filename'] for e in entries], namespace))
+                for entry in entries:
+                    entry['changed'] = any(verb != 'unchanged' for _, _, verb
+                                           in parse_apply_output(planned[entry['filename']]))
+                results.extend(entries)
+                continue
+
+            if self.client:
+                results.extend(self._api_apply_items(namespace, entries))
+                continue
+
+            to_apply, _, versions = self._plan_apply([e['filename'] for e in entries], namespace)
+            results.extend(entries)
+            entries = [e for e in entries if e['filename'] in to_apply]
+            if not entries:
+                continue
+
+            try:
+                _, rc, out, err, lines = self._kubectl_apply(
+                    [e['filename'] for e in entries], namespace, force=force, versions=versions)
+            except Exception as exc:
+                rc, err, lines = 1, str(exc), []
+
+            applied = parse_apply_output(lines)
+            unmatched = rc != 0 and not any('"%s"' % e['filename'] in err for e in entries)
+            for entry in entries:
+                if unmatched:
+                    entry['failed'] = True
+                    entry['msg'] = err.strip()
+                else:
+                    self._item_status(entry, applied, err)
+        return results
+
+    def _api_apply_items(self, namespace, entries):
+        for entry in entries:
+            try:
+                applied = parse_apply_output(self._api_apply([entry['filename']], namespace))
+            except Exception as exc:
+                entry['failed'] = True
+                entry['msg'] = str(exc)
+                continue
+            entry['changed'] = any(verb != 'unchanged' for _, _, verb in applied)
+        return entries
+
     def create(self, check=True, force=True):
         if check and self.exists():
             return []
 
-        cmd = ['apply']
-
-        if force:
-            cmd.append('--force')
-
         if not self.filename:
             self.module.fail_json(msg='filename required to create')
 
-        cmd.append('--filename=' + ','.join(self.filename))
-
-        return self._execute(cmd)
+        return self.replace(force=force)
 
     def replace(self, force=True):
 
-        cmd = ['apply']
-
-        if force:
-            cmd.append('--force')
-
         if not self.filename:
             self.module.fail_json(msg='filename required to reload')
 
-        cmd.append('--filename=' + ','.join(self.filename))
+        if self.check_mode:
+            return [line for _, lines in self.check_apply(self.filename) for line in lines]
 
-        return self._execute(cmd)
+        if self.parallelism > 1 and len(self.filename) > 1 and HAS_YAML:
+            return self._parallel_apply(self.filename, force=force)
+
+        if self.client:
+            try:
+                return self._api_apply(self.filename)
+            except Exception as exc:
+                self._api_fail('applying %s' % ','.join(self.filename), exc)
+
+        to_apply, unchanged, versions = self._plan_apply(self.filename)
+        if not to_apply:
+            return unchanged
+
+        try:
+            args, rc, out, err, lines = self._kubectl_apply(to_apply, force=force,
+                                                            versions=versions)
+        except Exception as exc:
+            self.module.fail_json(msg='error running kubectl apply: %s' % str(exc))
+        if rc != 0:
+            self.module.fail_json(msg=kubectl_error(args, rc, out, err))
+        return unchanged + lines
 
     def delete(self):
 
+        if not self.filename and not self.resource:
+            self.module.fail_json(msg='resource required to delete without filename')
+
+        if self.check_mode:
+            targets = self._named_targets()
+            return self._check_delete(self._existing(targets) or [] if targets is not None else None)
+
+        # Objects addressed by name are looked up with one list per kind and
+        # only the existing ones are deleted, in one call per namespace.
+        targets = None if self.force else self._named_targets()
+        found = self._existing(targets) if targets is not None else None
+        if found is not None:
+            return self._delete_targets(found) if found else []
+
         if not self.force and not self.exists():
             return []
 
+        if self.client:
+            if self.filename or self.names:
+                targets = self._named_targets() or []
+                return self._delete_targets(targets)
+            if not self.label and not self.all:
+                self.module.fail_json(msg='name, label or all required with resource')
+            return self._api_delete()
+
         cmd = ['delete']
 
         if self.filename:
             cmd.append('--filename=' + ','.join(self.filename))
         else:
-            if not self.resource:
-                self.module.fail_json(msg='resource required to delete without filename')
-
             cmd.append(self.resource)
 
-            if self.name:
-                cmd.append(self.name)
+            cmd.extend(self.names)
 
             if self.label:
                 cmd.append('--selector=' + self.label)
@@ -206,18 +1438,29 @@ class KubeManager(object):
         return self._execute(cmd)
 
     def exists(self):
+        if not self.filename and not self.resource:
+            self.module.fail_json(msg='resource required without filename')
+
+        targets = self._named_targets()
+        found = self._existing(targets) if targets is not None else None
+        if found is not None:
+            return bool(targets) and len(found) == len(targets)
+
+        if self.client:
+            # Errors mean "does not exist", like a failing kubectl get does.
+            try:
+                return bool(self._api_selected(list_all=True))
+            except Exception:
+                return False
+
         cmd = ['get']
 
         if self.filename:
             cmd.append('--filename=' + ','.join(self.filename))
         else:
-            if not self.resource:
-                self.module.fail_json(msg='resource required without filename')
-
             cmd.append(self.resource)
 
-            if self.name:
-                cmd.append(self.name)
+            cmd.extend(self.names)
 
             if self.label:
                 cmd.append('--selector=' + self.label)
@@ -232,35 +1475,149 @@ class KubeManager(object):
             return False
         return True
 
-    # TODO: This is currently unused, perhaps convert to 'scale' with a replicas param?
-    def stop(self):
-
-        if not self.force and not self.exists():
-            return []
-
-        cmd = ['stop']
-
-        if self.filename:
-            cmd.append('--filename=' + ','.join(self.filename))
+    def prune(self):
+        """Deletes the live objects matching label that were created by an
+        apply (they carry the last-applied annotation) but are not part of
+        the applied manifests any more.
+
+        The namespaced kinds in resource, or else the kinds of the manifests,
+        are listed once per namespace of a namespaced manifest, the cluster
+        scoped ones once, and compared with the manifests in memory; the
+        leftovers are deleted in one batched pass.
+        """
+        if not self.label:
+            self.module.fail_json(msg='label required to prune')
+        if not HAS_YAML:
+            self.module.fail_json(msg='prune requires PyYAML')
+
+        if self.items:
+            groups = [(namespace, [e['filename'] for e in entries])
+                      for namespace, entries in self._items_by_namespace()]
         else:
-            if not self.resource:
-                self.module.fail_json(msg='resource required to stop without filename')
-
-            cmd.append(self.resource)
+            groups = [(self.namespace, self.filename)]
 
-            if self.name:
-                cmd.append(self.name)
-
-            if self.label:
-                cmd.append('--selector=' + self.label)
-
-            if self.all:
-                cmd.append('--all')
-
-            if self.force:
-                cmd.append('--ignore-not-found')
+        try:
+            kinds = set(self._resource_kind(r) for r in self.resources)
+            applied, unscoped, namespaces = set(), set(), set()
+            for namespace, filenames in groups:
+                for obj in self._manifests(filenames):
+                    meta = obj.get('metadata', {})
+                    kind = normalize_kind(obj['kind'])
+                    if not self.resources:
+                        kinds.add(kind)
+                    if not self._namespaced(kind):
+                        applied.add((kind, None, meta['name']))
+                        continue
+                    obj_namespace = meta.get('namespace') or namespace or self.namespace
+                    applied.add((kind, obj_namespace, meta['name']))
+                    if obj_namespace is None:
+                        # In the namespace of the kubectl context.
+                        unscoped.add((kind, meta['name']))
+                    namespaces.add(obj_namespace)
+
+            namespaced = [kind for kind in sorted(kinds) if self._namespaced(kind)]
+            listings = [(None, [kind for kind in sorted(kinds) if kind not in namespaced])]
+            listings.extend((namespace, namespaced) for namespace in sorted(namespaces, key=str))
+            stale = {}
+            for namespace, listed in listings:
+                if not listed:
+                    continue
+                for obj in self._list_kinds(listed, namespace, self.label):
+                    meta = obj.get('metadata', {})
+                    kind = normalize_kind(obj['kind'])
+                    key = (kind, meta.get('namespace') if self._namespaced(kind) else None,
+                           meta['name'])
+                    if key in applied or (namespace is None and key[::2] in unscoped):
+                        continue
+                    if LAST_APPLIED_ANNOTATION in (meta.get('annotations') or {}):
+                        stale[key] = (obj['kind'],) + key[1:]
+        except Exception as exc:
+            self.module.fail_json(msg='error looking up objects to prune: %s' % str(exc))
+
+        targets = [stale[key] for key in sorted(stale, key=str)]
+        if self.check_mode:
+            return self._check_delete(targets)
+        return self._delete_targets(targets) if targets else []
+
+    def _scale_objects(self):
+        """Returns the live workloads selected by filename, resource and name,
+        or resource and label or all, listing every kind once per namespace.
+        Named objects that do not exist are left out."""
+        if self.label or self.all:
+            if not self.resources:
+                self.module.fail_json(msg='resource required to scale by label or all')
+            return self._list_kinds(self.resources, self.namespace, self.label)
+
+        targets = self._named_targets()
+        if targets is None:
+            self.module.fail_json(msg='filename, name, label or all required to scale')
+        found = self._existing(targets)
+        if found is None:
+            raise Exception('unable to look up %s' % ', '.join('%s/%s' % (t[0], t[2]) for t in targets))
+        return [self.index.get(*t) for t in found]
+
+    def scale(self, replicas, wait=False):
+        """Sets the replicas of every selected workload through its scale
+        subresource, skipping the ones already at replicas.
+
+        The kubectl engine scales all workloads of a namespace with one
+        kubectl scale. With wait, waits until the controllers have observed
+        the new count and the pods are ready or gone.
+        """
+        if replicas is None or replicas < 0:
+            self.module.fail_json(msg='replicas >= 0 required to scale')
+        if not self.filename and not self.resource:
+            self.module.fail_json(msg='resource required to scale without filename')
 
-        return self._execute(cmd)
+        try:
+            objects = self._scale_objects()
+        except Exception as exc:
+            self.module.fail_json(msg='error looking up resources to scale: %s' % str(exc))
+
+        targets, lines = [], []
+        to_scale = []
+        for obj in objects:
+            meta = obj['metadata']
+            target = (obj['kind'], meta.get('namespace'), meta['name'])
+            targets.append(target)
+            if (obj.get('spec') or {}).get('replicas', 1) == replicas:
+                self._record(target[0], target[1], target[2], 'unchanged', 0, 0 if self.client else None)
+                lines.append('%s/%s unchanged' % (obj['kind'].lower(), meta['name']))
+            else:
+                to_scale.append(target)
+
+        if self.check_mode:
+            for kind, namespace, name in to_scale:
+                self._record(kind, namespace, name, 'scaled', 0)
+                lines.append('%s/%s scaled' % (kind.lower(), name))
+            return lines
+
+        if self.client:
+            try:
+                for kind, namespace, name in to_scale:
+                    start, calls = time.time(), self.client.thread_calls()
+                    self.client.scale(self.client.resource_for_name(kind), name, replicas, namespace)
+                    self._record(kind, namespace, name, 'scaled', elapsed_ms(start),
+                                 self.client.thread_calls() - calls)
+                    lines.append('%s/%s scaled' % (kind.lower(), name))
+            except Exception as exc:
+                self._api_fail('scaling', exc)
+        else:
+            for namespace in sorted(set(t[1] for t in to_scale), key=str):
+                refs = ['%s/%s' % (normalize_kind(kind), name)
+                        for kind, ns, name in to_scale if ns == namespace]
+                args = self._args(['scale', '--replicas=%d' % replicas] + refs, namespace=namespace)
+                start = time.time()
+                rc, out, err = self._run(args)
+                if rc != 0:
+                    self.module.fail_json(msg=kubectl_error(args, rc, out, err))
+                for kind, name, verb in parse_apply_output(out.splitlines()):
+                    self._record(kind, namespace, name, verb, elapsed_ms(start))
+                lines.extend(out.splitlines())
+
+        if wait and targets:
+            self.wait_ready(targets)
+        return lines
 
 
 def main():
@@ -269,23 +1626,57 @@ def main():
         argument_spec=dict(
             name=dict(),
             filename=dict(type='list', aliases=['files', 'file', 'filenames']),
+            definition=dict(type='raw'),
             namespace=dict(),
             resource=dict(),
             label=dict(),
             server=dict(),
+            kubeconfig=dict(),
+            cache_dir=dict(),
+            engine=dict(default='kubectl', choices=['kubectl', 'api']),
             kubectl=dict(),
+            session=dict(default=False, type='bool'),
+            session_timeout=dict(default=300, type='int'),
             force=dict(default=False, type='bool'),
             all=dict(default=False, type='bool'),
             log_level=dict(default=0, type='int'),
-            state=dict(default='present', choices=['present', 'absent', 'latest', 'reloaded', 'stopped']),
+            items=dict(type='list'),
+            parallelism=dict(default=1, type='int'),
+            wait=dict(default=False, type='bool'),
+            wait_condition=dict(),
+            wait_timeout=dict(default=300, type='int'),
+            wait_max_unavailable=dict(type='raw'),
+            replicas=dict(type='int'),
+            prune=dict(default=False, type='bool'),
+            retries=dict(default=3, type='int'),
+            retry_delay=dict(default=0.5, type='float'),
+            retry_max_delay=dict(default=10, type='float'),
+            state=dict(default='present', choices=['present', 'absent', 'latest', 'reloaded', 'scaled', 'stopped']),
             ),
-            mutually_exclusive=[['filename', 'list']]
+            mutually_exclusive=[['filename', 'list'], ['filename', 'items'], ['filename', 'definition'],
+                                ['definition', 'items']],
+            supports_check_mode=True
         )
 
-    changed = False
-
     manager = KubeManager(module)
     state = module.params.get('state')
+    if manager.items:
+        if state not in ('present', 'latest', 'reloaded'):
+            module.fail_json(msg='items is only supported with state present, latest or reloaded.')
+        results = manager.apply_items()
+        failed = [r for r in results if r['failed']]
+        if failed:
+            module.fail_json(msg='failed to apply %d of %d items: %s' % (
+                len(failed), len(results), ', '.join(r['filename'] for r in failed)),
+                item_results=results, objects=manager.results)
+        pruned = manager.prune() if module.params.get('prune') else []
+        if module.params.get('wait') and not module.check_mode:
+            manager.wait_ready()
+        module.exit_json(changed=any(r['changed'] for r in results) or bool(pruned),
+                         msg='success: applied %d items' % len(results),
+                         item_results=results, objects=manager.results, diff=manager.diffs,
+                         rollout=manager.rollout)
+
     if state == 'present':
         result = manager.create(check=False)
 
@@ -295,8 +1686,11 @@ def main():
     elif state == 'reloaded':
         result = manager.replace()
 
+    elif state == 'scaled':
+        result = manager.scale(module.params.get('replicas'), wait=module.params.get('wait'))
+
     elif state == 'stopped':
-        result = manager.stop()
+        result = manager.scale(0, wait=module.params.get('wait'))
 
     elif state == 'latest':
         result = manager.replace()
@@ -304,11 +1698,31 @@ def main():
     else:
         module.fail_json(msg='Unrecognized state %s.' % state)
 
+    if module.params.get('prune'):
+        if state not in ('present', 'latest', 'reloaded'):
+            module.fail_json(msg='prune is only supported with state present, latest or reloaded.')
+        result = result + manager.prune()
+
+    if module.params.get('wait') and state in ('present', 'latest', 'reloaded') and not module.check_mode:
+        manager.wait_ready()
+
+    if state == 'absent':
+        changed = bool(result)
+    else:
+        changed = any(verb != 'unchanged' for _, _, verb in parse_apply_output(result))
+
     module.exit_json(changed=changed,
-                     msg='success: %s' % (' '.join(result))
-                     )
+                     msg='success: %s' % (' '.join(result)),
+                     objects=manager.results,
+                     diff=manager.diffs,
+                     rollout=manager.rollout)
 
 
 from ansible.module_utils.basic import *  # noqa
+from ansible.module_utils.kube_api import (  # noqa
+    DEFAULT_CACHE_DIR, DEFAULT_SESSION_TIMEOUT, FAILED, HAS_YAML, LAST_APPLIED_ANNOTATION, PENDING, READY,
+    STRATEGIC_MERGE_PATCH, KubeApiClient, applied_hash, apply_patch, desired_object, diff_view,
+    load_definition, load_manifests, manifest_hash, merge_patch, object_status, parse_version,
+    patch_type, read_kubeconfig, retry_delay, strategic_merge)
 if __name__ == '__main__':
     main()
@@ -0,0 +1,754 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+DOCUMENTATION = """
+---
+module: kube_node
+short_description: Manage the scheduling state, labels and taints of Kubernetes nodes
+description:
+  - Changes the scheduling state of many nodes in one task, talking to the
+    API server directly. The state of all nodes is read from a single node
+    list and the pods to drain from a single pod list.
+  - Waits for many nodes to be Ready with a single watch on the nodes.
+  - Reconciles the labels, annotations and taints of many nodes against a
+    single node list, patching only the nodes that differ.
+version_added: "2.4"
+options:
+  nodes:
+    required: false
+    description:
+      - Names of the nodes to handle. Names without a node are reported in
+        C(missing) and otherwise ignored. Defaults to the nodes of desired.
+  desired:
+    required: false
+    description:
+      - With state present, a dict mapping node names to their desired
+        C(labels) and C(annotations), dicts where a null value removes the
+        key, and C(taints), a list of C(key=value:Effect) strings, where
+        C(key:Effect-) removes the taint, or dicts with key, value, effect
+        and state (present or absent). Keys and taints that are not listed
+        are left alone, e.g. the ones set by the node controller.
+  state:
+    required: false
+    choices: ['cordoned', 'drained', 'uncordoned', 'ready', 'present']
+    default: cordoned
+    description:
+      - cordoned marks the nodes that are Ready and schedulable unschedulable.
+      - drained cordons them the same way and then evicts the pods of all
+        Ready nodes, including the ones that were already unschedulable, e.g.
+        by a previous failed drain. Nodes that are not Ready are left alone,
+        unless include_not_ready is set.
+        Only the nodes cordoned by the task are returned in C(cordoned), the
+        ones to uncordon afterwards.
+      - uncordoned makes the unschedulable nodes schedulable again.
+      - ready waits until all nodes are Ready, including nodes that have not
+        registered yet, e.g. after kubelet or CNI changes. The nodes still
+        not Ready after timeout fail the task.
+      - present sends one JSON merge patch to every node whose labels,
+        annotations or taints differ from desired.
+  parallelism:
+    required: false
+    default: 5
+    description:
+      - Number of nodes cordoned, drained, uncordoned or patched at the same
+        time.
+  eviction_parallelism:
+    required: false
+    default: 10
+    description:
+      - Number of pods of a node evicted at the same time.
+  timeout:
+    required: false
+    default: 360s
+    description:
+      - How long to wait for the pods of one node to be evicted and to
+        terminate, in seconds or as a duration such as C(360s) or C(6m). A
+        node whose pods are still running then fails the task.
+      - With state ready, how long to wait for all nodes to be Ready.
+  grace_period:
+    required: false
+    default: -1
+    description:
+      - Seconds given to each pod to terminate. Negative values use the
+        grace period of the pod.
+  force:
+    required: false
+    default: false
+    description:
+      - Also evict pods that are not managed by a controller. Without it,
+        a node running such pods fails to drain.
+  delete_local_data:
+    required: false
+    default: false
+    description:
+      - Also evict pods using emptyDir volumes, losing their data. Without
+        it, a node running such pods fails to drain.
+  include_not_ready:
+    required: false
+    default: false
+    description:
+      - Also cordon and drain the nodes that are not Ready, e.g. dead nodes
+        about to be removed. Their pods are evicted but not waited for, as
+        no kubelet is left to terminate them.
+  server:
+    required: false
+    default: null
+    description:
+      - The url for the API server.
+  kubeconfig:
+    required: false
+    default: null
+    description:
+      - The kubeconfig file used to reach the API server. Defaults to
+        C($KUBECONFIG) or C(~/.kube/config).
+  kubectl:
+    required: false
+    default: null
+    description:
+      - The path to the kubectl binary, only run to read the kubeconfig
+        when PyYAML is not installed.
+  cache_dir:
+    required: false
+    default: null
+    description:
+      - Directory of the discovery cache, see the kube module.
+  retries:
+    required: false
+    default: 3
+    description:
+      - Number of times a request failing with a transient error is retried.
+  retry_delay:
+    required: false
+    default: 0.5
+    description:
+      - Initial backoff in seconds between retries, and between evictions
+        of a pod refused by a disruption budget. It doubles with every
+        retry, up to retry_max_delay, and is jittered.
+  retry_max_delay:
+    required: false
+    default: 10
+    description:
+      - Upper bound in seconds of the backoff between retries.
+notes:
+  - Pods are drained through the eviction API, so PodDisruptionBudgets are
+    honoured. An eviction the budget of the pod does not allow yet only
+    backs off that pod; the other pods are evicted meanwhile.
+  - DaemonSet pods and mirror pods are never evicted, as with
+    C(kubectl drain --ignore-daemonsets).
+  - Check mode is supported and reports the nodes and pods that would be
+    handled.
+requirements:
+  - PyYAML, or kubectl to read the kubeconfig
+author: "Kubespray contributors"
+"""
+
+EXAMPLES = """
+- name: cordon and drain the nodes of the current upgrade batch
+  kube_node:
+    nodes: "{{ ansible_play_batch }}"
+    state: drained
+    force: true
+    delete_local_data: true
+    grace_period: 300
+    timeout: 360s
+  register: drain
+  run_once: true
+  delegate_to: "{{ groups['kube-master'][0] }}"
+
+- name: wait for all nodes to be Ready after restarting kubelet
+  kube_node:
+    nodes: "{{ groups['k8s-cluster'] }}"
+    state: ready
+    timeout: 5m
+  run_once: true
+  delegate_to: "{{ groups['kube-master'][0] }}"
+
+- name: apply the node labels and taints of the inventory
+  kube_node:
+    desired:
+      node-1:
+        labels:
+          node-role.kubernetes.io/ingress: "true"
+          obsolete-label: null
+        taints:
+          - dedicated=ingress:NoSchedule
+    state: present
+  run_once: true
+  delegate_to: "{{ groups['kube-master'][0] }}"
+
+- name: uncordon them once upgraded
+  kube_node:
+    nodes: "{{ drain.cordoned }}"
+    state: uncordoned
+  run_once: true
+  delegate_to: "{{ groups['kube-master'][0] }}"
+"""
+
+RETURN = """
+nodes:
+  description: One entry per node found, in the order of nodes.
+  returned: always
+  type: list
+  sample:
+    - name: node-1
+      ready: true
+      schedulable: false
+      cordoned: true
+      drained: true
+      duration_s: 12.3
+      pods:
+        - name: default/web-6d4b75cb6d-x7b9q
+          attempts: 3
+          evicted_after_s: 4.21
+          deleted_after_s: 9.87
+    - name: node-2
+      ready: true
+      msg: condition Ready met
+      ready_after_s: 48.2
+    - name: node-3
+      ready: true
+      schedulable: true
+      cordoned: false
+      patch:
+        metadata:
+          labels:
+            node-role.kubernetes.io/ingress: "true"
+cordoned:
+  description: Nodes made unschedulable by the task.
+  returned: always
+  type: list
+uncordoned:
+  description: Nodes made schedulable by the task.
+  returned: always
+  type: list
+patched:
+  description: With state present, the nodes patched by the task.
+  returned: always
+  type: list
+missing:
+  description: Requested nodes that do not exist.
+  returned: always
+  type: list
+not_ready:
+  description: With state ready, the nodes that were not Ready at timeout.
+  returned: when state is ready
+  type: list
+"""
+
+import json
+import os
+import re
+import socket
+import ssl
+import time
+from multiprocessing.pool import ThreadPool
+
+MIRROR_ANNOTATION = 'kubernetes.io/config.mirror'
+
+DURATION_RE = re.compile(r'^(?P<value>\d+(?:\.\d+)?)(?P<unit>ms|s|m|h)?$')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, None: 1}
+
+
+def duration_seconds(value):
+    """Parses a number of seconds or a kubectl style duration (360s, 6m)."""
+    match = DURATION_RE.match(str(value).strip())
+    if not match:
+        raise ValueError('invalid duration %s' % value)
+    return float(match.group('value')) * DURATION_UNITS[match.group('unit')]
+
+
+def node_ready(node):
+    for condition in (node.get('status') or {}).get('conditions') or []:
+        if condition.get('type') == 'Ready':
+            return condition.get('status') == 'True'
+    return False
+
+
+TAINT_RE = re.compile(r'^(?P<key>[^=:]+)(?:=(?P<value>[^:]*))?(?::(?P<effect>\w+))?$')
+
+
+def parse_taint(taint):
+    """Returns a taint dict for a key=value:Effect string or a dict."""
+    if isinstance(taint, dict):
+        taint = dict(taint)
+    else:
+        text = str(taint).strip()
+        # key:Effect- removes the taint, as with kubectl taint.
+        match = TAINT_RE.match(text[:-1] if text.endswith('-') else text)
+        if not match:
+            raise ValueError('invalid taint %s' % taint)
+        taint = match.groupdict()
+        if text.endswith('-'):
+            taint['state'] = 'absent'
+    if not taint.get('key'):
+        raise ValueError('taint %s has no key' % taint)
+    taint['effect'] = taint.get('effect') or 'NoSchedule'
+    return taint
+
+
+def merge_taints(live, desired):
+    """Returns the taints of a node after adding, updating or removing the
+    desired taints, matched by key and effect. Other taints are kept."""
+    taints = list(live)
+    for want in desired:
+        key, effect = want['key'], want['effect']
+        index = None
+        for i, taint in enumerate(taints):
+            if taint.get('key') == key and taint.get('effect') == effect:
+                index = i
+        if want.get('state') == 'absent':
+            if index is not None:
+                del taints[index]
+            continue
+        taint = {'key': key, 'effect': effect}
+        if want.get('value') not in (None, ''):
+            taint['value'] = str(want['value'])
+        if index is None:
+            taints.append(taint)
+        elif taints[index].get('value') != taint.get('value'):
+            taints[index] = taint
+    return taints
+
+
+def node_patch(node, desired):
+    """Returns the JSON merge patch turning node into desired, or None when
+    nothing differs.
+
+    A patch of the taints, a list the merge patch replaces as a whole, is
+    made conditional on the resourceVersion it was computed from.
+    """
+    meta = node.get('metadata') or {}
+    patch = {}
+    for field in ('labels', 'annotations'):
+        live = meta.get(field) or {}
+        changes = {}
+        for key, value in (desired.get(field) or {}).items():
+            if value is None:
+                if key in live:
+                    changes[key] = None
+            elif live.get(key) != str(value):
+                changes[key] = str(value)
+        if changes:
+            patch.setdefault('metadata', {})[field] = changes
+    if desired.get('taints'):
+        live = (node.get('spec') or {}).get('taints') or []
+        taints = merge_taints(live, [parse_taint(t) for t in desired['taints']])
+        if taints != live:
+            patch['spec'] = {'taints': taints}
+            patch.setdefault('metadata', {})['resourceVersion'] = meta.get('resourceVersion')
+    return patch or None
+
+
+def pod_ref(pod):
+    meta = pod['metadata']
+    return '%s/%s' % (meta.get('namespace'), meta['name'])
+
+
+def controller_kind(pod):
+    for owner in pod['metadata'].get('ownerReferences') or []:
+        if owner.get('controller'):
+            return owner.get('kind')
+    return None
+
+
+class NodeManager(object):
+
+    def __init__(self, module):
+        self.module = module
+        self.check_mode = module.check_mode
+        self.desired = module.params.get('desired') or {}
+        self.names = []
+        for name in module.params.get('nodes') or sorted(self.desired):
+            if name not in self.names:
+                self.names.append(name)
+        self.parallelism = max(1, module.params.get('parallelism') or 1)
+        self.eviction_parallelism = max(1, module.params.get('eviction_parallelism') or 1)
+        self.retry_delay = module.params.get('retry_delay') or 0.5
+        self.retry_max_delay = module.params.get('retry_max_delay') or 10
+        try:
+            self.timeout = duration_seconds(module.params.get('timeout'))
+        except ValueError as exc:
+            module.fail_json(msg=str(exc))
+        self.grace_period = module.params.get('grace_period')
+        self.force = module.params.get('force')
+        self.delete_local_data = module.params.get('delete_local_data')
+        self.include_not_ready = module.params.get('include_not_ready')
+
+        self.client = self._api_client()
+        self.nodes = {}
+        self.live = {}
+        self.missing = []
+        try:
+            self.node_resource = self.client.resource_for_kind('v1', 'Node')
+            self.pod_resource = self.client.resource_for_kind('v1', 'Pod')
+        except API_ERRORS as exc:
+            self._api_fail('reading the API discovery', exc)
+
+    def _kubeconfig(self):
+        """Returns the kubeconfig and the directory of its relative paths.
+        Without PyYAML, as on CoreOS hosts bootstrapped with pypy, kubectl
+        converts it to JSON with the files it refers to inlined."""
+        filename = self.module.params.get('kubeconfig')
+        if HAS_YAML:
+            return read_kubeconfig(filename)
+        kubectl = self.module.params.get('kubectl') or self.module.get_bin_path('kubectl', True)
+        args = [kubectl, 'config', 'view', '--raw', '--flatten', '-o', 'json']
+        if filename:
+            args.append('--kubeconfig=' + filename)
+        rc, out, err = self.module.run_command(args)
+        if rc != 0:
+            raise ValueError('%s failed: %s' % (' '.join(args), err.strip()))
+        return json.loads(out), os.getcwd()
+
+    def _api_client(self):
+        try:
+            config, basedir = self._kubeconfig()
+            return KubeApiClient.from_kubeconfig(
+                config, basedir, server=self.module.params.get('server'),
+                cache_dir=self.module.params.get('cache_dir') or DEFAULT_CACHE_DIR,
+                retries=self.module.params.get('retries'), backoff=self.retry_delay,
+                max_backoff=self.retry_max_delay)
+        except (IOError, OSError, ValueError, KeyError, ssl.SSLError) as exc:
+            self.module.fail_json(msg='unable to load kubeconfig: %s' % str(exc))
+
+    def _api_fail(self, action, exc):
+        self.module.fail_json(msg='error %s through the API server (%s): %s' % (
+            action, self.client.server, str(exc)), nodes=self.results())
+
+    def _map(self, func, items, workers=None):
+        """Runs func for every item on a pool of workers, parallelism by
+        default."""
+        if not items:
+            return []
+        pool = ThreadPool(min(workers or self.parallelism, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def results(self):
+        return [self.nodes[name] for name in self.names if name in self.nodes]
+
+    def load(self):
+        """Reads the state of every node with one list call."""
+        try:
+            live = self.client.list(self.node_resource)
+        except API_ERRORS as exc:
+            self._api_fail('listing nodes', exc)
+        live = self.live = dict((node['metadata']['name'], node) for node in live)
+        for name in self.names:
+            node = live.get(name)
+            if node is None:
+                self.missing.append(name)
+                continue
+            self.nodes[name] = {
+                'name': name,
+                'ready': node_ready(node),
+                'schedulable': not (node.get('spec') or {}).get('unschedulable'),
+                'cordoned': False,
+            }
+
+    def _set_unschedulable(self, names, unschedulable):
+        patch = {'spec': {'unschedulable': True if unschedulable else None}}
+
+        def set_node(name):
+            try:
+                self.client.patch(self.node_resource, name, patch)
+            except API_ERRORS as exc:
+                return '%s: %s' % (name, str(exc))
+
+        if self.check_mode:
+            return
+        errors = [e for e in self._map(set_node, names) if e]
+        if errors:
+            self.module.fail_json(msg='error %s %d node(s): %s' % (
+                'cordoning' if unschedulable else 'uncordoning', len(errors), '; '.join(errors)),
+                nodes=self.results())
+
+    def _handled(self, name):
+        """Tells whether node name is cordoned and drained: it exists and is
+        Ready, or include_not_ready is set."""
+        return name in self.nodes and (self.nodes[name]['ready'] or self.include_not_ready)
+
+    def cordon(self):
+        """Cordons the handled schedulable nodes and returns their names."""
+        names = [n for n in self.names if self._handled(n) and self.nodes[n]['schedulable']]
+        self._set_unschedulable(names, True)
+        for name in names:
+            self.nodes[name]['cordoned'] = True
+        return names
+
+    def uncordon(self):
+        """Uncordons the unschedulable nodes and returns their names."""
+        names = [n for n in self.names if n in self.nodes and not self.nodes[n]['schedulable']]
+        self._set_unschedulable(names, False)
+        for name in names:
+            self.nodes[name]['uncordoned'] = True
+        return names
+
+    def _patch_node(self, name):
+        """Patches node name into its desired state, reading it again after
+        a conflict. Returns the patch sent, or an error message."""
+        node = self.live[name]
+        attempt = 0
+        while True:
+            patch = node_patch(node, self.desired.get(name) or {})
+            if patch is None or self.check_mode:
+                return patch
+            try:
+                self.client.patch(self.node_resource, name, patch)
+                return patch
+            except API_ERRORS as exc:
+                if getattr(exc, 'status', None) != 409 or attempt >= self.module.params.get('retries'):
+                    return '%s: %s' % (name, str(exc))
+            time.sleep(retry_delay(attempt, self.retry_delay, self.retry_max_delay))
+            attempt += 1
+            try:
+                node = self.client.get(self.node_resource, name)
+            except API_ERRORS as exc:
+                return '%s: %s' % (name, str(exc))
+            if node is None:
+                return None
+
+    def reconcile(self):
+        """Patches every node whose labels, annotations or taints differ from
+        desired, parallelism at a time, and returns their names."""
+        try:
+            for desired in self.desired.values():
+                for taint in (desired or {}).get('taints') or []:
+                    parse_taint(taint)
+        except ValueError as exc:
+            self.module.fail_json(msg=str(exc))
+
+        names = [n for n in self.names if n in self.nodes]
+        patches = self._map(self._patch_node, names)
+        patched, errors = [], []
+        for name, patch in zip(names, patches):
+            if isinstance(patch, dict):
+                self.nodes[name]['patch'] = patch
+                patched.append(name)
+            elif patch:
+                errors.append(patch)
+        if errors:
+            self.module.fail_json(msg='error patching %d node(s): %s' % (len(errors), '; '.join(errors)),
+                                  nodes=self.results(), patched=patched, missing=self.missing)
+        return patched
+
+    def _drainable(self, pods):
+        """Returns (pods to evict, reasons the node cannot be drained)."""
+        evict, errors = [], []
+        for pod in pods:
+            meta = pod['metadata']
+            if MIRROR_ANNOTATION in (meta.get('annotations') or {}):
+                continue
+            kind = controller_kind(pod)
+            if kind == 'DaemonSet':
+                continue
+            if kind is None and not self.force:
+                errors.append('pod %s is not managed by a controller (use force)' % pod_ref(pod))
+                continue
+            volumes = (pod.get('spec') or {}).get('volumes') or []
+            if not self.delete_local_data and any('emptyDir' in v for v in volumes):
+                errors.append('pod %s uses local data (use delete_local_data)' % pod_ref(pod))
+                continue
+            evict.append(pod)
+        return evict, errors
+
+    def _evict_pods(self, pods, stats, start, deadline):
+        """Evicts pods eviction_parallelism at a time, retrying the ones a
+        disruption budget does not allow yet with a backoff until deadline.
+        Returns the pods still blocked."""
+        def evict(pod):
+            meta = pod['metadata']
+            stat = stats[meta.get('uid')]
+            stat['attempts'] += 1
+            evicted = self.client.evict(self.pod_resource, meta['name'], meta.get('namespace'),
+                                        grace_period=self.grace_period)
+            if evicted:
+                stat['evicted_after_s'] = round(time.time() - start, 2)
+            return evicted
+
+        # Terminating pods only need to go away.
+        pending = [p for p in pods if not p['metadata'].get('deletionTimestamp')]
+        attempt = 0
+        while pending:
+            pending = [pod for pod, evicted in zip(
+                pending, self._map(evict, pending, self.eviction_parallelism)) if not evicted]
+            if not pending or time.time() >= deadline:
+                break
+            KubeApiClient._backoff(retry_delay(attempt, self.retry_delay, self.retry_max_delay),
+                                   deadline)
+            attempt += 1
+        return pending
+
+    def _wait_deleted(self, name, pods, stats, start, deadline):
+        """Polls the pods of node name until none of pods is left and returns
+        the ones still running at deadline."""
+        pending = pods
+        delay = 0.5
+        while pending:
+            live = self.client.list(self.pod_resource, field_selector='spec.nodeName=' + name)
+            uids = set(p['metadata'].get('uid') for p in live)
+            for pod in pending:
+                if pod['metadata'].get('uid') not in uids:
+                    stats[pod['metadata'].get('uid')]['deleted_after_s'] = round(time.time() - start, 2)
+            pending = [p for p in pending if p['metadata'].get('uid') in uids]
+            if not pending or time.time() >= deadline:
+                break
+            KubeApiClient._backoff(delay, deadline)
+            delay = min(delay * 2, 5)
+        return pending
+
+    def _drain_node(self, args):
+        name, pods = args
+        result = self.nodes[name]
+        start = time.time()
+        evict, errors = self._drainable(pods)
+        stats = dict((p['metadata'].get('uid'), {'name': pod_ref(p), 'attempts': 0})
+                     for p in evict)
+        result['pods'] = [stats[p['metadata'].get('uid')] for p in evict]
+        if errors:
+            result['failed'] = True
+            result['msg'] = '; '.join(errors)
+            return result
+        if self.check_mode:
+            return result
+        deadline = start + self.timeout
+        try:
+            blocked = self._evict_pods(evict, stats, start, deadline)
+            pending = []
+            if not blocked and result['ready']:
+                pending = self._wait_deleted(name, evict, stats, start, deadline)
+        except API_ERRORS as exc:
+            result['failed'] = True
+            result['msg'] = str(exc)
+            return result
+        if blocked:
+            result['failed'] = True
+            result['msg'] = 'timed out after %ss, disruption budgets do not allow evicting %d pod(s): %s' % (
+                self.timeout, len(blocked), ', '.join(pod_ref(p) for p in blocked))
+        elif pending:
+            result['failed'] = True
+            result['msg'] = 'timed out after %ss waiting for %d pod(s): %s' % (
+                self.timeout, len(pending), ', '.join(pod_ref(p) for p in pending))
+        else:
+            result['drained'] = True
+        result['duration_s'] = round(time.time() - start, 1)
+        return result
+
+    def wait_ready(self):
+        """Waits until every node is Ready with one list and one watch on the
+        nodes, resumed if it breaks. Returns the nodes not Ready at timeout."""
+        start = time.time()
+        ready_times = {}
+        try:
+            statuses = self.client.wait_for(
+                [(self.node_resource, None, name) for name in self.names], self.timeout,
+                condition='Ready', backoff=self.retry_delay, max_backoff=self.retry_max_delay,
+                ready_times=ready_times)
+        except API_ERRORS as exc:
+            self._api_fail('watching nodes', exc)
+        not_ready = []
+        for name in self.names:
+            key = (self.node_resource['kind'], None, name)
+            state, message = statuses[key]
+            result = self.nodes[name] = {'name': name, 'ready': state == READY, 'msg': message}
+            if key in ready_times:
+                result['ready_after_s'] = round(max(0, ready_times[key] - start), 1)
+            else:
+                not_ready.append(name)
+        return not_ready
+
+    def drain(self):
+        """Cordons the handled schedulable nodes, then evicts the pods of all
+        handled nodes with up to parallelism nodes at a time. Returns the
+        cordoned nodes."""
+        cordoned = self.cordon()
+        names = [n for n in self.names if self._handled(n)]
+        if not names:
+            return cordoned
+        try:
+            pods = self.client.list(self.pod_resource)
+        except API_ERRORS as exc:
+            self._api_fail('listing pods', exc)
+        by_node = dict((name, []) for name in names)
+        for pod in pods:
+            node = (pod.get('spec') or {}).get('nodeName')
+            if node in by_node:
+                by_node[node].append(pod)
+
+        failed = [r for r in self._map(self._drain_node, [(n, by_node[n]) for n in names])
+                  if r.get('failed')]
+        if failed:
+            self.module.fail_json(msg='failed to drain %d of %d nodes: %s' % (
+                len(failed), len(names), '; '.join('%s: %s' % (r['name'], r['msg']) for r in failed)),
+                nodes=self.results(), cordoned=cordoned, missing=self.missing)
+        return cordoned
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            nodes=dict(type='list'),
+            desired=dict(type='dict'),
+            state=dict(default='cordoned', choices=['cordoned', 'drained', 'uncordoned', 'ready', 'present']),
+            parallelism=dict(default=5, type='int'),
+            eviction_parallelism=dict(default=10, type='int'),
+            timeout=dict(default='360s'),
+            grace_period=dict(default=-1, type='int'),
+            force=dict(default=False, type='bool'),
+            delete_local_data=dict(default=False, type='bool'),
+            include_not_ready=dict(default=False, type='bool'),
+            server=dict(),
+            kubeconfig=dict(),
+            kubectl=dict(),
+            cache_dir=dict(),
+            retries=dict(default=3, type='int'),
+            retry_delay=dict(default=0.5, type='float'),
+            retry_max_delay=dict(default=10, type='float'),
+        ),
+        required_one_of=[['nodes', 'desired']],
+        supports_check_mode=True
+    )
+
+    manager = NodeManager(module)
+    state = module.params.get('state')
+    if state == 'ready':
+        not_ready = manager.wait_ready()
+        if not_ready:
+            module.fail_json(msg='%d of %d nodes not Ready after %ss: %s' % (
+                len(not_ready), len(manager.names), manager.timeout, ', '.join(not_ready)),
+                nodes=manager.results(), not_ready=not_ready)
+        module.exit_json(changed=False, nodes=manager.results(), not_ready=[])
+
+    manager.load()
+    cordoned, uncordoned, patched = [], [], []
+    if state == 'present':
+        patched = manager.reconcile()
+    elif state == 'cordoned':
+        cordoned = manager.cordon()
+    elif state == 'drained':
+        cordoned = manager.drain()
+    elif state == 'uncordoned':
+        uncordoned = manager.uncordon()
+
+    module.exit_json(changed=bool(cordoned or uncordoned or patched),
+                     nodes=manager.results(),
+                     cordoned=cordoned,
+                     uncordoned=uncordoned,
+                     patched=patched,
+                     missing=manager.missing)
+
+
+from ansible.module_utils.basic import *  # noqa
+from ansible.module_utils.six.moves import http_client  # noqa
+from ansible.module_utils.kube_api import (  # noqa
+    DEFAULT_CACHE_DIR, HAS_YAML, READY, KubeApiClient, KubeApiError, read_kubeconfig, retry_delay)
+
+# Errors of an API request: an error response, or the API server could not
+# be reached or broke the connection.
+API_ERRORS = (KubeApiError, socket.error, ssl.SSLError, http_client.HTTPException)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1355 @@
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Minimal Kubernetes API client shared by the kube modules in library/.
+# It only depends on the python standard library (plus PyYAML to read
+# kubeconfig and manifest files) so it runs on any kube-master.
+
+import base64
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import random
+import re
+import socket
+import ssl
+import tempfile
+import threading
+import time
+
+from ansible.module_utils.six import iteritems, string_types
+from ansible.module_utils.six.moves import BaseHTTPServer, http_client, socketserver
+from ansible.module_utils.six.moves.urllib.parse import quote, urlencode, urlparse
+
+try:
+    import yaml
+    # The libyaml parser, when available, reads a kubeconfig with embedded
+    # certificates several times faster.
+    SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    HAS_YAML = True
+except ImportError:
+    HAS_YAML = False
+
+LAST_APPLIED_ANNOTATION = 'kubectl.kubernetes.io/last-applied-configuration'
+DEFAULT_KUBECONFIG = '~/.kube/config'
+DEFAULT_CACHE_DIR = '~/.kube/cache'
+# Seconds a session proxy waits for a request before it exits.
+DEFAULT_SESSION_TIMEOUT = 300
+
+# Metadata the server manages, left out of check mode diffs.
+SERVER_METADATA = ('creationTimestamp', 'generation', 'managedFields',
+                   'resourceVersion', 'selfLink', 'uid')
+
+# Throttled, or the API server / etcd is briefly unavailable, e.g. during a
+# leader election or an apiserver restart.
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+MERGE_PATCH = 'application/merge-patch+json'
+STRATEGIC_MERGE_PATCH = 'application/strategic-merge-patch+json'
+
+# API groups whose kinds are compiled into the API server, which accepts
+# strategic merge patches for them. CRDs and aggregated APIs only take JSON
+# merge patches.
+BUILTIN_GROUPS = ('', 'admissionregistration.k8s.io', 'apps', 'autoscaling', 'batch',
+                  'certificates.k8s.io', 'coordination.k8s.io', 'discovery.k8s.io',
+                  'events.k8s.io', 'extensions', 'networking.k8s.io', 'node.k8s.io',
+                  'policy', 'rbac.authorization.k8s.io', 'scheduling.k8s.io',
+                  'settings.k8s.io', 'storage.k8s.io')
+
+# patchMergeKey of the lists of built-in kinds that a strategic merge patch
+# merges item by item; other lists are replaced as a whole. Container ports
+# are keyed by containerPort, Service ports by port.
+PATCH_MERGE_KEYS = {
+    'containers': 'name',
+    'env': 'name',
+    'ephemeralContainers': 'name',
+    'hostAliases': 'ip',
+    'imagePullSecrets': 'name',
+    'initContainers': 'name',
+    'ownerReferences': 'uid',
+    'ports': 'port',
+    'volumeDevices': 'devicePath',
+    'volumeMounts': 'mountPath',
+    'volumes': 'name',
+}
+
+READY = 'ready'
+PENDING = 'pending'
+FAILED = 'failed'
+
+
+class KubeApiError(Exception):
+
+    def __init__(self, status, reason, body=None):
+        self.status = status
+        self.reason = reason
+        self.body = body
+        message = reason
+        try:
+            message = json.loads(body).get('message') or reason
+        except (TypeError, ValueError, AttributeError):
+            pass
+        super(KubeApiError, self).__init__('%s %s' % (status, message))
+
+
+def flatten_objects(docs):
+    """Drops empty documents and replaces objects of kind List by their items."""
+    objects = []
+    for doc in docs:
+        if not doc:
+            continue
+        if doc.get('kind') == 'List':
+            objects.extend(doc.get('items') or [])
+        else:
+            objects.append(doc)
+    return objects
+
+
+def load_manifests(filenames):
+    """Returns every object defined in the given YAML or JSON files.
+
+    Multi-document files and objects of kind List are flattened.
+    """
+    objects = []
+    for filename in filenames:
+        with open(filename) as f:
+            objects.extend(flatten_objects(yaml.safe_load_all(f)))
+    return objects
+
+
+def load_definition(definition):
+    """Returns (objects, text) for an inline definition: an object, a list of
+    objects or (multi-document) YAML text.
+
+    text is what kubectl reads from stdin. objects is None when the text
+    cannot be parsed because PyYAML is missing.
+    """
+    if isinstance(definition, string_types):
+        return (flatten_objects(yaml.safe_load_all(definition)) if HAS_YAML else None), definition
+    objects = flatten_objects(definition if isinstance(definition, list) else [definition])
+    return objects, json.dumps({'kind': 'List', 'apiVersion': 'v1', 'items': objects})
+
+
+def read_kubeconfig(filename=None):
+    filename = filename or os.environ.get('KUBECONFIG', '').split(os.pathsep)[0] or DEFAULT_KUBECONFIG
+    filename = os.path.expanduser(filename)
+    with open(filename) as f:
+        config = yaml.load(f, Loader=SafeLoader)
+    return config, os.path.dirname(os.path.abspath(filename))
+
+
+def contains(current, desired):
+    """Returns True when every field of desired is already set in current."""
+    if isinstance(desired, dict):
+        if not isinstance(current, dict):
+            return False
+        return all(key in current and contains(current[key], value)
+                   for key, value in iteritems(desired))
+    if isinstance(desired, list):
+        if not isinstance(current, list) or len(current) != len(desired):
+            return False
+        return all(contains(c, d) for c, d in zip(current, desired))
+    return current == desired
+
+
+def patch_merge_key(field, *lists):
+    """Returns the key a strategic merge patch merges the items of the list
+    field by, or None when the lists are replaced as a whole."""
+    key = PATCH_MERGE_KEYS.get(field)
+    items = [item for items in lists for item in items or []]
+    if key == 'port' and any(isinstance(item, dict) and 'containerPort' in item for item in items):
+        key = 'containerPort'
+    if key and all(isinstance(item, dict) and key in item for item in items):
+        return key
+    return None
+
+
+def three_way_list_patch(key, original, modified, current):
+    """Returns the strategic merge patch of a list merged by key: the new
+    items, the changes to live items and deletions of the items removed from
+    original."""
+    original = dict((item[key], item) for item in original or []
+                    if isinstance(item, dict) and key in item)
+    live = dict((item[key], item) for item in current)
+    items = []
+    for item in modified:
+        if item[key] not in live:
+            items.append(item)
+            continue
+        sub = three_way_patch(original.get(item[key]), item, live[item[key]], True)
+        if sub:
+            sub[key] = item[key]
+            items.append(sub)
+    wanted = set(item[key] for item in modified)
+    items.extend({key: value, '$patch': 'delete'} for value in original
+                 if value not in wanted and value in live)
+    return items
+
+
+def three_way_patch(original, modified, current, strategic=False):
+    """Builds a JSON merge patch, or with strategic a strategic merge patch,
+    the way kubectl apply does.
+
+    Fields of modified that are not reflected in current are set, fields
+    removed from the last applied configuration (original) are deleted and
+    everything else, e.g. defaults filled in by the server, is left alone.
+    The strategic patch merges the lists of PATCH_MERGE_KEYS item by item,
+    so values the server filled into their items, such as the nodePort of
+    a Service port, are kept.
+    """
+    patch = {}
+    original = original if isinstance(original, dict) else {}
+    for key, value in iteritems(modified):
+        live = current.get(key)
+        merge_key = strategic and isinstance(value, list) and isinstance(live, list) and \
+            patch_merge_key(key, value, live, original.get(key))
+        if isinstance(value, dict) and isinstance(live, dict):
+            sub = three_way_patch(original.get(key), value, live, strategic)
+            if sub:
+                patch[key] = sub
+        elif merge_key:
+            sub = three_way_list_patch(merge_key, original.get(key), value, live)
+            if sub:
+                patch[key] = sub
+                patch['$setElementOrder/' + key] = [{merge_key: item[merge_key]} for item in value]
+        elif not contains(live, value):
+            patch[key] = value
+    for key in original:
+        if key not in modified and key in current:
+            patch[key] = None
+    return patch
+
+
+def merge_patch(target, patch):
+    """Applies a JSON merge patch (RFC 7386) to target, in place when target
+    is a dict, and returns the result."""
+    if not isinstance(patch, dict):
+        return patch
+    if not isinstance(target, dict):
+        target = {}
+    for key, value in iteritems(patch):
+        if value is None:
+            target.pop(key, None)
+        else:
+            target[key] = merge_patch(target.get(key), value)
+    return target
+
+
+def strategic_merge(target, patch):
+    """Applies a strategic merge patch built by three_way_patch to target,
+    in place when target is a dict, and returns the result."""
+    if not isinstance(patch, dict):
+        return patch
+    if not isinstance(target, dict):
+        target = {}
+    for key, value in iteritems(patch):
+        if key.startswith('$setElementOrder/'):
+            continue
+        merge_key = isinstance(value, list) and isinstance(target.get(key), list) and \
+            patch_merge_key(key, value, target[key])
+        if value is None:
+            target.pop(key, None)
+        elif merge_key:
+            items = target[key]
+            for item in value:
+                found = [i for i in items if i[merge_key] == item[merge_key]]
+                if item.get('$patch') == 'delete':
+                    items = [i for i in items if i[merge_key] != item[merge_key]]
+                elif found:
+                    strategic_merge(found[0], item)
+                else:
+                    items.append(item)
+            target[key] = items
+        else:
+            target[key] = strategic_merge(target.get(key), value)
+    for key, order in iteritems(patch):
+        field = key.partition('$setElementOrder/')[2]
+        if field and isinstance(target.get(field), list):
+            merge_key = list(order[0])[0] if order else None
+            rank = dict((item[merge_key], i) for i, item in enumerate(order))
+            target[field].sort(key=lambda item: rank.get(item.get(merge_key), len(rank)))
+    return target
+
+
+def patch_type(api_version):
+    """Returns the patch content type kubectl apply uses for the kinds of
+    api_version, e.g. apps/v1."""
+    group = (api_version or 'v1').rpartition('/')[0]
+    return STRATEGIC_MERGE_PATCH if group in BUILTIN_GROUPS else MERGE_PATCH
+
+
+def retry_delay(attempt, base, maximum):
+    """Returns the sleep before retry number attempt (0 based): exponential
+    backoff capped at maximum, with full jitter so that many tasks retrying
+    at once do not hit the server in lockstep."""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+def parse_version(version):
+    """Returns (major, minor) of a version such as v1.13.2 or v1.9.5+coreos.0."""
+    match = re.match(r'v?(\d+)\.(\d+)', version or '')
+    return (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+
+
+def last_applied(obj):
+    """Returns the JSON kubectl stores in the last-applied annotation."""
+    obj = json.loads(json.dumps(obj))
+    annotations = obj.get('metadata', {}).get('annotations') or {}
+    annotations.pop(LAST_APPLIED_ANNOTATION, None)
+    if not annotations:
+        obj.get('metadata', {}).pop('annotations', None)
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+
+def manifest_hash(obj):
+    """Returns a content hash of obj in its last-applied form.
+
+    The namespace is left out because objects are always looked up in their
+    namespace before their hashes are compared.
+    """
+    obj = json.loads(last_applied(obj))
+    obj.get('metadata', {}).pop('namespace', None)
+    canonical = json.dumps(obj, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def applied_hash(live):
+    """Returns the manifest_hash of the last-applied annotation of a live
+    object, or None when the object was never applied."""
+    annotations = (live.get('metadata') or {}).get('annotations') or {}
+    try:
+        return manifest_hash(json.loads(annotations[LAST_APPLIED_ANNOTATION]))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def desired_object(obj, namespace=None):
+    """Returns a copy of obj in namespace, annotated with its last-applied
+    configuration like kubectl apply writes it."""
+    desired = json.loads(json.dumps(obj))
+    metadata = desired.setdefault('metadata', {})
+    if namespace:
+        metadata['namespace'] = namespace
+    metadata.setdefault('annotations', {})[LAST_APPLIED_ANNOTATION] = last_applied(desired)
+    return desired
+
+
+def apply_patch(desired, live, strategic=False):
+    """Returns the merge patch, or with strategic the strategic merge patch,
+    applying desired to live takes: None when live does not exist and has to
+    be created, an empty dict when it is up to date."""
+    if live is None:
+        return None
+    if applied_hash(live) == manifest_hash(desired):
+        return {}
+    original = (live.get('metadata', {}).get('annotations') or {}).get(LAST_APPLIED_ANNOTATION)
+    original = json.loads(original) if isinstance(original, string_types) else {}
+    return three_way_patch(original, desired, live, strategic)
+
+
+def diff_view(obj):
+    """Renders obj as YAML for a check mode diff, without its status, the
+    metadata managed by the server and the last-applied annotation."""
+    if obj is None:
+        return ''
+    obj = json.loads(json.dumps(obj))
+    obj.pop('status', None)
+    metadata = obj.get('metadata') or {}
+    for key in SERVER_METADATA:
+        metadata.pop(key, None)
+    annotations = metadata.get('annotations') or {}
+    annotations.pop(LAST_APPLIED_ANNOTATION, None)
+    if not annotations:
+        metadata.pop('annotations', None)
+    return yaml.safe_dump(obj, default_flow_style=False)
+
+
+def iter_lines(response):
+    """Yields the lines of a streamed (chunked) HTTP response as they arrive."""
+    if hasattr(response, 'readline'):
+        while True:
+            line = response.readline()
+            if not line:
+                return
+            if line.strip():
+                yield line.decode('utf-8')
+    else:
+        # python 2 responses are not file objects, read byte by byte.
+        buf = b''
+        while True:
+            char = response.read(1)
+            if not char:
+                return
+            buf += char
+            if char == b'\n':
+                if buf.strip():
+                    yield buf.decode('utf-8')
+                buf = b''
+
+
+def unavailable_budget(max_unavailable, desired):
+    """Returns how many of desired replicas may be unavailable, for
+    max_unavailable given as a number or a percentage such as '10%' (rounded
+    down, like a rolling update's maxUnavailable)."""
+    if not max_unavailable:
+        return 0
+    if isinstance(max_unavailable, string_types) and max_unavailable.endswith('%'):
+        return int(desired * float(max_unavailable[:-1]) / 100)
+    return int(max_unavailable)
+
+
+def object_status(obj, condition=None, max_unavailable=None):
+    """Returns (state, message) for a live object, state being one of READY,
+    PENDING or FAILED.
+
+    With condition the object is ready once that status condition is True,
+    like kubectl wait --for=condition=<condition>. Otherwise the rules of
+    kubectl rollout status are used for workloads, Jobs must complete, Pods
+    must be Ready and other kinds are ready as soon as they exist.
+    max_unavailable lets a workload count as rolled out with that many (or
+    that percentage of) replicas not updated or not available yet, so a few
+    broken nodes do not hold up a DaemonSet rollout on a large cluster.
+    """
+    kind = obj.get('kind')
+    meta = obj.get('metadata') or {}
+    spec = obj.get('spec') or {}
+    status = obj.get('status') or {}
+    conditions = dict((c.get('type'), c) for c in status.get('conditions') or [])
+
+    if condition:
+        if (conditions.get(condition) or {}).get('status') == 'True':
+            return READY, 'condition %s met' % condition
+        return PENDING, 'waiting for condition %s' % condition
+
+    if status.get('observedGeneration', meta.get('generation', 0)) < meta.get('generation', 0):
+        return PENDING, 'waiting for the controller to observe generation %s' % meta['generation']
+
+    if kind == 'Deployment':
+        replicas = spec.get('replicas', 1)
+        budget = unavailable_budget(max_unavailable, replicas)
+        updated = status.get('updatedReplicas', 0)
+        progressing = conditions.get('Progressing') or {}
+        if progressing.get('reason') == 'ProgressDeadlineExceeded':
+            return FAILED, progressing.get('message') or 'progress deadline exceeded'
+        if updated < replicas - budget:
+            return PENDING, '%d of %d replicas updated' % (updated, replicas)
+        if status.get('replicas', 0) > updated + budget:
+            return PENDING, '%d old replicas pending termination' % (status['replicas'] - updated)
+        if status.get('availableReplicas', 0) < min(updated, replicas - budget):
+            return PENDING, '%d of %d updated replicas available' % (
+                status.get('availableReplicas', 0), updated)
+        return READY, '%d replicas available' % min(status.get('availableReplicas', 0), replicas)
+
+    if kind == 'DaemonSet':
+        desired = status.get('desiredNumberScheduled', 0)
+        wanted = desired - unavailable_budget(max_unavailable, desired)
+        if (spec.get('updateStrategy') or {}).get('type') == 'OnDelete':
+            if status.get('numberReady', 0) < wanted:
+                return PENDING, '%d of %d pods ready' % (status.get('numberReady', 0), desired)
+            return READY, '%d of %d pods ready' % (status.get('numberReady', 0), desired)
+        if status.get('updatedNumberScheduled', 0) < wanted:
+            return PENDING, '%d of %d pods updated' % (status.get('updatedNumberScheduled', 0), desired)
+        if status.get('numberAvailable', 0) < wanted:
+            return PENDING, '%d of %d updated pods available' % (status.get('numberAvailable', 0), desired)
+        return READY, '%d of %d pods available' % (status.get('numberAvailable', 0), desired)
+
+    if kind in ('StatefulSet', 'ReplicaSet', 'ReplicationController') and \
+            status.get('replicas', 0) > spec.get('replicas', 1):
+        return PENDING, '%d replicas pending termination' % (status['replicas'] - spec.get('replicas', 1))
+
+    if kind == 'StatefulSet':
+        replicas = spec.get('replicas', 1)
+        budget = unavailable_budget(max_unavailable, replicas)
+        if status.get('readyReplicas', 0) < replicas - budget:
+            return PENDING, '%d of %d replicas ready' % (status.get('readyReplicas', 0), replicas)
+        strategy = spec.get('updateStrategy') or {}
+        if strategy.get('type', 'RollingUpdate') == 'RollingUpdate' and \
+                not (strategy.get('rollingUpdate') or {}).get('partition') and \
+                status.get('updateRevision') != status.get('currentRevision') and \
+                status.get('updatedReplicas', 0) < replicas - budget:
+            return PENDING, 'waiting for the rolling update to finish'
+        return READY, '%d replicas ready' % min(status.get('readyReplicas', 0), replicas)
+
+    if kind in ('ReplicaSet', 'ReplicationController'):
+        replicas = spec.get('replicas', 1)
+        if status.get('readyReplicas', 0) < replicas - unavailable_budget(max_unavailable, replicas):
+            return PENDING, '%d of %d replicas ready' % (status.get('readyReplicas', 0), replicas)
+        return READY, '%d replicas ready' % min(status.get('readyReplicas', 0), replicas)
+
+    if kind == 'Job':
+        if (conditions.get('Failed') or {}).get('status') == 'True':
+            return FAILED, conditions['Failed'].get('message') or 'job failed'
+        if (conditions.get('Complete') or {}).get('status') == 'True':
+            return READY, 'job complete'
+        return PENDING, '%d of %d completions' % (status.get('succeeded', 0), spec.get('completions', 1))
+
+    if kind == 'Pod':
+        if status.get('phase') == 'Failed':
+            return FAILED, status.get('message') or 'pod failed'
+        if status.get('phase') == 'Succeeded' or \
+                (conditions.get('Ready') or {}).get('status') == 'True':
+            return READY, 'pod ready'
+        return PENDING, 'pod %s' % status.get('phase', 'Pending')
+
+    if kind == 'CustomResourceDefinition':
+        if (conditions.get('Established') or {}).get('status') == 'True':
+            return READY, 'established'
+        return PENDING, 'waiting for the CRD to be established'
+
+    return READY, 'exists'
+
+
+class KubeApiClient(object):
+    """Talks to the API server over one keep-alive connection per thread.
+
+    The discovery documents are fetched lazily and kept for the lifetime of
+    the client, so a module run pays for discovery at most once per API group.
+    With a cache_dir they are also written to disk and reused by later runs
+    for as long as the server reports the same version.
+
+    After use_session() requests go through a KubeSessionProxy on a unix
+    socket instead, which keeps its connections to the API server open
+    across module runs.
+    """
+
+    def __init__(self, server, ca_data=None, cert_data=None, key_data=None,
+                 token=None, username=None, password=None, insecure=False,
+                 timeout=30, cache_dir=None, retries=0, backoff=0.5, max_backoff=10):
+        url = urlparse(server)
+        self.server = server
+        self.scheme = url.scheme or 'https'
+        self.host = url.hostname
+        self.port = url.port or (443 if self.scheme == 'https' else 80)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.headers = {'Accept': 'application/json',
+                        'User-Agent': 'kubespray-kube-module'}
+        if token:
+            self.headers['Authorization'] = 'Bearer ' + token
+        elif username:
+            credentials = '%s:%s' % (username, password or '')
+            self.headers['Authorization'] = 'Basic ' + base64.b64encode(
+                credentials.encode('utf-8')).decode('ascii')
+
+        self.ssl_context = None
+        if self.scheme == 'https':
+            self.ssl_context = self._ssl_context(ca_data, cert_data, key_data,
+                                                 insecure)
+
+        # Identifies the server and credentials, so that a session proxy is
+        # only shared by clients that would authenticate the same way.
+        identity = hashlib.sha256(server.encode('utf-8'))
+        for blob in (ca_data, cert_data, key_data,
+                     self.headers.get('Authorization', '').encode('utf-8'),
+                     str(bool(insecure)).encode('ascii')):
+            identity.update(b'\0' + (blob or b''))
+        self.identity = identity.hexdigest()
+        self.session_socket = None
+
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._resources = {}
+        self._groups = None
+        self._cache_lock = threading.RLock()
+        self._cache_file = None
+        self._cache_version = None
+        self._cache_stale = False
+        self._server_version = None
+        if cache_dir:
+            self._cache_file = os.path.join(
+                os.path.expanduser(cache_dir), 'discovery',
+                '%s_%s.json' % (self.host, self.port))
+
+    @classmethod
+    def from_kubeconfig(cls, config, basedir='.', context=None, server=None,
+                        timeout=30, cache_dir=None, **kwargs):
+        """Builds a client from a parsed kubeconfig dict."""
+        def named(section, name):
+            for entry in config.get(section) or []:
+                if entry.get('name') == name:
+                    return entry.get(section[:-1]) or {}
+            raise ValueError('%s %s not found in kubeconfig' % (section[:-1], name))
+
+        def data(section, key):
+            if section.get(key + '-data'):
+                return base64.b64decode(section[key + '-data'])
+            if section.get(key):
+                with open(os.path.join(basedir, section[key]), 'rb') as f:
+                    return f.read()
+            return None
+
+        ctx = named('contexts', context or config.get('current-context'))
+        cluster = named('clusters', ctx.get('cluster'))
+        user = named('users', ctx.get('user')) if ctx.get('user') else {}
+
+        token = user.get('token')
+        if not token and user.get('tokenFile'):
+            with open(os.path.join(basedir, user['tokenFile'])) as f:
+                token = f.read().strip()
+
+        return cls(server or cluster.get('server'),
+                   ca_data=data(cluster, 'certificate-authority'),
+                   cert_data=data(user, 'client-certificate'),
+                   key_data=data(user, 'client-key'),
+                   token=token,
+                   username=user.get('username'),
+                   password=user.get('password'),
+                   insecure=cluster.get('insecure-skip-tls-verify', False),
+                   timeout=timeout,
+                   cache_dir=cache_dir,
+                   **kwargs)
+
+    def _ssl_context(self, ca_data, cert_data, key_data, insecure):
+        if ca_data and not insecure:
+            # Like kubectl, only trust the cluster CA; this also skips loading
+            # the system CA store on every module run.
+            context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_CLIENT', ssl.PROTOCOL_SSLv23))
+            context.verify_mode = ssl.CERT_REQUIRED
+            context.check_hostname = True
+            context.load_verify_locations(cadata=ca_data.decode('ascii'))
+        else:
+            context = ssl.create_default_context()
+        if insecure:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        if cert_data and key_data:
+            # load_cert_chain only accepts paths; the files are removed as
+            # soon as the context holds the key material.
+            paths = []
+            try:
+                for blob in (cert_data, key_data):
+                    fd, path = tempfile.mkstemp()
+                    paths.append(path)
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(blob)
+                context.load_cert_chain(paths[0], paths[1])
+            finally:
+                for path in paths:
+                    os.remove(path)
+        return context
+
+    def _connect(self):
+        if self.session_socket:
+            conn = UnixHTTPConnection(self.session_socket, timeout=self.timeout)
+            try:
+                conn.connect()
+                return conn
+            except socket.error:
+                # The proxy exited, e.g. after its idle timeout.
+                self.session_socket = None
+        return self._connect_server()
+
+    def _connect_server(self):
+        if self.scheme == 'https':
+            return http_client.HTTPSConnection(self.host, self.port,
+                                               timeout=self.timeout,
+                                               context=self.ssl_context)
+        return http_client.HTTPConnection(self.host, self.port,
+                                          timeout=self.timeout)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _count_call(self):
+        with self._lock:
+            self.calls += 1
+        self._local.calls = getattr(self._local, 'calls', 0) + 1
+
+    def thread_calls(self):
+        """Returns the number of requests sent by the calling thread, to
+        attribute calls to objects applied in parallel."""
+        return getattr(self._local, 'calls', 0)
+
+    def request(self, method, path, body=None, query=None,
+                content_type='application/json', retry_status=RETRYABLE_STATUS):
+        """Sends one request and returns the decoded JSON response.
+
+        Connection errors and retry_status responses are retried up to
+        retries times with jittered exponential backoff.
+        """
+        if query:
+            path += '?' + urlencode(query)
+        headers = dict(self.headers)
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = content_type
+
+        attempt = 0
+        while True:
+            try:
+                return self._request_once(method, path, payload, headers)
+            except KubeApiError as e:
+                if e.status not in retry_status or attempt >= self.retries:
+                    raise
+            except (http_client.HTTPException, socket.error):
+                if attempt >= self.retries:
+                    raise
+            time.sleep(retry_delay(attempt, self.backoff, self.max_backoff))
+            attempt += 1
+
+    def _request_once(self, method, path, payload, headers):
+        self._count_call()
+
+        reused = getattr(self._local, 'conn', None) is not None
+        try:
+            response = self._send(method, path, payload, headers)
+        except (http_client.HTTPException, socket.error):
+            # The server may have closed an idle keep-alive connection.
+            self.close()
+            if not reused:
+                raise
+            response = self._send(method, path, payload, headers)
+
+        status, reason, data = response
+        if status >= 400:
+            raise KubeApiError(status, reason, data)
+        if not data:
+            return None
+        return json.loads(data)
+
+    def _send(self, method, path, payload, headers):
+        conn = self._connection()
+        conn.request(method, path, payload, headers)
+        response = conn.getresponse()
+        data = response.read().decode('utf-8')
+        return response.status, response.reason, data
+
+    def use_session(self, cache_dir=DEFAULT_CACHE_DIR,
+                    idle_timeout=DEFAULT_SESSION_TIMEOUT):
+        """Sends the requests of this client through the session proxy for
+        its server and credentials, starting one if none is listening.
+
+        Returns False, leaving the client unchanged, when no proxy could be
+        reached.
+        """
+        path = os.path.join(os.path.expanduser(cache_dir), 'sessions',
+                            self.identity[:16] + '.sock')
+        if not start_session_proxy(self, path, idle_timeout):
+            return False
+        self.close()
+        self.session_socket = path
+        return True
+
+    # Discovery
+
+    def _load_cache(self):
+        """Loads the discovery cache once, if it was written for the version
+        the server reports now."""
+        if self._cache_file is None or self._cache_version is not None:
+            return
+        with self._cache_lock:
+            if self._cache_version is not None:
+                return
+            version = self.server_version()
+            try:
+                with open(self._cache_file) as f:
+                    cached = json.load(f)
+            except (IOError, OSError, ValueError):
+                cached = {}
+            if cached.get('server') == self.server and cached.get('version') == version:
+                self._groups = cached.get('groups')
+                self._resources.update(cached.get('resources') or {})
+            else:
+                self._cache_stale = True
+            self._cache_version = version
+
+    def server_version(self):
+        """Returns the gitVersion of the API server, e.g. v1.13.2."""
+        if self._server_version is None:
+            self._server_version = (self.request('GET', '/version') or {}).get('gitVersion') or ''
+        return self._server_version
+
+    def supports_dry_run(self):
+        """Server side dry run is beta, and on by default, since 1.13. Older
+        servers ignore the dryRun parameter and would persist the write."""
+        return parse_version(self.server_version()) >= (1, 13)
+
+    def _save_cache(self):
+        if self._cache_file is None:
+            return
+        with self._cache_lock:
+            directory = os.path.dirname(self._cache_file)
+            try:
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                # Written next to the cache and renamed so that concurrent
+                # runs never read a partial file.
+                fd, path = tempfile.mkstemp(dir=directory)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({'server': self.server, 'version': self._cache_version,
+                               'groups': self._groups, 'resources': self._resources}, f)
+                os.rename(path, self._cache_file)
+            except (IOError, OSError):
+                pass
+
+    def _refresh_discovery(self):
+        """Drops cached discovery after a lookup miss, so kinds registered
+        since the cache was written (e.g. new CRDs) are found. Returns False
+        if discovery was already fetched from the server during this run."""
+        with self._cache_lock:
+            if self._cache_version is None or self._cache_stale:
+                return False
+            self._cache_stale = True
+            self._groups = None
+            self._resources = {}
+            return True
+
+    def api_groups(self):
+        """Returns the preferred group/version of every API group."""
+        self._load_cache()
+        if self._groups is None:
+            groups = self.request('GET', '/apis').get('groups') or []
+            self._groups = ['v1'] + [g['preferredVersion']['groupVersion']
+                                     for g in groups]
+            self._save_cache()
+        return self._groups
+
+    def api_resources(self, group_version):
+        self._load_cache()
+        if group_version not in self._resources:
+            prefix = '/api/' if group_version == 'v1' else '/apis/'
+            try:
+                found = self.request('GET', prefix + group_version)
+            except KubeApiError as e:
+                if e.status != 404:
+                    raise
+                found = {}
+            self._resources[group_version] = [
+                dict(r, groupVersion=group_version)
+                for r in found.get('resources') or []
+                if '/' not in r['name']]
+            self._save_cache()
+        return self._resources[group_version]
+
+    def resource_for_kind(self, api_version, kind):
+        for resource in self.api_resources(api_version):
+            if resource['kind'] == kind:
+                return resource
+        if self._refresh_discovery():
+            return self.resource_for_kind(api_version, kind)
+        raise KubeApiError(404, 'no resource of kind %s in %s' % (kind, api_version))
+
+    def resource_for_name(self, name):
+        """Resolves a kubectl style resource name such as deploy or svc."""
+        lookup, _, group = name.lower().partition('.')
+        for group_version in self.api_groups():
+            if group and group_version.split('/')[0] != group:
+                continue
+            for resource in self.api_resources(group_version):
+                names = [resource['name'], resource.get('singularName'),
+                         resource['kind'].lower()] + (resource.get('shortNames') or [])
+                if lookup in names:
+                    return resource
+        if self._refresh_discovery():
+            return self.resource_for_name(name)
+        raise KubeApiError(404, 'the server does not have a resource type "%s"' % lookup)
+
+    def path(self, resource, namespace=None, name=None, subresource=None):
+        group_version = resource['groupVersion']
+        parts = ['/api' if group_version == 'v1' else '/apis', group_version]
+        if resource.get('namespaced') and namespace:
+            parts.extend(['namespaces', quote(namespace, safe='')])
+        parts.append(resource['name'])
+        if name:
+            parts.append(quote(name, safe=''))
+        if subresource:
+            parts.append(subresource)
+        return '/'.join(parts)
+
+    # Object operations
+
+    def get(self, resource, name, namespace=None):
+        try:
+            return self.request('GET', self.path(resource, namespace, name))
+        except KubeApiError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def list(self, resource, namespace=None, selector=None, field_selector=None):
+        return self.list_versioned(resource, namespace, selector, field_selector)[0]
+
+    def list_versioned(self, resource, namespace=None, selector=None,
+                       field_selector=None):
+        """Returns the items of a collection and its resourceVersion, the
+        starting point for a watch."""
+        query = {}
+        if selector:
+            query['labelSelector'] = selector
+        if field_selector:
+            query['fieldSelector'] = field_selector
+        found = self.request('GET', self.path(resource, namespace), query=query)
+        items = found.get('items') or []
+        for item in items:
+            item.setdefault('kind', resource['kind'])
+            item.setdefault('apiVersion', resource['groupVersion'])
+        return items, (found.get('metadata') or {}).get('resourceVersion')
+
+    def watch(self, resource, namespace=None, resource_version=None,
+              timeout=60, selector=None):
+        """Yields (event type, object) from a watch on a collection.
+
+        The stream runs on its own connection and ends after timeout seconds
+        or when the server closes it. ERROR events are raised as
+        KubeApiError, a 410 status meaning resource_version is too old.
+        """
+        query = {'watch': 'true', 'timeoutSeconds': max(1, int(timeout))}
+        if resource_version:
+            query['resourceVersion'] = resource_version
+        if selector:
+            query['labelSelector'] = selector
+        path = self.path(resource, namespace) + '?' + urlencode(query)
+
+        self._count_call()
+
+        # Watches are long lived streams and bypass the session proxy.
+        conn = self._connect_server()
+        conn.timeout = timeout + self.timeout
+        try:
+            conn.request('GET', path, None, self.headers)
+            response = conn.getresponse()
+            if response.status >= 400:
+                raise KubeApiError(response.status, response.reason,
+                                   response.read().decode('utf-8'))
+            for line in iter_lines(response):
+                event = json.loads(line)
+                obj = event.get('object') or {}
+                if event.get('type') == 'ERROR':
+                    raise KubeApiError(obj.get('code', 500), obj.get('reason', 'watch error'),
+                                       json.dumps(obj))
+                obj.setdefault('kind', resource['kind'])
+                yield event.get('type'), obj
+        finally:
+            conn.close()
+
+    def wait_for(self, objects, timeout, condition=None, backoff=1, max_backoff=30,
+                 max_unavailable=None, ready_times=None):
+        """Watches objects until all of them are ready, failed or timeout
+        seconds have passed.
+
+        objects is a list of (resource, namespace, name). One watch is opened
+        per resource and namespace, all of them in parallel and bounded by the
+        same deadline. Broken or expired watches are resumed with exponential
+        backoff. Returns a dict mapping (kind, namespace, name) to
+        (state, message). When given, ready_times gets the time.time() at
+        which every object was first seen ready.
+        """
+        deadline = time.time() + timeout
+        groups = {}
+        for resource, namespace, name in objects:
+            key = (resource['groupVersion'], resource['name'], namespace)
+            groups.setdefault(key, (resource, namespace, set()))[2].add(name)
+
+        statuses = {}
+        for resource, namespace, names in groups.values():
+            for name in names:
+                statuses[(resource['kind'], namespace, name)] = (PENDING, 'not found')
+
+        threads = [threading.Thread(target=self._watch_group,
+                                    args=(resource, namespace, names, deadline,
+                                          condition, statuses, backoff, max_backoff,
+                                          max_unavailable,
+                                          ready_times if ready_times is not None else {}))
+                   for resource, namespace, names in groups.values()]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()) + self.timeout)
+        return statuses
+
+    def _watch_group(self, resource, namespace, names, deadline, condition,
+                     statuses, backoff, max_backoff, max_unavailable, ready_times):
+        pending = set(names)
+        delay = backoff
+        resource_version = None
+
+        def update(obj, deleted=False):
+            name = obj.get('metadata', {}).get('name')
+            if name not in pending:
+                return
+            key = (resource['kind'], namespace, name)
+            if deleted:
+                statuses[key] = (PENDING, 'deleted')
+                return
+            statuses[key] = object_status(obj, condition, max_unavailable)
+            if statuses[key][0] == READY:
+                ready_times.setdefault(key, time.time())
+            if statuses[key][0] != PENDING:
+                pending.discard(name)
+
+        while pending and time.time() < deadline:
+            try:
+                if resource_version is None:
+                    items, resource_version = self.list_versioned(resource, namespace)
+                    for obj in items:
+                        update(obj)
+                    if not pending:
+                        return
+                for event, obj in self.watch(resource, namespace, resource_version,
+                                             timeout=deadline - time.time()):
+                    resource_version = obj.get('metadata', {}).get('resourceVersion', resource_version)
+                    update(obj, deleted=event == 'DELETED')
+                    if not pending:
+                        return
+                delay = backoff
+            except KubeApiError as e:
+                if e.status == 410:
+                    resource_version = None
+                    continue
+                self._backoff(delay, deadline)
+                delay = min(delay * 2, max_backoff)
+            except (http_client.HTTPException, socket.error, ValueError):
+                self._backoff(delay, deadline)
+                delay = min(delay * 2, max_backoff)
+
+    @staticmethod
+    def _backoff(delay, deadline):
+        time.sleep(max(0, min(delay, deadline - time.time())))
+
+    def create(self, resource, obj, namespace=None, dry_run=False):
+        return self.request('POST', self.path(resource, namespace), body=obj,
+                            query={'dryRun': 'All'} if dry_run else None)
+
+    def patch(self, resource, name, patch, namespace=None,
+              patch_type=MERGE_PATCH, dry_run=False):
+        return self.request('PATCH', self.path(resource, namespace, name),
+                            body=patch, content_type=patch_type,
+                            query={'dryRun': 'All'} if dry_run else None)
+
+    def scale(self, resource, name, replicas, namespace=None):
+        """Sets the replicas of a workload through its scale subresource."""
+        return self.request('PATCH', self.path(resource, namespace, name, 'scale'),
+                            body={'spec': {'replicas': replicas}},
+                            content_type=MERGE_PATCH)
+
+    def delete(self, resource, name, namespace=None, body=None):
+        try:
+            return self.request('DELETE', self.path(resource, namespace, name),
+                                body=body)
+        except KubeApiError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def delete_collection(self, resource, namespace=None, selector=None, body=None):
+        """Deletes every object of a collection matching selector in one call
+        and returns the deleted objects."""
+        query = {'labelSelector': selector} if selector else None
+        found = self.request('DELETE', self.path(resource, namespace),
+                             body=body, query=query)
+        return found.get('items') or []
+
+    def evict(self, resource, name, namespace, grace_period=None):
+        """Evicts a pod through its eviction subresource, which honours the
+        PodDisruptionBudgets of the pod.
+
+        Returns False when a budget does not allow the eviction yet (429),
+        True once it is accepted or the pod is gone.
+        """
+        body = {'apiVersion': 'policy/v1beta1', 'kind': 'Eviction',
+                'metadata': {'name': name, 'namespace': namespace}}
+        if grace_period is not None and grace_period >= 0:
+            body['deleteOptions'] = {'kind': 'DeleteOptions', 'apiVersion': 'v1',
+                                     'gracePeriodSeconds': grace_period}
+        try:
+            self.request('POST', self.path(resource, namespace, name, 'eviction'), body=body,
+                         retry_status=[s for s in RETRYABLE_STATUS if s != 429])
+        except KubeApiError as e:
+            if e.status == 429:
+                return False
+            if e.status == 404:
+                return True
+            raise
+        return True
+
+    def object_resource(self, obj, namespace=None):
+        """Returns the resource and effective namespace of a manifest object."""
+        resource = self.resource_for_kind(obj.get('apiVersion', 'v1'), obj['kind'])
+        if not resource.get('namespaced'):
+            return resource, None
+        return resource, obj.get('metadata', {}).get('namespace') or namespace or 'default'
+
+    def apply(self, obj, namespace=None):
+        """Creates or patches obj like kubectl apply.
+
+        Returns the verb kubectl would print: created, configured or
+        unchanged. Objects whose last-applied annotation matches the manifest
+        are not written at all. Built-in kinds are patched with a strategic
+        merge patch and custom resources with a JSON merge patch, as kubectl
+        does. A conflict, e.g. the object was created or changed by someone
+        else in between, re-reads the object and plans the write again.
+        """
+        resource, namespace = self.object_resource(obj, namespace)
+        desired = desired_object(obj, namespace)
+        name = desired['metadata']['name']
+        content_type = patch_type(resource['groupVersion'])
+        attempt = 0
+        while True:
+            live = self.get(resource, name, namespace)
+            patch = apply_patch(desired, live, content_type == STRATEGIC_MERGE_PATCH)
+            try:
+                if patch is None:
+                    self.create(resource, desired, namespace)
+                    return 'created'
+                if not patch:
+                    return 'unchanged'
+                self.patch(resource, name, patch, namespace, content_type)
+                return 'configured'
+            except KubeApiError as e:
+                if e.status != 409 or attempt >= self.retries:
+                    raise
+            time.sleep(retry_delay(attempt, self.backoff, self.max_backoff))
+            attempt += 1
+
+    def dry_run_apply(self, obj, namespace=None):
+        """Returns (verb, live, result) of applying obj without persisting
+        anything.
+
+        Servers supporting dry run compute result themselves, with defaults
+        and admission applied. On older servers the patch is merged into the
+        live object locally.
+        """
+        resource, namespace = self.object_resource(obj, namespace)
+        desired = desired_object(obj, namespace)
+        name = desired['metadata']['name']
+        live = self.get(resource, name, namespace)
+        content_type = patch_type(resource['groupVersion'])
+        strategic = content_type == STRATEGIC_MERGE_PATCH
+        patch = apply_patch(desired, live, strategic)
+        server = self.supports_dry_run()
+        if patch is None:
+            result = self.create(resource, desired, namespace, dry_run=True) if server else desired
+            return 'created', None, result
+        if not patch:
+            return 'unchanged', live, live
+        if server:
+            result = self.patch(resource, name, patch, namespace, content_type, dry_run=True)
+        else:
+            merge = strategic_merge if strategic else merge_patch
+            result = merge(json.loads(json.dumps(live)), patch)
+        return 'configured', live, result
+
+
+class UnixHTTPConnection(http_client.HTTPConnection):
+    """HTTP connection over a unix socket, used to reach a session proxy."""
+
+    def __init__(self, path, timeout=30):
+        http_client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except socket.error:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class KubeSessionHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def address_string(self):
+        return 'session'
+
+    def forward(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = self.rfile.read(length) if length else None
+        status, reason, content_type, data = self.server.forward(
+            self.command, self.path, payload, self.headers.get('Content-Type'))
+        self.send_response(status, reason)
+        self.send_header('Content-Type', content_type or 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = forward
+
+
+class KubeSessionProxy(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Forwards the requests received on a unix socket to the API server of
+    client over a pool of keep-alive connections.
+
+    Module runs talking to the proxy skip the TCP and TLS handshakes with the
+    API server. The proxy authenticates with the credentials of client and
+    ignores the ones sent by its own clients; the socket is only reachable
+    by its owner. It exits after idle_timeout seconds without requests.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, client):
+        socketserver.UnixStreamServer.__init__(self, path, KubeSessionHandler)
+        self.client = client
+        self.path = path
+        self.last_used = time.time()
+        self.active = 0
+        self._pool = []
+        self._pool_lock = threading.Lock()
+
+    def _checkout(self):
+        with self._pool_lock:
+            if self._pool:
+                return self._pool.pop(), True
+        return self.client._connect_server(), False
+
+    def _checkin(self, conn):
+        with self._pool_lock:
+            self._pool.append(conn)
+
+    def forward(self, method, path, payload, content_type):
+        with self._pool_lock:
+            self.active += 1
+        try:
+            return self._forward(method, path, payload, content_type)
+        finally:
+            with self._pool_lock:
+                self.active -= 1
+            self.last_used = time.time()
+
+    def _forward(self, method, path, payload, content_type):
+        self.last_used = time.time()
+        headers = dict(self.client.headers)
+        if content_type:
+            headers['Content-Type'] = content_type
+        conn, reused = self._checkout()
+        try:
+            conn.request(method, path, payload, headers)
+            response = conn.getresponse()
+        except (http_client.HTTPException, socket.error):
+            # The server may have closed an idle keep-alive connection.
+            conn.close()
+            if not reused:
+                raise
+            conn = self.client._connect_server()
+            conn.request(method, path, payload, headers)
+            response = conn.getresponse()
+        data = response.read()
+        self._checkin(conn)
+        return response.status, response.reason, response.getheader('Content-Type'), data
+
+    def serve(self, idle_timeout):
+        thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.2})
+        thread.daemon = True
+        thread.start()
+        while True:
+            idle = time.time() - self.last_used
+            if idle >= idle_timeout:
+                break
+            time.sleep(min(1, idle_timeout - idle))
+        # Unlinked under the start lock, so that a proxy started meanwhile
+        # keeps its socket; clients then connect to the server directly.
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        self.shutdown()
+        self.server_close()
+        deadline = time.time() + self.client.timeout
+        while self.active and time.time() < deadline:
+            time.sleep(0.05)
+        with self._pool_lock:
+            for conn in self._pool:
+                conn.close()
+
+
+def session_alive(path):
+    conn = UnixHTTPConnection(path, timeout=1)
+    try:
+        conn.connect()
+        return True
+    except socket.error:
+        return False
+    finally:
+        conn.close()
+
+
+def start_session_proxy(client, path, idle_timeout=DEFAULT_SESSION_TIMEOUT):
+    """Starts a KubeSessionProxy for client listening on path, in a detached
+    process, unless one is already listening there.
+
+    Returns True once a proxy accepts connections on path.
+    """
+    # Longer paths do not fit in sockaddr_un.
+    if len(path) > 100:
+        return False
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            return False
+    try:
+        os.chmod(directory, 0o700)
+        lock = open(path + '.lock', 'a')
+    except (IOError, OSError):
+        return False
+
+    try:
+        # Concurrent module runs start a single proxy.
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if session_alive(path):
+            return True
+        if os.path.exists(path):
+            os.remove(path)
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.setsid()
+                if os.fork():
+                    os._exit(0)
+                # Ansible waits for the module's output streams to close.
+                devnull = os.open(os.devnull, os.O_RDWR)
+                for fd in (0, 1, 2):
+                    os.dup2(devnull, fd)
+                os.closerange(3, 1024)
+                os.umask(0o177)
+                client._local = threading.local()
+                client._lock = threading.Lock()
+                KubeSessionProxy(path, client).serve(idle_timeout)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            if session_alive(path):
+                return True
+            time.sleep(0.05)
+        return False
+    finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Per-task latency of consecutive kube tasks (engine=api) against the stub
+# API server, with and without the on-disk discovery cache.
+#
+#   python tests/unit/bench_discovery.py [--tasks 20] [--latency 0.005]
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import ansible.module_utils
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'library'))
+ansible.module_utils.__path__.append(os.path.join(HERE, '..', '..', 'module_utils'))
+
+import kube  # noqa
+from stub_apiserver import StubApiServer  # noqa
+from test_kube import MANIFEST, FakeModule  # noqa
+
+# One object per API group, like the manifests of a kubespray addon.
+OBJECTS = [('ConfigMap', 'v1'), ('Deployment', 'apps/v1'),
+           ('Job', 'batch/v1'), ('ClusterRole', 'rbac.authorization.k8s.io/v1')]
+
+
+def write_manifests(tmpdir):
+    filenames = []
+    for kind, api_version in OBJECTS:
+        filename = os.path.join(tmpdir, '%s.yml' % kind.lower())
+        with open(filename, 'w') as f:
+            f.write(MANIFEST % dict(name='bench', kind=kind, value='a',
+                                    api_version=api_version))
+        filenames.append(filename)
+    return filenames
+
+
+def run_tasks(server, kubeconfig, filenames, cache_dir, tasks, cached):
+    """Runs one kube task per iteration, each with a fresh client as in a new
+    module process, and returns the wall time of every task in ms."""
+    timings = []
+    for _ in range(tasks):
+        if not cached:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        start = time.time()
+        manager = kube.KubeManager(FakeModule(engine='api', kubeconfig=kubeconfig,
+                                              cache_dir=cache_dir, filename=filenames))
+        manager.replace()
+        manager.client.close()
+        timings.append((time.time() - start) * 1000)
+    return timings
+
+
+def report(label, timings, calls):
+    timings = sorted(timings)
+    print('%-18s mean %7.2f ms  p50 %7.2f ms  max %7.2f ms  %5.1f requests/task' % (
+        label, sum(timings) / len(timings), timings[len(timings) // 2],
+        timings[-1], calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tasks', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='seconds added to every API response')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    server = StubApiServer().start()
+    try:
+        kubeconfig = os.path.join(tmpdir, 'kubeconfig')
+        with open(kubeconfig, 'w') as f:
+            yaml.safe_dump(server.kubeconfig(), f)
+        filenames = write_manifests(tmpdir)
+        cache_dir = os.path.join(tmpdir, 'cache')
+        run_tasks(server, kubeconfig, filenames, cache_dir, 1, False)
+        server.latency = args.latency
+
+        for label, cached in (('without cache', False), ('with cache', True)):
+            del server.requests[:]
+            timings = run_tasks(server, kubeconfig, filenames, cache_dir,
+                                args.tasks, cached)
+            report(label, timings, float(len(server.requests)) / args.tasks)
+    finally:
+        server.stop()
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Overhead of KubeManager operations on 10, 100 and 1000 objects, with the
+# kubectl engine against fake_kubectl.py and the api engine against the stub
+# API server. Every operation reports its wall time, the kubectl processes
+# it spawned and the API requests it sent.
+#
+#   python tests/unit/bench_kube.py [--sizes 10,100,1000] [--engines kubectl,api]
+#   python tests/unit/bench_kube.py --save tests/unit/bench_kube_baseline.json
+#   python tests/unit/bench_kube.py --baseline tests/unit/bench_kube_baseline.json
+#
+# With --baseline the run fails when an operation spawns more processes or
+# sends more requests than recorded, or, with --tolerance, takes more than
+# that factor of the recorded wall time.
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import ansible.module_utils
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'library'))
+ansible.module_utils.__path__.append(os.path.join(HERE, '..', '..', 'module_utils'))
+
+import kube  # noqa
+from stub_apiserver import StubApiServer  # noqa
+from test_kube import MANIFEST, FakeModule  # noqa
+
+# (name, state, manifest value); replace changes every object, noop applies
+# them again unchanged.
+OPERATIONS = [('create', 'present', 'a'), ('exists', 'present', 'a'),
+              ('replace', 'latest', 'b'), ('noop', 'latest', 'b'),
+              ('delete', 'absent', 'b')]
+COUNTERS = ('spawns', 'api_calls')
+
+
+def write_manifests(tmpdir, count, value):
+    filenames = []
+    for i in range(count):
+        filename = os.path.join(tmpdir, 'bench-%04d.yml' % i)
+        with open(filename, 'w') as f:
+            f.write(MANIFEST % dict(name='bench-%04d' % i, kind='ConfigMap',
+                                    value=value, api_version='v1'))
+        filenames.append(filename)
+    return filenames
+
+
+def run_operation(operation, filenames, params, server):
+    """Runs one operation as a fresh module run and returns its counters."""
+    module = FakeModule(filename=filenames, **params)
+    requests = len(server.requests) if server else 0
+    start = time.time()
+    manager = kube.KubeManager(module)
+    if operation == 'create':
+        manager.create()
+    elif operation == 'exists':
+        manager.exists()
+    elif operation == 'delete':
+        manager.delete()
+    else:
+        manager.replace()
+    wall = time.time() - start
+    if manager.client:
+        manager.client.close()
+    return {'wall_s': round(wall, 3), 'spawns': len(module.commands),
+            'api_calls': len(server.requests) - requests if server else 0}
+
+
+def run_size(engine, count, tmpdir):
+    """Runs every operation on count objects against a clean cluster."""
+    workdir = os.path.join(tmpdir, '%s-%d' % (engine, count))
+    os.makedirs(workdir)
+    os.environ['FAKE_KUBECTL_STATE'] = os.path.join(workdir, 'state.json')
+    server = None
+    params = {'cache_dir': os.path.join(workdir, 'cache')}
+    if engine == 'api':
+        server = StubApiServer().start()
+        params['engine'] = 'api'
+        params['kubeconfig'] = os.path.join(workdir, 'kubeconfig')
+        with open(params['kubeconfig'], 'w') as f:
+            yaml.safe_dump(server.kubeconfig(), f)
+    results = {}
+    try:
+        for operation, state, value in OPERATIONS:
+            filenames = write_manifests(workdir, count, value)
+            results[operation] = run_operation(operation, filenames, dict(params, state=state), server)
+    finally:
+        if server:
+            server.stop()
+    return results
+
+
+def run(engines, sizes):
+    """Returns {engine: {size: {operation: counters}}}, sizes as strings."""
+    tmpdir = tempfile.mkdtemp()
+    state_file = os.environ.get('FAKE_KUBECTL_STATE')
+    try:
+        return dict((engine, dict((str(size), run_size(engine, size, tmpdir)) for size in sizes))
+                    for engine in engines)
+    finally:
+        if state_file is None:
+            os.environ.pop('FAKE_KUBECTL_STATE', None)
+        else:
+            os.environ['FAKE_KUBECTL_STATE'] = state_file
+        shutil.rmtree(tmpdir)
+
+
+def regressions(results, baseline, tolerance=None):
+    """Returns a message for every operation doing more work than in baseline."""
+    found = []
+    for engine, sizes in sorted(results.items()):
+        for size, operations in sorted(sizes.items(), key=lambda s: int(s[0])):
+            for operation, counters in sorted(operations.items()):
+                expected = baseline.get(engine, {}).get(size, {}).get(operation)
+                if expected is None:
+                    continue
+                for counter in COUNTERS:
+                    if counters[counter] > expected[counter]:
+                        found.append('%s %s x%s: %d %s, baseline %d' % (
+                            engine, operation, size, counters[counter], counter, expected[counter]))
+                if tolerance and counters['wall_s'] > expected['wall_s'] * tolerance:
+                    found.append('%s %s x%s: %.3fs, baseline %.3fs' % (
+                        engine, operation, size, counters['wall_s'], expected['wall_s']))
+    return found
+
+
+def report(results):
+    print('%-8s %-8s %6s %10s %8s %10s' % ('engine', 'op', 'objects', 'wall ms', 'spawns', 'api calls'))
+    for engine, sizes in sorted(results.items()):
+        for size, operations in sorted(sizes.items(), key=lambda s: int(s[0])):
+            for operation, _, _ in OPERATIONS:
+                counters = operations[operation]
+                print('%-8s %-8s %6s %10.1f %8d %10d' % (
+                    engine, operation, size, counters['wall_s'] * 1000,
+                    counters['spawns'], counters['api_calls']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='10,100,1000')
+    parser.add_argument('--engines', default='kubectl,api')
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--baseline', help='fail on regressions against this file')
+    parser.add_argument('--tolerance', type=float,
+                        help='also fail when an operation takes more than this factor '
+                             'of the baseline wall time')
+    args = parser.parse_args()
+
+    results = run(args.engines.split(','), [int(s) for s in args.sizes.split(',')])
+    report(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for message in found:
+            print('REGRESSION ' + message)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Per-item latency of a kube task looping over nodes (engine=api), as with
+# delegate_to a master, against the stub API server over TLS, with and
+# without the session proxy. Requires the openssl command.
+#
+#   python tests/unit/bench_session.py [--items 1000] [--latency 0]
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import ansible.module_utils
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'library'))
+ansible.module_utils.__path__.append(os.path.join(HERE, '..', '..', 'module_utils'))
+
+import kube  # noqa
+from stub_apiserver import StubApiServer  # noqa
+from test_kube import FakeModule  # noqa
+
+
+def self_signed(tmpdir):
+    certfile = os.path.join(tmpdir, 'apiserver.crt')
+    keyfile = os.path.join(tmpdir, 'apiserver.key')
+    subprocess.check_call(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+         '-subj', '/CN=kube-apiserver', '-addext', 'subjectAltName=IP:127.0.0.1',
+         '-keyout', keyfile, '-out', certfile],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+def node(name, value):
+    return {'apiVersion': 'v1', 'kind': 'Node',
+            'metadata': {'name': name, 'labels': {'bench': value}}}
+
+
+def run_items(kubeconfig, cache_dir, items, value, session):
+    """Labels one node per item, each with a fresh client as in a new module
+    process, and returns the wall time of every item in ms."""
+    timings = []
+    for i in range(items):
+        start = time.time()
+        manager = kube.KubeManager(FakeModule(
+            engine='api', kubeconfig=kubeconfig, cache_dir=cache_dir,
+            session=session, session_timeout=2, definition=node('node-%d' % i, value)))
+        manager.replace()
+        manager.client.close()
+        timings.append((time.time() - start) * 1000)
+    return timings
+
+
+def report(label, timings, connections):
+    timings = sorted(timings)
+    print('%-18s mean %7.2f ms  p50 %7.2f ms  p99 %7.2f ms  total %6.2f s  %4d TLS handshakes' % (
+        label, sum(timings) / len(timings), timings[len(timings) // 2],
+        timings[len(timings) * 99 // 100], sum(timings) / 1000, connections))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds added to every API response')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    server = StubApiServer(*self_signed(tmpdir)).start()
+    try:
+        kubeconfig = os.path.join(tmpdir, 'kubeconfig')
+        with open(kubeconfig, 'w') as f:
+            yaml.safe_dump(server.kubeconfig(), f)
+        for i in range(args.items):
+            server.add(node('node-%d' % i, 'none'))
+        cache_dir = os.path.join(tmpdir, 'cache')
+        run_items(kubeconfig, cache_dir, 1, 'warm', False)
+        server.latency = args.latency
+
+        for label, session in (('without session', False), ('with session', True)):
+            server.connections = 0
+            timings = run_items(kubeconfig, cache_dir, args.items, label, session)
+            report(label, timings, server.connections)
+    finally:
+        server.stop()
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Scripted stand-in for kubectl used by the kube module tests.
+#
+# Objects are kept in the JSON file named by FAKE_KUBECTL_STATE and every
+# invocation is appended to FAKE_KUBECTL_LOG. Files listed in
+# FAKE_KUBECTL_FAIL (comma separated) fail to apply. The first
+# FAKE_KUBECTL_FLAKY invocations fail as if the API server was down.
+
+import fcntl
+import json
+import os
+import sys
+
+import yaml
+
+LAST_APPLIED = 'kubectl.kubernetes.io/last-applied-configuration'
+
+KIND_ALIASES = {'deploy': 'deployment', 'svc': 'service', 'cm': 'configmap',
+                'po': 'pod', 'ds': 'daemonset', 'aliases': 'alias'}
+# Kinds whose singular name ends in "s", as discovery would tell kubectl.
+SINGULAR_KINDS = ('alias', 'endpoints', 'prometheus')
+# kubectl api-resources --no-headers
+API_RESOURCES = '\n'.join([
+    'configmaps          cm                               true    ConfigMap',
+    'endpoints           ep                               true    Endpoints',
+    'namespaces          ns                               false   Namespace',
+    'nodes               no                               false   Node',
+    'pods                po                               true    Pod',
+    'services            svc                              true    Service',
+    'daemonsets          ds       apps                    true    DaemonSet',
+    'deployments         deploy   apps                    true    Deployment',
+    'customresourcedefinitions crd,crds apiextensions.k8s.io false CustomResourceDefinition',
+    'prometheuses                 monitoring.coreos.com   true    Prometheus',
+    'clusterrolebindings          rbac.authorization.k8s.io false ClusterRoleBinding',
+    'clusterroles                 rbac.authorization.k8s.io false ClusterRole',
+    'roles                        rbac.authorization.k8s.io true  Role',
+    'aliases                      example.com             true    Alias',
+]) + '\n'
+
+STATE_FILE = os.environ.get('FAKE_KUBECTL_STATE', 'fake_kubectl.json')
+LOG_FILE = os.environ.get('FAKE_KUBECTL_LOG')
+FAIL_FILES = [f for f in os.environ.get('FAKE_KUBECTL_FAIL', '').split(',') if f]
+
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE) as f:
+        return json.load(f)
+
+
+def save_state(state):
+    with open(STATE_FILE, 'w') as f:
+        json.dump(state, f)
+
+
+def object_key(obj, namespace):
+    meta = obj.get('metadata', {})
+    return '/'.join([obj['kind'].lower(), meta.get('namespace', namespace) or '',
+                     meta['name']])
+
+
+def display_kind(obj):
+    group = obj.get('apiVersion', 'v1').rpartition('/')[0]
+    kind = obj['kind'].lower()
+    return '%s.%s' % (kind, group) if group else kind
+
+
+def load_objects(filename):
+    if filename == '-':
+        docs = list(yaml.safe_load_all(sys.stdin))
+    else:
+        with open(filename) as f:
+            docs = list(yaml.safe_load_all(f))
+    objects = []
+    for doc in docs:
+        if doc and doc.get('kind') == 'List':
+            objects.extend(doc.get('items') or [])
+        elif doc:
+            objects.append(doc)
+    return objects
+
+
+def annotate(obj, namespace):
+    meta = obj['metadata']
+    meta.setdefault('namespace', namespace)
+    meta.setdefault('annotations', {})[LAST_APPLIED] = json.dumps(
+        obj, sort_keys=True)
+    return obj
+
+
+def kind_name(kind):
+    kind = KIND_ALIASES.get(kind.lower(), kind.lower())
+    if kind.endswith('s') and kind not in SINGULAR_KINDS:
+        return kind[:-1]
+    return kind
+
+
+def matches(obj, selector):
+    labels = obj['metadata'].get('labels') or {}
+    return all(labels.get(k) == v for k, _, v in
+               (term.partition('=') for term in selector.split(',') if term))
+
+
+def get_kinds(state, namespace, kinds, flags):
+    kinds = [kind_name(k) for k in kinds.split(',')]
+    items = [obj for key, obj in sorted(state.items())
+             if key.split('/')[0] in kinds and key.split('/')[1] in (namespace, '') and
+             matches(obj, flags.get('selector', ''))]
+    sys.stdout.write(json.dumps({'kind': 'List', 'apiVersion': 'v1', 'items': items}))
+    return 0
+
+
+def get_refs(state, namespace, refs):
+    items = []
+    for ref in refs:
+        kind, _, name = ref.partition('/')
+        key = '/'.join([kind_name(kind), namespace, name])
+        if key not in state:
+            sys.stderr.write('Error from server (NotFound): %s not found\n' % key)
+            return 1
+        items.append(state[key])
+    sys.stdout.write(json.dumps({'kind': 'List', 'apiVersion': 'v1', 'items': items}))
+    return 0
+
+
+def delete(state, namespace, flags, objects):
+    rc = 0
+    for obj in objects:
+        kind, _, name = obj.partition('/')
+        key = '/'.join([kind_name(kind), namespace, name])
+        if state.pop(key, None) is None:
+            if 'ignore-not-found' not in flags:
+                sys.stderr.write('Error from server (NotFound): %s not found\n' % key)
+                rc = 1
+            continue
+        sys.stdout.write('%s "%s" deleted\n' % (kind_name(kind), name))
+    return rc
+
+
+def scale(state, namespace, flags, objects):
+    for obj in objects:
+        kind, _, name = obj.partition('/')
+        key = '/'.join([kind_name(kind), namespace, name])
+        if key not in state:
+            sys.stderr.write('Error from server (NotFound): %s not found\n' % key)
+            return 1
+        state[key].setdefault('spec', {})['replicas'] = int(flags['replicas'])
+        sys.stdout.write('%s "%s" scaled\n' % (kind_name(kind), name))
+    return 0
+
+
+def get(state, namespace, flags):
+    items = []
+    for filename in flags.get('filename', '').split(','):
+        for obj in load_objects(filename):
+            key = object_key(obj, namespace)
+            if key in state:
+                items.append(state[key])
+            elif 'ignore-not-found' not in flags:
+                sys.stderr.write('Error from server (NotFound): %s not found\n' % key)
+                return 1
+    if items:
+        sys.stdout.write(json.dumps({'kind': 'List', 'apiVersion': 'v1',
+                                     'items': items}))
+    return 0
+
+
+def apply(state, namespace, flags):
+    rc = 0
+    for filename in flags.get('filename', '').split(','):
+        if filename in FAIL_FILES:
+            sys.stderr.write('error when creating "%s": injected failure\n' % filename)
+            rc = 1
+            continue
+        if filename != '-' and not os.path.exists(filename):
+            sys.stderr.write('error: the path "%s" does not exist\n' % filename)
+            rc = 1
+            continue
+        for obj in load_objects(filename):
+            key = object_key(obj, namespace)
+            obj = annotate(obj, namespace)
+            live = dict(state.get(key) or {})
+            version = (live.get('metadata') or {}).get('resourceVersion')
+            if live:
+                live['metadata'] = dict(live['metadata'])
+                live['metadata'].pop('resourceVersion', None)
+            if key not in state:
+                verb = 'created'
+            elif live == obj:
+                verb = 'unchanged'
+            else:
+                verb = 'configured'
+            if verb != 'unchanged':
+                version = str(max([int(o['metadata'].get('resourceVersion') or 0)
+                                   for o in state.values()] or [0]) + 1)
+            obj['metadata']['resourceVersion'] = version
+            state[key] = obj
+            if flags.get('output') == 'json':
+                # Like kubectl apply, one JSON document per object.
+                sys.stdout.write(json.dumps(obj, indent=4) + '\n')
+            else:
+                sys.stdout.write('%s/%s %s\n' % (display_kind(obj),
+                                                 obj['metadata']['name'], verb))
+    return rc
+
+
+def flaky():
+    """Counts down FAKE_KUBECTL_FLAKY, returning True while it is positive."""
+    remaining = int(os.environ.get('FAKE_KUBECTL_FLAKY') or 0)
+    if not remaining:
+        return False
+    counter = STATE_FILE + '.flaky'
+    with open(STATE_FILE + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        failed = 0
+        if os.path.exists(counter):
+            with open(counter) as f:
+                failed = int(f.read())
+        if failed >= remaining:
+            return False
+        with open(counter, 'w') as f:
+            f.write(str(failed + 1))
+    return True
+
+
+def main(argv):
+    if LOG_FILE:
+        with open(LOG_FILE, 'a') as f:
+            f.write(json.dumps(argv) + '\n')
+
+    flags = {}
+    positional = []
+    args = iter(argv)
+    for arg in args:
+        if arg.startswith('--'):
+            key, _, value = arg[2:].partition('=')
+            flags[key] = value
+        elif arg == '-o':
+            flags['output'] = next(args)
+        else:
+            positional.append(arg)
+
+    if positional == ['config', 'view']:
+        with open(os.path.expanduser(flags.get('kubeconfig') or '~/.kube/config')) as f:
+            sys.stdout.write(json.dumps(yaml.safe_load(f)))
+        return 0
+
+    if flaky():
+        sys.stderr.write('Unable to connect to the server: dial tcp 127.0.0.1:6443: '
+                         'connect: connection refused\n')
+        return 1
+
+    # Parallel workers run several fake kubectl processes at once.
+    with open(STATE_FILE + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = load_state()
+        namespace = flags.get('namespace') or 'default'
+        command = positional[0] if positional else None
+        if command == 'apply':
+            rc = apply(state, namespace, flags)
+        elif command == 'get' and len(positional) > 1 and '/' in positional[1]:
+            rc = get_refs(state, namespace, positional[1:])
+        elif command == 'get' and len(positional) > 1:
+            rc = get_kinds(state, namespace, positional[1], flags)
+        elif command == 'get':
+            rc = get(state, namespace, flags)
+        elif command == 'api-resources':
+            sys.stdout.write(API_RESOURCES)
+            rc = 0
+        elif command == 'version':
+            sys.stdout.write(json.dumps({
+                'clientVersion': {'gitVersion': 'v1.9.5'},
+                'serverVersion': {'gitVersion': 'v1.9.5'}}))
+            rc = 0
+        elif command == 'scale':
+            rc = scale(state, namespace, flags, positional[1:])
+        elif command == 'delete':
+            rc = delete(state, namespace, flags, positional[1:])
+        else:
+            sys.stderr.write('error: unknown command "%s"\n' % command)
+            return 1
+        save_state(state)
+    return rc
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
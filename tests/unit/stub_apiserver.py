@@ -0,0 +1,522 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# In-memory stand-in for kube-apiserver used by the kube module tests.
+# It serves discovery, CRUD with JSON and strategic merge patches and label
+# selectors over HTTP/1.1 keep-alive connections, plain or TLS, and records
+# every request.
+
+import copy
+import json
+import base64
+import socket
+import ssl
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+
+def _resource(name, kind, namespaced=True, short_names=None):
+    return {'name': name, 'kind': kind, 'namespaced': namespaced,
+            'singularName': '', 'shortNames': short_names or [],
+            'verbs': ['create', 'delete', 'get', 'list', 'patch', 'update']}
+
+
+RESOURCES = {
+    'v1': [
+        _resource('configmaps', 'ConfigMap', short_names=['cm']),
+        _resource('namespaces', 'Namespace', False, ['ns']),
+        _resource('nodes', 'Node', False, ['no']),
+        _resource('pods', 'Pod', short_names=['po']),
+        _resource('secrets', 'Secret'),
+        _resource('serviceaccounts', 'ServiceAccount', short_names=['sa']),
+        _resource('services', 'Service', short_names=['svc']),
+    ],
+    'apps/v1': [
+        _resource('daemonsets', 'DaemonSet', short_names=['ds']),
+        _resource('deployments', 'Deployment', short_names=['deploy']),
+        _resource('statefulsets', 'StatefulSet', short_names=['sts']),
+    ],
+    'batch/v1': [
+        _resource('jobs', 'Job'),
+    ],
+    'rbac.authorization.k8s.io/v1': [
+        _resource('clusterrolebindings', 'ClusterRoleBinding', False),
+        _resource('clusterroles', 'ClusterRole', False),
+    ],
+    'monitoring.coreos.com/v1': [
+        _resource('prometheuses', 'Prometheus'),
+    ],
+    'example.com/v1': [
+        _resource('aliases', 'Alias'),
+    ],
+}
+# Custom resources, which only take JSON merge patches.
+CUSTOM_GROUPS = ('monitoring.coreos.com', 'example.com')
+
+# patchMergeKey of the lists the strategic merge patches of the tests touch.
+PATCH_MERGE_KEYS = {'containers': 'name', 'env': 'name', 'ports': 'port'}
+
+
+def merge_patch(target, patch):
+    """Applies an RFC 7386 JSON merge patch."""
+    if not isinstance(patch, dict):
+        return patch
+    if not isinstance(target, dict):
+        target = {}
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        else:
+            target[key] = merge_patch(target.get(key), value)
+    return target
+
+
+def strategic_merge_patch(target, patch):
+    """Applies a strategic merge patch, merging the lists of
+    PATCH_MERGE_KEYS by their key and honouring $patch: delete and
+    $setElementOrder."""
+    if not isinstance(patch, dict):
+        return patch
+    if not isinstance(target, dict):
+        target = {}
+    for key, value in patch.items():
+        if key.startswith('$setElementOrder/'):
+            continue
+        merge_key = PATCH_MERGE_KEYS.get(key)
+        if merge_key == 'port' and any('containerPort' in item for item in value or []):
+            merge_key = 'containerPort'
+        if value is None:
+            target.pop(key, None)
+        elif merge_key and isinstance(target.get(key), list):
+            items = dict((item[merge_key], item) for item in target[key])
+            order = [item[merge_key] for item in target[key]]
+            for item in value:
+                if item.get('$patch') == 'delete':
+                    items.pop(item[merge_key], None)
+                elif item[merge_key] in items:
+                    strategic_merge_patch(items[item[merge_key]], item)
+                else:
+                    items[item[merge_key]] = item
+                    order.append(item[merge_key])
+            ordered = patch.get('$setElementOrder/' + key)
+            if ordered:
+                order = [item[merge_key] for item in ordered] + order
+            seen = set()
+            target[key] = [items[k] for k in order
+                           if k in items and not (k in seen or seen.add(k))]
+        else:
+            target[key] = strategic_merge_patch(target.get(key), value)
+    return target
+
+
+def match_selector(obj, selector):
+    labels = obj.get('metadata', {}).get('labels') or {}
+    for term in [t for t in (selector or '').split(',') if t]:
+        if '!=' in term:
+            key, value = term.split('!=')
+            if labels.get(key) == value:
+                return False
+        elif '=' in term:
+            key, value = term.split('=', 1)
+            if labels.get(key.rstrip('=')) != value:
+                return False
+        elif term not in labels:
+            return False
+    return True
+
+
+def match_fields(obj, selector):
+    """Matches field selectors such as spec.nodeName=node-1."""
+    for term in [t for t in (selector or '').split(',') if t]:
+        negate = '!=' in term
+        key, value = term.split('!=' if negate else '=', 1)
+        found = obj
+        for part in key.split('.'):
+            found = found.get(part) if isinstance(found, dict) else None
+        if (str(found if found is not None else '') == value.lstrip('=')) == negate:
+            return False
+    return True
+
+
+class StubApiServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, certfile=None, keyfile=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubApiHandler)
+        self.certfile = certfile
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.objects = {}
+        self.requests = []
+        self.connections = 0
+        self.resource_version = 0
+        self.events = []
+        self.lock = threading.Lock()
+        self.changed = threading.Condition()
+        self.thread = None
+        self.version = 'v1.9.5'
+        # Seconds added to every response to mimic a remote API server.
+        self.latency = 0
+        # Pod name -> number of evictions refused as if a disruption budget
+        # did not allow them yet.
+        self.evictions_blocked = {}
+        # Content type of every PATCH request.
+        self.patch_types = []
+        # Statuses answered to the next requests instead of serving them, or
+        # (method, status) to only fail the next request with that method.
+        self.fail_next = []
+
+    def next_failure(self, method):
+        with self.lock:
+            for i, fail in enumerate(self.fail_next):
+                if not isinstance(fail, tuple) or fail[0] == method:
+                    del self.fail_next[i]
+                    return fail if not isinstance(fail, tuple) else fail[1]
+        return None
+
+    @property
+    def url(self):
+        return '%s://127.0.0.1:%d' % ('https' if self.certfile else 'http',
+                                      self.server_address[1])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def kubeconfig(self):
+        cluster = {'server': self.url}
+        if self.certfile:
+            # The certificate is self-signed, so it is its own CA.
+            with open(self.certfile, 'rb') as f:
+                cluster['certificate-authority-data'] = base64.b64encode(f.read()).decode('ascii')
+        return {
+            'apiVersion': 'v1',
+            'kind': 'Config',
+            'current-context': 'stub',
+            'clusters': [{'name': 'stub', 'cluster': cluster}],
+            'contexts': [{'name': 'stub',
+                          'context': {'cluster': 'stub', 'user': 'admin'}}],
+            'users': [{'name': 'admin', 'user': {'token': 'secret'}}],
+        }
+
+    def writes(self):
+        return [r for r in self.requests if r[0] not in ('GET',)]
+
+    def add(self, obj):
+        """Stores obj as if it had been created through the API."""
+        resource = self.resource_for(obj['apiVersion'], obj['kind'])
+        meta = obj.setdefault('metadata', {})
+        namespace = meta.get('namespace', 'default') if resource['namespaced'] else None
+        if namespace:
+            meta['namespace'] = namespace
+        self.bump(obj)
+        self.objects[(resource['name'], namespace, meta['name'])] = obj
+        self.record('ADDED', resource['name'], obj)
+        return obj
+
+    def get(self, plural, namespace, name):
+        return self.objects.get((plural, namespace, name))
+
+    def update(self, plural, namespace, name, patch):
+        """Merges patch into a stored object, e.g. to fake controller status
+        updates, and notifies watchers."""
+        obj = merge_patch(self.get(plural, namespace, name), patch)
+        self.bump(obj)
+        self.record('MODIFIED', plural, obj)
+        return obj
+
+    def bump(self, obj):
+        with self.lock:
+            self.resource_version += 1
+            obj['metadata']['resourceVersion'] = str(self.resource_version)
+
+    def record(self, event_type, plural, obj):
+        with self.changed:
+            self.events.append((int(obj['metadata']['resourceVersion']),
+                                event_type, plural, copy.deepcopy(obj)))
+            self.changed.notify_all()
+
+    @staticmethod
+    def resource_for(api_version, kind):
+        for resource in RESOURCES.get(api_version, []):
+            if resource['kind'] == kind:
+                return resource
+        raise KeyError(kind)
+
+    @staticmethod
+    def resource_by_plural(group_version, plural):
+        for resource in RESOURCES.get(group_version, []):
+            if resource['name'] == plural:
+                return resource
+        return None
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # Headers and body are written separately; without TCP_NODELAY every
+        # response waits for a delayed ACK.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_status(self, status, reason, message):
+        self.send_json(status, {'kind': 'Status', 'apiVersion': 'v1',
+                                'status': 'Failure', 'reason': reason,
+                                'message': message, 'code': status})
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length).decode('utf-8'))
+
+    def route(self):
+        """Splits the request path into (group_version, namespace, plural,
+        name, subresource); returns None for discovery paths."""
+        parts = [p for p in self.url.path.split('/') if p]
+        if parts[:1] == ['api']:
+            group_version, rest = 'v1', parts[2:]
+        else:
+            group_version, rest = '/'.join(parts[1:3]), parts[3:]
+        namespace = None
+        if len(rest) >= 3 and rest[0] == 'namespaces':
+            namespace, rest = rest[1], rest[2:]
+        if not rest:
+            return None
+        return (group_version, namespace, rest[0],
+                rest[1] if len(rest) > 1 else None,
+                rest[2] if len(rest) > 2 else None)
+
+    def handle_request(self, method):
+        self.url = urlparse(self.path)
+        self.query = dict((k, v[0]) for k, v in parse_qs(self.url.query).items())
+        self.server.requests.append((method, self.url.path))
+        body = self.read_body() if method in ('POST', 'PUT', 'PATCH', 'DELETE') else None
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        fail = self.server.next_failure(method)
+        if fail == 409:
+            # The object appears concurrently.
+            if method == 'POST' and body:
+                resource = self.server.resource_by_plural(*self.route()[0:3:2])
+                self.server.add(dict(body, apiVersion=self.route()[0], kind=resource['kind']))
+            return self.send_status(409, 'AlreadyExists', 'conflict')
+        if fail:
+            return self.send_status(fail, 'ServiceUnavailable', 'injected failure')
+
+        if self.url.path == '/version':
+            return self.send_json(200, {'gitVersion': self.server.version})
+
+        if self.url.path == '/apis':
+            groups = [{'name': gv.split('/')[0],
+                       'preferredVersion': {'groupVersion': gv}}
+                      for gv in sorted(RESOURCES) if gv != 'v1']
+            return self.send_json(200, {'kind': 'APIGroupList', 'groups': groups})
+        if self.url.path == '/api':
+            return self.send_json(200, {'kind': 'APIVersions', 'versions': ['v1']})
+
+        route = self.route()
+        if route is None:
+            group_version = self.url.path.split('/', 2)[-1]
+            if group_version not in RESOURCES:
+                return self.send_status(404, 'NotFound', 'the server could not find the requested resource')
+            return self.send_json(200, {'kind': 'APIResourceList',
+                                        'groupVersion': group_version,
+                                        'resources': RESOURCES[group_version]})
+
+        group_version, namespace, plural, name, subresource = route
+        resource = self.server.resource_by_plural(group_version, plural)
+        if resource is None:
+            return self.send_status(404, 'NotFound', 'the server could not find the requested resource')
+        handler = getattr(self, 'do_%s_%s' % (method.lower(), 'object' if name else 'collection'), None)
+        if handler is None:
+            return self.send_status(405, 'MethodNotAllowed', 'method not allowed')
+        return handler(resource, group_version, namespace, name, subresource, body)
+
+    def send_chunk(self, data):
+        self.wfile.write(('%x\r\n' % len(data)).encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def watch(self, resource, namespace):
+        sent = int(self.query.get('resourceVersion') or self.server.resource_version)
+        deadline = time.time() + float(self.query.get('timeoutSeconds', 60))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        while time.time() < deadline:
+            with self.server.changed:
+                events = [e for e in self.server.events if e[0] > sent and e[2] == resource['name'] and
+                          (namespace is None or e[3]['metadata'].get('namespace') == namespace)]
+                if not events:
+                    self.server.changed.wait(max(0, deadline - time.time()))
+                    continue
+            for version, event_type, _, obj in events:
+                self.send_chunk(json.dumps({'type': event_type, 'object': obj}).encode('utf-8') + b'\n')
+                sent = version
+        self.wfile.write(b'0\r\n\r\n')
+
+    def do_get_collection(self, resource, group_version, namespace, name, subresource, body):
+        if self.query.get('watch') in ('1', 'true'):
+            return self.watch(resource, namespace)
+        items = [obj for (plural, ns, _), obj in sorted(self.server.objects.items(), key=lambda i: str(i[0]))
+                 if plural == resource['name'] and (namespace is None or ns == namespace) and
+                 match_selector(obj, self.query.get('labelSelector')) and
+                 match_fields(obj, self.query.get('fieldSelector'))]
+        self.send_json(200, {'kind': resource['kind'] + 'List', 'apiVersion': group_version,
+                             'metadata': {'resourceVersion': str(self.server.resource_version)},
+                             'items': items})
+
+    def do_get_object(self, resource, group_version, namespace, name, subresource, body):
+        obj = self.server.get(resource['name'], namespace, name)
+        if obj is None:
+            return self.send_status(404, 'NotFound', '%s "%s" not found' % (resource['name'], name))
+        self.send_json(200, obj)
+
+    def do_post_collection(self, resource, group_version, namespace, name, subresource, body):
+        key = (resource['name'], namespace, body['metadata']['name'])
+        if key in self.server.objects:
+            return self.send_status(409, 'AlreadyExists', '%s "%s" already exists' % key[::2])
+        body['metadata']['uid'] = '%s-%s' % key[1:]
+        body['metadata'].setdefault('generation', 1)
+        if self.query.get('dryRun') == 'All':
+            return self.send_json(201, body)
+        self.server.bump(body)
+        self.server.objects[key] = body
+        self.server.record('ADDED', resource['name'], body)
+        self.send_json(201, body)
+
+    def do_post_object(self, resource, group_version, namespace, name, subresource, body):
+        if resource['name'] != 'pods' or subresource != 'eviction':
+            return self.send_status(405, 'MethodNotAllowed', 'method not allowed')
+        with self.server.lock:
+            blocked = self.server.evictions_blocked.get(name, 0)
+            if blocked:
+                self.server.evictions_blocked[name] = blocked - 1
+        if blocked:
+            return self.send_status(429, 'TooManyRequests', "Cannot evict pod as it would violate "
+                                    "the pod's disruption budget.")
+        return self.do_delete_object(resource, group_version, namespace, name, None, None)
+
+    def do_put_object(self, resource, group_version, namespace, name, subresource, body):
+        if self.server.get(resource['name'], namespace, name) is None:
+            return self.send_status(404, 'NotFound', '%s "%s" not found' % (resource['name'], name))
+        self.server.bump(body)
+        self.server.objects[(resource['name'], namespace, name)] = body
+        self.server.record('MODIFIED', resource['name'], body)
+        self.send_json(200, body)
+
+    def do_patch_object(self, resource, group_version, namespace, name, subresource, body):
+        obj = self.server.get(resource['name'], namespace, name)
+        if obj is None:
+            return self.send_status(404, 'NotFound', '%s "%s" not found' % (resource['name'], name))
+        precondition = (body.get('metadata') or {}).get('resourceVersion')
+        if precondition and precondition != obj['metadata'].get('resourceVersion'):
+            return self.send_status(409, 'Conflict', 'the object has been modified')
+        content_type = self.headers.get('Content-Type')
+        self.server.patch_types.append(content_type)
+        merge = merge_patch
+        if content_type == 'application/strategic-merge-patch+json':
+            if group_version.split('/')[0] in CUSTOM_GROUPS:
+                return self.send_status(415, 'UnsupportedMediaType',
+                                        'the body of the request was in an unknown format')
+            merge = strategic_merge_patch
+        if self.query.get('dryRun') == 'All':
+            return self.send_json(200, merge(copy.deepcopy(obj), body))
+        if subresource == 'scale':
+            obj.setdefault('spec', {})['replicas'] = body['spec']['replicas']
+            obj['metadata']['generation'] = obj['metadata'].get('generation', 1) + 1
+        else:
+            merge(obj, body)
+        self.server.bump(obj)
+        self.server.record('MODIFIED', resource['name'], obj)
+        if subresource == 'scale':
+            return self.send_json(200, {'kind': 'Scale', 'apiVersion': 'autoscaling/v1',
+                                        'metadata': {'name': name, 'namespace': namespace},
+                                        'spec': {'replicas': obj['spec']['replicas']}})
+        self.send_json(200, obj)
+
+    def do_delete_collection(self, resource, group_version, namespace, name, subresource, body):
+        deleted = []
+        for key, obj in sorted(self.server.objects.items(), key=lambda i: str(i[0])):
+            if key[0] == resource['name'] and (namespace is None or key[1] == namespace) and \
+                    match_selector(obj, self.query.get('labelSelector')):
+                del self.server.objects[key]
+                self.server.bump(obj)
+                self.server.record('DELETED', resource['name'], obj)
+                deleted.append(obj)
+        self.send_json(200, {'kind': resource['kind'] + 'List', 'apiVersion': group_version,
+                             'metadata': {'resourceVersion': str(self.server.resource_version)},
+                             'items': deleted})
+
+    def do_delete_object(self, resource, group_version, namespace, name, subresource, body):
+        obj = self.server.get(resource['name'], namespace, name)
+        if obj is None:
+            return self.send_status(404, 'NotFound', '%s "%s" not found' % (resource['name'], name))
+        if obj['metadata'].get('finalizers'):
+            # Stays until its finalizers are removed, e.g. a pod that takes
+            # long to terminate.
+            obj['metadata'].setdefault('deletionTimestamp', '2018-01-01T00:00:00Z')
+            self.server.bump(obj)
+            self.server.record('MODIFIED', resource['name'], obj)
+            return self.send_json(200, obj)
+        del self.server.objects[(resource['name'], namespace, name)]
+        self.server.bump(obj)
+        self.server.record('DELETED', resource['name'], obj)
+        self.send_json(200, obj)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
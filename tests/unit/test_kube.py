@@ -0,0 +1,912 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import copy
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import ansible.module_utils
+import yaml
+
+path = "./library/"
+if path not in sys.path:
+    sys.path.append(path)
+
+module_utils_path = os.path.abspath("./module_utils/")
+if module_utils_path not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(module_utils_path)
+
+import kube
+from ansible.module_utils import kube_api
+from stub_apiserver import StubApiServer, strategic_merge_patch
+
+FAKE_KUBECTL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'fake_kubectl.py')
+
+DEFAULT_PARAMS = {
+    'force': False,
+    'all': False,
+    'log_level': 0,
+    'state': 'present',
+}
+
+
+class FailJson(SystemExit):
+    pass
+
+
+class FakeModule(object):
+    """Minimal AnsibleModule stand-in that runs commands for real."""
+
+    def __init__(self, check_mode=False, **params):
+        self.check_mode = check_mode
+        self.params = dict(DEFAULT_PARAMS)
+        self.params.update(params)
+        self.commands = []
+        self.warnings = []
+
+    def get_bin_path(self, name, required=False):
+        return FAKE_KUBECTL
+
+    def run_command(self, args, data=None):
+        self.commands.append(args)
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        out, err = proc.communicate(data)
+        return proc.returncode, out, err
+
+    def warn(self, warning):
+        self.warnings.append(warning)
+
+    def fail_json(self, **kwargs):
+        raise FailJson(kwargs)
+
+
+MANIFEST = """apiVersion: %(api_version)s
+kind: %(kind)s
+metadata:
+  name: %(name)s
+data:
+  key: %(value)s
+"""
+
+
+class TestKubeManager(unittest.TestCase):
+    def setUp(self):
+        self.server = None
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['FAKE_KUBECTL_STATE'] = os.path.join(self.tmpdir,
+                                                        'state.json')
+        os.environ.pop('FAKE_KUBECTL_FAIL', None)
+
+    def tearDown(self):
+        if self.server:
+            self.server.stop()
+        shutil.rmtree(self.tmpdir)
+        os.environ.pop('FAKE_KUBECTL_FAIL', None)
+
+    def write_manifest(self, name, kind='ConfigMap', api_version='v1',
+                       value='a'):
+        filename = os.path.join(self.tmpdir, '%s-%s.yml' % (name, kind))
+        with open(filename, 'w') as f:
+            f.write(MANIFEST % dict(name=name, kind=kind, value=value,
+                                    api_version=api_version))
+        return filename
+
+    def api_module(self, **params):
+        if self.server is None:
+            self.server = StubApiServer().start()
+            self.kubeconfig = os.path.join(self.tmpdir, 'kubeconfig')
+            with open(self.kubeconfig, 'w') as f:
+                yaml.safe_dump(self.server.kubeconfig(), f)
+        params.setdefault('cache_dir', os.path.join(self.tmpdir, 'cache'))
+        return FakeModule(engine='api', kubeconfig=self.kubeconfig, **params)
+
+    def test_resource_kind(self):
+        resources = ['deploy', 'svc', 'daemonsets', 'deployment.apps',
+                     'ingresses', 'ingress', 'endpoints', 'ClusterRoleBinding',
+                     'podsecuritypolicies', 'storageclasses', 'prometheuses',
+                     'prometheus', 'prometheuses.monitoring.coreos.com', 'statuses']
+        expected = ['deployment', 'service', 'daemonset', 'deployment',
+                    'ingress', 'ingress', 'endpoints', 'clusterrolebinding',
+                    'podsecuritypolicy', 'storageclass', 'prometheus',
+                    'prometheus', 'prometheus', 'status']
+        self.assertEqual(expected, [kube.resource_kind(r) for r in resources])
+
+    def test_normalize_kind(self):
+        kinds = ['Prometheus', 'Status', 'Endpoints', 'ClusterRoleBinding',
+                 'prometheus.monitoring.coreos.com', 'deployment.apps']
+        expected = ['prometheus', 'status', 'endpoints', 'clusterrolebinding',
+                    'prometheus', 'deployment']
+        self.assertEqual(expected, [kube.normalize_kind(k) for k in kinds])
+
+    def test_parse_apply_output(self):
+        lines = ['deployment.apps "kube-dns" configured',
+                 'service/kube-dns unchanged',
+                 'Warning: something unrelated']
+        expected = [('deployment', 'kube-dns', 'configured'),
+                    ('service', 'kube-dns', 'unchanged')]
+        self.assertEqual(expected, kube.parse_apply_output(lines))
+
+    def test_kubectl_error(self):
+        self.assertEqual("error running kubectl (kubectl apply -f a.yml) command (rc=1), "
+                         "out='', err='boom'",
+                         kube.kubectl_error(['kubectl', 'apply', '-f', 'a.yml'], 1, '', 'boom'))
+
+    def test_apply_items_one_call_per_namespace(self):
+        module = FakeModule(namespace='kube-system', items=[
+            {'name': 'one', 'resource': 'cm',
+             'filename': self.write_manifest('one')},
+            {'name': 'two', 'type': 'cm', 'file': self.write_manifest('two')},
+            {'name': 'three', 'resource': 'cm', 'namespace': 'default',
+             'filename': self.write_manifest('three')}])
+        results = kube.KubeManager(module).apply_items()
+
+        applies = [c for c in module.commands if 'apply' in c]
+        self.assertEqual(2, len(applies))
+        self.assertIn('--namespace=kube-system', applies[0])
+        self.assertIn('--namespace=default', applies[1])
+        self.assertEqual(['one', 'two', 'three'],
+                         [r['name'] for r in results])
+        self.assertTrue(all(r['changed'] for r in results))
+        self.assertFalse(any(r['failed'] for r in results))
+
+    def test_apply_items_reports_unchanged(self):
+        items = [{'name': 'one', 'resource': 'cm',
+                  'filename': self.write_manifest('one')}]
+        kube.KubeManager(FakeModule(items=items)).apply_items()
+        results = kube.KubeManager(FakeModule(items=items)).apply_items()
+        self.assertFalse(results[0]['changed'])
+
+    def test_apply_items_skips_unchanged_files(self):
+        items = [{'name': 'one', 'filename': self.write_manifest('one')},
+                 {'name': 'two', 'filename': self.write_manifest('two')}]
+        kube.KubeManager(FakeModule(items=items)).apply_items()
+        self.write_manifest('two', value='b')
+        module = FakeModule(items=items)
+        results = kube.KubeManager(module).apply_items()
+        self.assertEqual([False, True], [r['changed'] for r in results])
+        applies = [c for c in module.commands if 'apply' in c]
+        self.assertEqual(['--filename=' + items[1]['filename']],
+                         [a for a in applies[0] if a.startswith('--filename')])
+
+    def test_replace_skips_unchanged(self):
+        filenames = [self.write_manifest('one'), self.write_manifest('two')]
+        self.assertEqual(['configmap/one created', 'configmap/two created'],
+                         kube.KubeManager(FakeModule(filename=filenames)).replace())
+
+        module = FakeModule(filename=filenames)
+        result = kube.KubeManager(module).replace()
+        self.assertEqual(['configmap/one unchanged', 'configmap/two unchanged'],
+                         result)
+        self.assertFalse([c for c in module.commands if 'apply' in c])
+
+        self.write_manifest('two', value='b')
+        result = kube.KubeManager(FakeModule(filename=filenames)).replace()
+        self.assertEqual(['configmap/one unchanged', 'configmap/two configured'],
+                         result)
+
+    def test_replace_reports_objects(self):
+        one, two = self.write_manifest('one'), self.write_manifest('two')
+        manager = kube.KubeManager(FakeModule(filename=[one], namespace='apps'))
+        manager.replace()
+        self.write_manifest('one', value='b')
+        manager = kube.KubeManager(FakeModule(filename=[one, two], namespace='apps'))
+        self.assertEqual(['configmap/one configured', 'configmap/two created'],
+                         manager.replace())
+
+        results = sorted(manager.results, key=lambda r: r['name'])
+        self.assertEqual([('configmap', 'apps', 'one', 'configured'),
+                          ('configmap', 'apps', 'two', 'created')],
+                         [(r['kind'], r['namespace'], r['name'], r['action']) for r in results])
+        self.assertTrue(all(r['duration_ms'] >= 0 and r['api_calls'] is None for r in results))
+
+        manager = kube.KubeManager(FakeModule(filename=[one, two], namespace='apps'))
+        manager.replace()
+        self.assertEqual(['unchanged', 'unchanged'], [r['action'] for r in manager.results])
+
+    def test_parse_json_objects(self):
+        docs = '{"kind": "ConfigMap"}\n{"kind": "Service"}\n'
+        self.assertEqual(['ConfigMap', 'Service'],
+                         [o['kind'] for o in kube.parse_json_objects(docs)])
+        self.assertEqual(['Pod'], [o['kind'] for o in kube.parse_json_objects(
+            '{"kind": "List", "items": [{"kind": "Pod"}]}')])
+        self.assertEqual([], kube.parse_json_objects(''))
+
+    def test_kubectl_definition_on_stdin(self):
+        definition = (MANIFEST % dict(name='one', kind='ConfigMap', value='a', api_version='v1') +
+                      '---\n' +
+                      MANIFEST % dict(name='two', kind='ConfigMap', value='a', api_version='v1'))
+        module = FakeModule(definition=definition)
+        self.assertEqual(['configmap/one created', 'configmap/two created'],
+                         kube.KubeManager(module).replace())
+        self.assertTrue(all('--filename=-' in c for c in module.commands))
+
+        self.assertEqual(['configmap/one unchanged', 'configmap/two unchanged'],
+                         kube.KubeManager(FakeModule(definition=definition)).replace())
+
+    def test_api_definition_objects(self):
+        definition = [{'apiVersion': 'v1', 'kind': 'ConfigMap', 'metadata': {'name': 'one'}},
+                      {'apiVersion': 'v1', 'kind': 'List',
+                       'items': [{'apiVersion': 'v1', 'kind': 'ConfigMap', 'metadata': {'name': 'two'}}]}]
+        manager = kube.KubeManager(self.api_module(definition=definition))
+        self.assertEqual(['configmap/one created', 'configmap/two created'], manager.replace())
+        self.assertTrue(manager.exists())
+
+    def test_apply_phases(self):
+        workload = self.write_manifest('app', kind='Deployment',
+                                       api_version='apps/v1')
+        role = self.write_manifest('app', kind='ClusterRole',
+                                   api_version='rbac.authorization.k8s.io/v1')
+        namespace = self.write_manifest('app', kind='Namespace')
+        self.assertEqual([[namespace], [role], [workload]],
+                         kube.apply_phases([workload, role, namespace]))
+
+    def test_parallel_apply(self):
+        filenames = [self.write_manifest('cm%d' % i) for i in range(5)]
+        filenames.append(self.write_manifest('kube-system', kind='Namespace'))
+        module = FakeModule(filename=filenames, parallelism=3)
+        result = kube.KubeManager(module).replace()
+
+        self.assertEqual(6, len(result))
+        applies = [c for c in module.commands if 'apply' in c]
+        self.assertEqual(4, len(applies))
+        self.assertEqual('--filename=' + filenames[-1], applies[0][-1])
+        with open(os.environ['FAKE_KUBECTL_STATE']) as f:
+            self.assertEqual(6, len(json.load(f)))
+
+    def test_parallel_apply_aggregates_errors(self):
+        filenames = [self.write_manifest('cm%d' % i) for i in range(4)]
+        workload = self.write_manifest('app', kind='Deployment',
+                                       api_version='apps/v1')
+        os.environ['FAKE_KUBECTL_FAIL'] = ','.join(filenames[:2])
+        module = FakeModule(filename=filenames + [workload], parallelism=2)
+        try:
+            kube.KubeManager(module).replace()
+            self.fail('parallel apply did not fail')
+        except FailJson as e:
+            self.assertIn('2 apply worker(s) failed', e.args[0]['msg'])
+        self.assertFalse([c for c in module.commands
+                          if '--filename=' + workload in c])
+
+    def test_api_parallel_apply(self):
+        filenames = [self.write_manifest('cm%d' % i) for i in range(6)]
+        module = self.api_module(filename=filenames, parallelism=3)
+        result = kube.KubeManager(module).replace()
+        self.assertEqual(6, len(result))
+        self.assertEqual(6, len(self.server.objects))
+        self.assertLessEqual(self.server.connections, 3)
+
+    def test_apply_items_matches_resource_kind(self):
+        items = [{'name': 'dns', 'resource': 'cm',
+                  'filename': self.write_manifest('dns')},
+                 {'name': 'dns', 'resource': 'deploy',
+                  'filename': self.write_manifest('dns', kind='Deployment',
+                                                  api_version='apps/v1')}]
+        kube.KubeManager(FakeModule(items=items)).apply_items()
+        self.write_manifest('dns', kind='Deployment', api_version='apps/v1',
+                            value='b')
+        results = kube.KubeManager(FakeModule(items=items)).apply_items()
+        self.assertEqual([False, True], [r['changed'] for r in results])
+
+    def test_apply_items_partial_failure(self):
+        bad = self.write_manifest('bad')
+        os.environ['FAKE_KUBECTL_FAIL'] = bad
+        module = FakeModule(items=[
+            {'name': 'good', 'filename': self.write_manifest('good')},
+            {'name': 'bad', 'filename': bad}])
+        results = kube.KubeManager(module).apply_items()
+        self.assertEqual([False, True], [r['failed'] for r in results])
+        self.assertTrue(results[0]['changed'])
+        self.assertIn('injected failure', results[1]['msg'])
+
+    def test_apply_items_requires_filename(self):
+        module = FakeModule(items=[{'name': 'nofile'}])
+        self.assertRaises(FailJson, kube.KubeManager(module).apply_items)
+
+    def test_api_apply_create_then_unchanged(self):
+        filenames = [self.write_manifest('one'), self.write_manifest('two')]
+        module = self.api_module(filename=filenames, namespace='kube-system')
+        result = kube.KubeManager(module).replace()
+        self.assertEqual(['configmap/one created', 'configmap/two created'],
+                         result)
+        self.assertEqual([], module.commands)
+        live = self.server.get('configmaps', 'kube-system', 'one')
+        self.assertIn(kube_api.LAST_APPLIED_ANNOTATION,
+                      live['metadata']['annotations'])
+
+        writes = len(self.server.writes())
+        result = kube.KubeManager(module).replace()
+        self.assertEqual(['configmap/one unchanged', 'configmap/two unchanged'],
+                         result)
+        self.assertEqual(writes, len(self.server.writes()))
+
+    def test_api_check_mode_server_dry_run(self):
+        one = self.write_manifest('one')
+        kube.KubeManager(self.api_module(filename=[one])).replace()
+        self.server.version = 'v1.13.4'
+        self.write_manifest('one', value='b')
+        del self.server.requests[:]
+
+        manager = kube.KubeManager(self.api_module(
+            filename=[one, self.write_manifest('two')], check_mode=True))
+        self.assertEqual(['configmap/one configured', 'configmap/two created'], manager.replace())
+        self.assertEqual([('PATCH', '/api/v1/namespaces/default/configmaps/one'),
+                          ('POST', '/api/v1/namespaces/default/configmaps')],
+                         self.server.writes())
+        self.assertEqual('a', self.server.get('configmaps', 'default', 'one')['data']['key'])
+        self.assertIsNone(self.server.get('configmaps', 'default', 'two'))
+        self.assertEqual([one, self.write_manifest('two')], [d['before_header'] for d in manager.diffs])
+        self.assertIn('key: a', manager.diffs[0]['before'])
+        self.assertIn('key: b', manager.diffs[0]['after'])
+
+    def test_api_check_mode_without_server_dry_run(self):
+        one = self.write_manifest('one')
+        kube.KubeManager(self.api_module(filename=[one])).replace()
+        self.write_manifest('one', value='b')
+        del self.server.requests[:]
+
+        # v1.9 servers ignore dryRun, so nothing may be sent.
+        manager = kube.KubeManager(self.api_module(filename=[one], check_mode=True))
+        self.assertEqual(['configmap/one configured'], manager.replace())
+        self.assertEqual([], self.server.writes())
+        self.assertIn('key: b', manager.diffs[0]['after'])
+
+    def test_kubectl_check_mode(self):
+        one = self.write_manifest('one')
+        kube.KubeManager(FakeModule(filename=[one])).replace()
+        self.write_manifest('one', value='b')
+
+        module = FakeModule(filename=[one, self.write_manifest('two')], check_mode=True)
+        manager = kube.KubeManager(module)
+        self.assertEqual(['configmap/one configured', 'configmap/two created'], manager.replace())
+        self.assertFalse([c for c in module.commands if 'apply' in c])
+        self.assertEqual(2, len(manager.diffs))
+
+        module = FakeModule(resource='cm', name='one,missing', check_mode=True)
+        self.assertEqual(['configmap "one" deleted'], kube.KubeManager(module).delete())
+        self.assertFalse([c for c in module.commands if 'delete' in c])
+
+    def labeled(self, *names):
+        return [{'apiVersion': 'v1', 'kind': 'ConfigMap',
+                 'metadata': {'name': name, 'labels': {'app': 'x'}}} for name in names]
+
+    def test_api_strategic_merge_keeps_server_filled_list_fields(self):
+        service = {'apiVersion': 'v1', 'kind': 'Service', 'metadata': {'name': 'web'},
+                   'spec': {'type': 'NodePort', 'ports': [{'name': 'http', 'port': 80}]}}
+        deploy = {'apiVersion': 'apps/v1', 'kind': 'Deployment', 'metadata': {'name': 'web'},
+                  'spec': {'template': {'spec': {'containers': [
+                      {'name': 'web', 'image': 'nginx:1.14', 'env': [{'name': 'A', 'value': '1'}]},
+                      {'name': 'sidecar', 'image': 'proxy:1'}]}}}}
+        kube.KubeManager(self.api_module(definition=[service, deploy])).replace()
+        # Allocated and defaulted by the server.
+        self.server.update('services', 'default', 'web', {'spec': {'ports': [
+            {'name': 'http', 'port': 80, 'nodePort': 30080, 'protocol': 'TCP'}]}})
+        live = self.server.get('deployments', 'default', 'web')
+        for container in live['spec']['template']['spec']['containers']:
+            container['terminationMessagePath'] = '/dev/termination-log'
+
+        service['spec']['ports'].append({'name': 'https', 'port': 443})
+        containers = deploy['spec']['template']['spec']['containers']
+        containers[0]['image'] = 'nginx:1.15'
+        containers[0]['env'] = [{'name': 'B', 'value': '2'}]
+        del containers[1]
+        del self.server.patch_types[:]
+        self.assertEqual(['service/web configured', 'deployment/web configured'],
+                         kube.KubeManager(self.api_module(definition=[service, deploy])).replace())
+
+        self.assertEqual(['application/strategic-merge-patch+json'] * 2, self.server.patch_types)
+        self.assertEqual([{'name': 'http', 'port': 80, 'nodePort': 30080, 'protocol': 'TCP'},
+                          {'name': 'https', 'port': 443}],
+                         self.server.get('services', 'default', 'web')['spec']['ports'])
+        containers = self.server.get('deployments', 'default', 'web')['spec']['template']['spec']['containers']
+        self.assertEqual([{'name': 'web', 'image': 'nginx:1.15', 'env': [{'name': 'B', 'value': '2'}],
+                           'terminationMessagePath': '/dev/termination-log'}], containers)
+
+    def test_api_custom_resources_use_json_merge_patch(self):
+        prometheus = {'apiVersion': 'monitoring.coreos.com/v1', 'kind': 'Prometheus',
+                      'metadata': {'name': 'k8s'}, 'spec': {'replicas': 1}}
+        kube.KubeManager(self.api_module(definition=prometheus)).replace()
+        prometheus['spec']['replicas'] = 2
+        kube.KubeManager(self.api_module(definition=prometheus)).replace()
+        self.assertEqual(['application/merge-patch+json'], self.server.patch_types)
+        self.assertEqual(2, self.server.get('prometheuses', 'default', 'k8s')['spec']['replicas'])
+
+    def test_strategic_merge_matches_server(self):
+        original = {'spec': {'containers': [{'name': 'a', 'image': 'x'}, {'name': 'b', 'image': 'y'}]}}
+        live = {'spec': {'containers': [{'name': 'b', 'image': 'y', 'tty': False},
+                                        {'name': 'a', 'image': 'x', 'tty': False}]}}
+        modified = {'spec': {'containers': [{'name': 'c', 'image': 'z'}, {'name': 'a', 'image': 'w'}]}}
+        patch = kube_api.three_way_patch(original, modified, live, strategic=True)
+        self.assertEqual({'spec': {
+            'containers': [{'name': 'c', 'image': 'z'}, {'name': 'a', 'image': 'w'},
+                           {'name': 'b', '$patch': 'delete'}],
+            '$setElementOrder/containers': [{'name': 'c'}, {'name': 'a'}]}}, patch)
+        expected = {'spec': {'containers': [{'name': 'c', 'image': 'z'},
+                                            {'name': 'a', 'image': 'w', 'tty': False}]}}
+        self.assertEqual(expected, kube_api.strategic_merge(copy.deepcopy(live), patch))
+        self.assertEqual(expected, strategic_merge_patch(copy.deepcopy(live), patch))
+
+    def test_api_prune(self):
+        kube.KubeManager(self.api_module(definition=self.labeled('one', 'two', 'three'))).replace()
+        self.server.add(self.labeled('manual')[0])
+
+        manager = kube.KubeManager(self.api_module(definition=self.labeled('one', 'two'),
+                                                   label='app=x'))
+        manager.replace()
+        self.assertEqual(['configmap "three" deleted'], manager.prune())
+        self.assertEqual(['manual', 'one', 'two'],
+                         sorted(key[2] for key in self.server.objects))
+
+    def test_kubectl_prune_check_mode(self):
+        kube.KubeManager(FakeModule(definition=self.labeled('one', 'two'))).replace()
+        module = FakeModule(definition=self.labeled('one'), label='app=x', check_mode=True)
+        self.assertEqual(['configmap "two" deleted'], kube.KubeManager(module).prune())
+        self.assertFalse([c for c in module.commands if 'delete' in c])
+
+        module = FakeModule(definition=self.labeled('one'), label='app=x')
+        self.assertEqual(['configmap "two" deleted'], kube.KubeManager(module).prune())
+
+    def cluster_scoped_and_stale(self):
+        """Applies a ClusterRole and a ConfigMap in namespace apps, then
+        returns manifests dropping the ClusterRole. A labeled ConfigMap that
+        an apply created in default is never part of them."""
+        role = {'apiVersion': 'rbac.authorization.k8s.io/v1', 'kind': 'ClusterRole',
+                'metadata': {'name': 'reader', 'labels': {'app': 'x'}}}
+        cm = self.labeled('one')[0]
+        cm['metadata']['namespace'] = 'apps'
+        return [role, cm], [cm]
+
+    def test_api_prune_skips_namespaces_of_cluster_scoped_kinds(self):
+        kube.KubeManager(self.api_module(definition=self.labeled('other'))).replace()
+        applied, kept = self.cluster_scoped_and_stale()
+        kube.KubeManager(self.api_module(definition=applied)).replace()
+
+        manager = kube.KubeManager(self.api_module(definition=applied, label='app=x'))
+        self.assertEqual([], manager.prune())
+        self.assertIsNotNone(self.server.get('configmaps', 'default', 'other'))
+
+        manager = kube.KubeManager(self.api_module(definition=kept, label='app=x',
+                                                   resource='clusterrole,cm'))
+        self.assertEqual(['clusterrole "reader" deleted'], manager.prune())
+        self.assertIsNotNone(self.server.get('configmaps', 'default', 'other'))
+
+    def test_kubectl_prune_skips_namespaces_of_cluster_scoped_kinds(self):
+        kube.KubeManager(FakeModule(definition=self.labeled('other'))).replace()
+        applied, kept = self.cluster_scoped_and_stale()
+        kube.KubeManager(FakeModule(definition=applied)).replace()
+
+        module = FakeModule(definition=applied, label='app=x')
+        self.assertEqual([], kube.KubeManager(module).prune())
+        self.assertFalse([c for c in module.commands if 'get' in c and
+                          'configmap' in c[-4] and '--namespace=apps' not in c])
+
+        module = FakeModule(definition=kept, label='app=x', resource='clusterrole,cm')
+        self.assertEqual(['clusterrole "reader" deleted'], kube.KubeManager(module).prune())
+        self.assertEqual(1, len([c for c in module.commands if 'api-resources' in c]))
+
+    def test_kubectl_prune_kind_ending_in_s(self):
+        prometheus = [{'apiVersion': 'monitoring.coreos.com/v1', 'kind': 'Prometheus',
+                       'metadata': {'name': name, 'labels': {'app': 'x'}}}
+                      for name in ('one', 'two')]
+        kube.KubeManager(FakeModule(definition=prometheus)).replace()
+        module = FakeModule(definition=prometheus[:1], label='app=x')
+        self.assertEqual(['prometheus "two" deleted'], kube.KubeManager(module).prune())
+        self.assertTrue([c for c in module.commands if 'get' in c and 'prometheus' in c])
+        self.assertFalse([c for c in module.commands if 'prometheu' in c])
+
+    def test_api_reports_calls_per_object(self):
+        filenames = [self.write_manifest('one'), self.write_manifest('two')]
+        kube.KubeManager(self.api_module(filename=filenames[:1])).replace()
+        manager = kube.KubeManager(self.api_module(filename=filenames))
+        manager.replace()
+        # The first object also pays for the discovery cache check.
+        self.assertEqual([('one', 'unchanged', 2), ('two', 'created', 2)],
+                         [(r['name'], r['action'], r['api_calls']) for r in manager.results])
+
+        manager = kube.KubeManager(self.api_module(resource='cm', name='one,two'))
+        manager.delete()
+        self.assertEqual(['deleted', 'deleted'], [r['action'] for r in manager.results])
+
+    def test_api_apply_compares_last_applied_only(self):
+        filename = self.write_manifest('one')
+        module = self.api_module(filename=[filename])
+        kube.KubeManager(module).replace()
+        self.server.get('configmaps', 'default', 'one')['data']['key'] = 'edited'
+        writes = len(self.server.writes())
+
+        self.assertEqual(['configmap/one unchanged'],
+                         kube.KubeManager(module).replace())
+        self.assertEqual(writes, len(self.server.writes()))
+
+        self.write_manifest('one', value='b')
+        self.assertEqual(['configmap/one configured'],
+                         kube.KubeManager(module).replace())
+        self.assertEqual('b', self.server.get('configmaps', 'default', 'one')['data']['key'])
+
+    def test_manifest_hash_ignores_namespace_and_annotation(self):
+        obj = {'kind': 'ConfigMap', 'metadata': {'name': 'one'}, 'data': {'a': 1}}
+        live = json.loads(json.dumps(obj))
+        live['metadata']['namespace'] = 'kube-system'
+        live['metadata']['annotations'] = {
+            kube_api.LAST_APPLIED_ANNOTATION: kube_api.last_applied(live)}
+        self.assertEqual(kube_api.manifest_hash(obj), kube_api.applied_hash(live))
+        self.assertIsNone(kube_api.applied_hash({'metadata': {}}))
+
+    def test_api_apply_removes_dropped_fields(self):
+        filename = self.write_manifest('one')
+        module = self.api_module(filename=[filename])
+        kube.KubeManager(module).replace()
+        live = self.server.get('configmaps', 'default', 'one')
+        live['data']['owner'] = 'someone-else'
+        with open(filename, 'w') as f:
+            f.write(MANIFEST.replace('  key: %(value)s\n', '  other: b\n') % dict(
+                name='one', kind='ConfigMap', api_version='v1'))
+
+        result = kube.KubeManager(module).replace()
+        self.assertEqual(['configmap/one configured'], result)
+        live = self.server.get('configmaps', 'default', 'one')
+        self.assertEqual({'other': 'b', 'owner': 'someone-else'}, live['data'])
+        self.assertIn('uid', live['metadata'])
+
+    def test_api_reuses_connection_and_discovery(self):
+        filenames = [self.write_manifest(n, kind='Deployment',
+                                         api_version='apps/v1')
+                     for n in ('one', 'two', 'three')]
+        kube.KubeManager(self.api_module(filename=filenames)).replace()
+        self.assertEqual(1, self.server.connections)
+        discovery = [r for r in self.server.requests
+                     if r == ('GET', '/apis/apps/v1')]
+        self.assertEqual(1, len(discovery))
+
+    def test_api_session_proxy_shared_between_runs(self):
+        filename = self.write_manifest('one')
+        for value in ('a', 'b', 'c'):
+            self.write_manifest('one', value=value)
+            manager = kube.KubeManager(self.api_module(
+                filename=[filename], session=True, session_timeout=1))
+            self.assertEqual(['configmap/one configured' if value != 'a' else
+                              'configmap/one created'], manager.replace())
+            manager.client.close()
+        self.assertEqual(1, self.server.connections)
+        self.assertEqual('c', self.server.get('configmaps', 'default', 'one')['data']['key'])
+
+        # The proxy exits once idle and the next run starts a new one.
+        session_socket = manager.client.session_socket
+        for _ in range(100):
+            if not os.path.exists(session_socket):
+                break
+            time.sleep(0.05)
+        self.assertFalse(os.path.exists(session_socket))
+
+    def test_api_discovery_cache_shared_between_runs(self):
+        filenames = [self.write_manifest('one', kind='Deployment', api_version='apps/v1'),
+                     self.write_manifest('two')]
+        kube.KubeManager(self.api_module(filename=filenames)).replace()
+        del self.server.requests[:]
+
+        kube.KubeManager(self.api_module(filename=filenames)).replace()
+        discovery = [r for r in self.server.requests
+                     if r[0] == 'GET' and '/namespaces/' not in r[1]]
+        self.assertEqual([('GET', '/version')], discovery)
+
+        # An upgraded server invalidates the cache.
+        self.server.version = 'v1.10.0'
+        del self.server.requests[:]
+        kube.KubeManager(self.api_module(filename=filenames)).replace()
+        self.assertIn(('GET', '/apis/apps/v1'), self.server.requests)
+
+    def test_api_discovery_cache_refreshed_on_unknown_kind(self):
+        kube.KubeManager(self.api_module(filename=[self.write_manifest('one')])).replace()
+        cache_file = os.path.join(self.tmpdir, 'cache', 'discovery', '127.0.0.1_%d.json'
+                                  % self.server.server_address[1])
+        with open(cache_file) as f:
+            cached = json.load(f)
+        cached['resources']['v1'] = [r for r in cached['resources']['v1']
+                                     if r['kind'] != 'ConfigMap']
+        with open(cache_file, 'w') as f:
+            json.dump(cached, f)
+
+        manager = kube.KubeManager(self.api_module(filename=[self.write_manifest('two')]))
+        self.assertEqual(['configmap/two created'], manager.replace())
+
+    def test_api_exists_and_delete(self):
+        kube.KubeManager(self.api_module(
+            filename=[self.write_manifest('one'),
+                      self.write_manifest('two')])).replace()
+        self.server.get('configmaps', 'default', 'two')['metadata']['labels'] = {'app': 'x'}
+
+        manager = kube.KubeManager(self.api_module(resource='cm', name='one'))
+        self.assertTrue(manager.exists())
+        self.assertEqual(['configmap "one" deleted'], manager.delete())
+        self.assertFalse(manager.exists())
+        self.assertEqual([], manager.delete())
+
+        manager = kube.KubeManager(self.api_module(resource='configmaps',
+                                                   label='app=x'))
+        self.assertEqual(['configmap "two" deleted'], manager.delete())
+        self.assertEqual({}, self.server.objects)
+
+    def test_api_exists_lists_each_kind_once(self):
+        kube.KubeManager(self.api_module(
+            filename=[self.write_manifest(n) for n in ('one', 'two', 'three')])).replace()
+        del self.server.requests[:]
+
+        manager = kube.KubeManager(self.api_module(resource='cm,svc',
+                                                   name='one,two,three'))
+        self.assertFalse(manager.exists())
+        self.assertEqual([('GET', '/api/v1/namespaces/default/configmaps'),
+                          ('GET', '/api/v1/namespaces/default/services')],
+                         [r for r in self.server.requests if '/namespaces/' in r[1]])
+        self.assertTrue(kube.KubeManager(self.api_module(
+            resource='cm', name='one,two,three')).exists())
+
+        # Only the existing objects are deleted.
+        self.assertEqual(3, len(manager.delete()))
+        self.assertEqual({}, self.server.objects)
+
+    def aliases(self, *names):
+        return [{'apiVersion': 'example.com/v1', 'kind': 'Alias', 'metadata': {'name': name}}
+                for name in names]
+
+    def test_api_resource_names_resolved_through_discovery(self):
+        kube.KubeManager(self.api_module(definition=self.aliases('one', 'two'))).replace()
+        manager = kube.KubeManager(self.api_module(resource='aliases', name='one'))
+        self.assertEqual(['alias "one" deleted'], manager.delete())
+        self.assertEqual(['two'], [key[2] for key in self.server.objects])
+
+    def test_kubectl_resource_names_resolved_through_api_resources(self):
+        kube.KubeManager(FakeModule(definition=self.aliases('one', 'two'))).replace()
+        module = FakeModule(resource='aliases', name='one')
+        self.assertEqual(['alias "one" deleted'], kube.KubeManager(module).delete())
+        self.assertEqual(['api-resources', '--no-headers'], module.commands[0][1:])
+
+    def test_kubectl_delete_existing_in_one_call(self):
+        filenames = [self.write_manifest(n) for n in ('one', 'two')]
+        kube.KubeManager(FakeModule(filename=filenames)).replace()
+
+        module = FakeModule(resource='cm,svc', name='one,two')
+        self.assertEqual(['configmap "one" deleted', 'configmap "two" deleted'],
+                         kube.KubeManager(module).delete())
+        self.assertEqual([['get', 'configmap,service', '-o', 'json'],
+                          ['delete', '--ignore-not-found', 'configmap/one', 'configmap/two']],
+                         [c[1:] for c in module.commands])
+        self.assertEqual([], kube.KubeManager(FakeModule(resource='cm', name='one')).delete())
+
+    def test_kubectl_retries_transient_errors(self):
+        os.environ['FAKE_KUBECTL_FLAKY'] = '2'
+        self.addCleanup(os.environ.pop, 'FAKE_KUBECTL_FLAKY')
+        module = FakeModule(filename=[self.write_manifest('one')], retries=2, retry_delay=0.01)
+        self.assertEqual(['configmap/one created'], kube.KubeManager(module).replace())
+
+        # Planning and applying each give up after one retry.
+        os.remove(os.environ['FAKE_KUBECTL_STATE'] + '.flaky')
+        os.environ['FAKE_KUBECTL_FLAKY'] = '4'
+        module = FakeModule(filename=[self.write_manifest('two')], retries=1, retry_delay=0.01)
+        self.assertRaises(FailJson, kube.KubeManager(module).replace)
+
+    def test_api_retries_unavailable_server(self):
+        manager = kube.KubeManager(self.api_module(filename=[self.write_manifest('one')],
+                                                   retries=3, retry_delay=0.01))
+        self.server.fail_next = [503, 429]
+        self.assertEqual(['configmap/one created'], manager.replace())
+
+        manager = kube.KubeManager(self.api_module(filename=[self.write_manifest('two')],
+                                                   retries=0))
+        self.server.fail_next = [503]
+        self.assertRaises(FailJson, manager.replace)
+
+    def test_api_apply_conflict_reads_again(self):
+        manager = kube.KubeManager(self.api_module(filename=[self.write_manifest('one')],
+                                                   retries=1, retry_delay=0.01))
+        # Someone else creates the object between our GET and POST.
+        self.server.fail_next = [('POST', 409)]
+        self.assertEqual(['configmap/one unchanged'], manager.replace())
+        self.assertEqual(2, len([r for r in self.server.requests
+                                 if r == ('GET', '/api/v1/namespaces/default/configmaps/one')]))
+
+    def test_api_resource_for_name(self):
+        client = kube.KubeManager(self.api_module()).client
+        for name in ('deploy', 'deployments.apps', 'Deployment'):
+            self.assertEqual('deployments', client.resource_for_name(name)['name'])
+        self.assertRaises(kube_api.KubeApiError, client.resource_for_name,
+                          'deployments.batch')
+
+    def test_object_status(self):
+        deploy = {'kind': 'Deployment', 'metadata': {'generation': 2},
+                  'spec': {'replicas': 2},
+                  'status': {'observedGeneration': 1}}
+        self.assertEqual(kube_api.PENDING, kube_api.object_status(deploy)[0])
+        deploy['status'] = {'observedGeneration': 2, 'replicas': 3,
+                            'updatedReplicas': 2, 'availableReplicas': 2}
+        self.assertEqual((kube_api.PENDING, '1 old replicas pending termination'),
+                         kube_api.object_status(deploy))
+        deploy['status']['replicas'] = 2
+        self.assertEqual(kube_api.READY, kube_api.object_status(deploy)[0])
+
+        daemonset = {'kind': 'DaemonSet', 'status': {
+            'desiredNumberScheduled': 3, 'updatedNumberScheduled': 3,
+            'numberAvailable': 2}}
+        self.assertEqual(kube_api.PENDING, kube_api.object_status(daemonset)[0])
+
+        job = {'kind': 'Job', 'status': {'conditions': [
+            {'type': 'Failed', 'status': 'True', 'message': 'BackoffLimitExceeded'}]}}
+        self.assertEqual((kube_api.FAILED, 'BackoffLimitExceeded'),
+                         kube_api.object_status(job))
+        self.assertEqual(kube_api.PENDING,
+                         kube_api.object_status(job, condition='Complete')[0])
+
+    def later(self, delay, func, *args):
+        timer = threading.Timer(delay, func, args)
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def test_api_wait_ready(self):
+        filename = self.write_manifest('app', kind='Deployment',
+                                       api_version='apps/v1')
+        manager = kube.KubeManager(self.api_module(filename=[filename],
+                                                   wait_timeout=10))
+        manager.replace()
+        self.later(0.3, self.server.update, 'deployments', 'default', 'app',
+                   {'status': {'updatedReplicas': 1, 'replicas': 1,
+                               'availableReplicas': 1}})
+        manager.wait_ready()
+        watches = [r for r in self.server.requests
+                   if r == ('GET', '/apis/apps/v1/namespaces/default/deployments')]
+        self.assertEqual(2, len(watches))
+
+    def test_api_rollout_summary(self):
+        filenames = [self.write_manifest('app', kind='Deployment', api_version='apps/v1'),
+                     self.write_manifest('settings')]
+        manager = kube.KubeManager(self.api_module(filename=filenames, wait_timeout=10))
+        manager.replace()
+        self.later(0.3, self.server.update, 'deployments', 'default', 'app',
+                   {'status': {'updatedReplicas': 1, 'replicas': 1,
+                               'availableReplicas': 1}})
+        manager.wait_ready()
+        objects = manager.rollout['objects']
+        self.assertEqual(['settings', 'app'], [o['name'] for o in objects])
+        self.assertLess(objects[0]['ready_after_s'], 0.3)
+        self.assertGreaterEqual(objects[1]['ready_after_s'], 0.3)
+        self.assertGreaterEqual(manager.rollout['duration_s'], objects[1]['ready_after_s'])
+
+    def test_object_status_max_unavailable(self):
+        daemonset = {'kind': 'DaemonSet', 'metadata': {'generation': 2},
+                     'status': {'observedGeneration': 2, 'desiredNumberScheduled': 500,
+                                'updatedNumberScheduled': 495, 'numberAvailable': 490}}
+        self.assertEqual(kube_api.PENDING, kube_api.object_status(daemonset)[0])
+        self.assertEqual(kube_api.PENDING, kube_api.object_status(daemonset, max_unavailable=5)[0])
+        self.assertEqual((kube_api.READY, '490 of 500 pods available'),
+                         kube_api.object_status(daemonset, max_unavailable='2%'))
+
+    def test_api_wait_timeout(self):
+        filename = self.write_manifest('app', kind='Deployment',
+                                       api_version='apps/v1')
+        manager = kube.KubeManager(self.api_module(filename=[filename],
+                                                   wait_timeout=1))
+        manager.replace()
+        try:
+            manager.wait_ready()
+            self.fail('wait did not time out')
+        except FailJson as e:
+            self.assertIn('deployment/app: 0 of 1 replicas updated',
+                          e.args[0]['msg'])
+
+    def test_api_wait_failed_job(self):
+        filename = self.write_manifest('migrate', kind='Job',
+                                       api_version='batch/v1')
+        manager = kube.KubeManager(self.api_module(filename=[filename],
+                                                   wait_timeout=30))
+        manager.replace()
+        self.later(0.2, self.server.update, 'jobs', 'default', 'migrate',
+                   {'status': {'conditions': [{'type': 'Failed',
+                                               'status': 'True'}]}})
+        try:
+            manager.wait_ready()
+            self.fail('wait did not fail')
+        except FailJson as e:
+            self.assertIn('resources failed: job/migrate', e.args[0]['msg'])
+
+    def add_deployment(self, name, replicas, labels=None):
+        self.server.add({'apiVersion': 'apps/v1', 'kind': 'Deployment',
+                         'metadata': {'name': name, 'namespace': 'kube-system',
+                                      'generation': 1, 'labels': labels or {}},
+                         'spec': {'replicas': replicas},
+                         'status': {'observedGeneration': 1, 'replicas': replicas,
+                                    'updatedReplicas': replicas,
+                                    'availableReplicas': replicas}})
+
+    def test_api_scale_by_label_and_wait(self):
+        manager = kube.KubeManager(self.api_module(
+            resource='deploy', label='drain=true', namespace='kube-system', wait_timeout=10))
+        self.add_deployment('coredns', 2, {'drain': 'true'})
+        self.add_deployment('ingress', 0, {'drain': 'true'})
+        self.add_deployment('tiller', 1)
+        del self.server.requests[:]
+
+        self.later(0.3, self.server.update, 'deployments', 'kube-system', 'coredns',
+                   {'status': {'observedGeneration': 2, 'replicas': 0,
+                               'updatedReplicas': 0, 'availableReplicas': 0}})
+        lines = manager.scale(0, wait=True)
+        self.assertEqual(['deployment/ingress unchanged', 'deployment/coredns scaled'], lines)
+        self.assertEqual([('PATCH', '/apis/apps/v1/namespaces/kube-system/deployments/coredns/scale')],
+                         self.server.writes())
+        self.assertEqual(0, self.server.get('deployments', 'kube-system', 'coredns')['status']['replicas'])
+        self.assertEqual(1, self.server.get('deployments', 'kube-system', 'tiller')['spec']['replicas'])
+
+    def test_kubectl_scale_in_one_call(self):
+        filenames = [self.write_manifest(n, kind='Deployment', api_version='apps/v1')
+                     for n in ('one', 'two')]
+        kube.KubeManager(FakeModule(filename=filenames)).replace()
+
+        module = FakeModule(resource='deploy', name='one,two,missing')
+        self.assertEqual(['deployment "one" scaled', 'deployment "two" scaled'],
+                         kube.KubeManager(module).scale(3))
+        self.assertEqual([['--namespace=default', 'scale', '--replicas=3',
+                           'deployment/one', 'deployment/two']],
+                         [c[1:] for c in module.commands if 'scale' in c])
+
+        module = FakeModule(filename=filenames)
+        self.assertEqual(['deployment/one unchanged', 'deployment/two unchanged'],
+                         kube.KubeManager(module).scale(3))
+
+    def test_kubectl_wait_ready(self):
+        filename = self.write_manifest('app', kind='Deployment',
+                                       api_version='apps/v1')
+        module = FakeModule(filename=[filename], wait_timeout=10)
+        manager = kube.KubeManager(module)
+        manager.replace()
+
+        def available():
+            state_file = os.environ['FAKE_KUBECTL_STATE']
+            with open(state_file + '.lock', 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                with open(state_file) as f:
+                    state = json.load(f)
+                state['deployment/default/app']['status'] = {
+                    'updatedReplicas': 1, 'replicas': 1, 'availableReplicas': 1}
+                with open(state_file, 'w') as f:
+                    json.dump(state, f)
+
+        self.later(0.5, available)
+        manager.wait_ready()
+        gets = [c for c in module.commands if 'get' in c]
+        self.assertTrue(2 <= len(gets) <= 3)
+
+    def test_benchmark_matches_baseline(self):
+        import bench_kube
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'bench_kube_baseline.json')) as f:
+            baseline = json.load(f)
+        results = bench_kube.run(['kubectl', 'api'], [10])
+        self.assertEqual([], bench_kube.regressions(results, baseline))
+
+        results['api']['10']['noop']['api_calls'] += 1
+        self.assertEqual(['api noop x10: 12 api_calls, baseline 11'],
+                         bench_kube.regressions(results, baseline))
+
+    def test_api_engine_falls_back_to_kubectl(self):
+        module = FakeModule(engine='api',
+                            kubeconfig=os.path.join(self.tmpdir, 'missing'))
+        manager = kube.KubeManager(module)
+        self.assertIsNone(manager.client)
+        self.assertEqual(1, len(module.warnings))
@@ -0,0 +1,295 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+import ansible.module_utils
+import yaml
+
+path = "./library/"
+if path not in sys.path:
+    sys.path.append(path)
+
+module_utils_path = os.path.abspath("./module_utils/")
+if module_utils_path not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(module_utils_path)
+
+import kube_node
+from stub_apiserver import StubApiServer
+from test_kube import FailJson, FakeModule
+
+NODE_PARAMS = {
+    'state': 'cordoned',
+    'parallelism': 5,
+    'eviction_parallelism': 10,
+    'timeout': '360s',
+    'grace_period': -1,
+    'force': False,
+    'delete_local_data': False,
+    'include_not_ready': False,
+    'retries': 0,
+    'retry_delay': 0.01,
+    'retry_max_delay': 0.05,
+}
+
+
+def node(name, ready=True, unschedulable=False):
+    return {'apiVersion': 'v1', 'kind': 'Node',
+            'metadata': {'name': name},
+            'spec': {'unschedulable': True} if unschedulable else {},
+            'status': {'conditions': [{'type': 'Ready',
+                                       'status': 'True' if ready else 'Unknown'}]}}
+
+
+def pod(name, node_name, owner='ReplicaSet', namespace='default', **spec):
+    meta = {'name': name, 'namespace': namespace, 'uid': name}
+    if owner:
+        meta['ownerReferences'] = [{'kind': owner, 'name': 'owner', 'controller': True}]
+    spec['nodeName'] = node_name
+    return {'apiVersion': 'v1', 'kind': 'Pod', 'metadata': meta, 'spec': spec}
+
+
+class TestNodeManager(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = StubApiServer().start()
+        self.kubeconfig = os.path.join(self.tmpdir, 'kubeconfig')
+        with open(self.kubeconfig, 'w') as f:
+            yaml.safe_dump(self.server.kubeconfig(), f)
+        for name in ('node-1', 'node-2'):
+            self.server.add(node(name))
+        self.server.add(node('node-3', ready=False))
+        self.server.add(node('node-4', unschedulable=True))
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def manager(self, check_mode=False, **params):
+        module = FakeModule(check_mode=check_mode, kubeconfig=self.kubeconfig,
+                            cache_dir=os.path.join(self.tmpdir, 'cache'))
+        module.params.update(NODE_PARAMS)
+        module.params.update(params)
+        manager = kube_node.NodeManager(module)
+        manager.load()
+        del self.server.requests[:]
+        return manager
+
+    def later(self, delay, func, *args):
+        timer = threading.Timer(delay, func, args)
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def unschedulable(self, name):
+        return bool(self.server.get('nodes', None, name)['spec'].get('unschedulable'))
+
+    def test_cordon_ready_schedulable_nodes(self):
+        manager = self.manager(nodes=['node-1', 'node-2', 'node-3', 'node-4', 'node-5'])
+        self.assertEqual(['node-5'], manager.missing)
+        self.assertEqual(['node-1', 'node-2'], manager.cordon())
+        self.assertEqual([True, True, False, True],
+                         [self.unschedulable(n) for n in ('node-1', 'node-2', 'node-3', 'node-4')])
+        self.assertEqual([('PATCH', '/api/v1/nodes/node-1'), ('PATCH', '/api/v1/nodes/node-2')],
+                         sorted(self.server.requests))
+
+    def test_unreachable_api_server_fails_the_module(self):
+        manager = self.manager(nodes=['node-1', 'node-2'], state='drained')
+        self.server.stop()
+        with self.assertRaises(FailJson) as failed:
+            manager.drain()
+        self.assertTrue(failed.exception.args[0]['msg'].startswith('error cordoning 2 node(s)'))
+
+        with self.assertRaises(FailJson) as failed:
+            self.manager(nodes=['node-1'], cache_dir=os.path.join(self.tmpdir, 'empty'))
+        self.assertTrue(failed.exception.args[0]['msg'].startswith(
+            'error reading the API discovery'))
+
+    def test_kubeconfig_read_with_kubectl_without_pyyaml(self):
+        self.addCleanup(setattr, kube_node, 'HAS_YAML', kube_node.HAS_YAML)
+        kube_node.HAS_YAML = False
+        manager = self.manager(nodes=['node-1'])
+        self.assertEqual(['config', 'view'], manager.module.commands[0][1:3])
+        self.assertEqual(['node-1'], manager.cordon())
+        self.assertTrue(self.unschedulable('node-1'))
+
+    def test_check_mode_changes_nothing(self):
+        self.server.add(pod('web', 'node-1'))
+        manager = self.manager(check_mode=True, nodes=['node-1'])
+        self.assertEqual(['node-1'], manager.drain())
+        self.assertEqual([{'name': 'default/web', 'attempts': 0}], manager.nodes['node-1']['pods'])
+        self.assertEqual([], self.server.writes())
+
+    def test_drain_skips_daemonset_and_mirror_pods(self):
+        self.server.add(pod('web', 'node-1'))
+        self.server.add(pod('db', 'node-2', owner='StatefulSet', namespace='data'))
+        self.server.add(pod('proxy', 'node-1', owner='DaemonSet'))
+        mirror = pod('apiserver', 'node-1', owner=None, namespace='kube-system')
+        mirror['metadata']['annotations'] = {kube_node.MIRROR_ANNOTATION: 'x'}
+        self.server.add(mirror)
+        self.server.add(pod('other', 'node-3'))
+
+        manager = self.manager(nodes=['node-1', 'node-2'])
+        self.assertEqual(['node-1', 'node-2'], manager.drain())
+        remaining = sorted(name for plural, _, name in self.server.objects if plural == 'pods')
+        self.assertEqual(['apiserver', 'other', 'proxy'], remaining)
+        # One list of all pods, then one check per node that its pods are gone.
+        self.assertEqual(3, len([r for r in self.server.requests if r == ('GET', '/api/v1/pods')]))
+        self.assertEqual([('POST', '/api/v1/namespaces/data/pods/db/eviction'),
+                          ('POST', '/api/v1/namespaces/default/pods/web/eviction')],
+                         sorted(r for r in self.server.requests if r[0] == 'POST'))
+        self.assertTrue(all(r['drained'] for r in manager.results()))
+
+    def test_drain_refuses_bare_pods_without_force(self):
+        self.server.add(pod('bare', 'node-1', owner=None))
+        self.server.add(pod('scratch', 'node-2', volumes=[{'name': 'tmp', 'emptyDir': {}}]))
+        manager = self.manager(nodes=['node-1', 'node-2'])
+        with self.assertRaises(FailJson) as cm:
+            manager.drain()
+        self.assertIn('default/bare is not managed by a controller', cm.exception.args[0]['msg'])
+        self.assertIn('default/scratch uses local data', cm.exception.args[0]['msg'])
+        self.assertIsNotNone(self.server.get('pods', 'default', 'bare'))
+
+        manager = self.manager(nodes=['node-1', 'node-2'], force=True, delete_local_data=True)
+        manager.drain()
+        self.assertIsNone(self.server.get('pods', 'default', 'bare'))
+        self.assertIsNone(self.server.get('pods', 'default', 'scratch'))
+
+    def test_drain_times_out_per_node(self):
+        stuck = pod('stuck', 'node-1')
+        stuck['metadata']['finalizers'] = ['example.com/slow']
+        self.server.add(stuck)
+        self.server.add(pod('web', 'node-2'))
+        manager = self.manager(nodes=['node-1', 'node-2'], timeout='0.2s')
+        with self.assertRaises(FailJson) as cm:
+            manager.drain()
+        self.assertIn('node-1: timed out', cm.exception.args[0]['msg'])
+        results = cm.exception.args[0]['nodes']
+        self.assertTrue(results[0]['failed'])
+        self.assertTrue(results[1]['drained'])
+
+    def test_drain_backs_off_pods_blocked_by_disruption_budget(self):
+        for name in ('web-1', 'web-2', 'web-3'):
+            self.server.add(pod(name, 'node-1'))
+        self.server.evictions_blocked['web-2'] = 2
+        manager = self.manager(nodes=['node-1'])
+        manager.drain()
+        pods = dict((p['name'], p) for p in manager.nodes['node-1']['pods'])
+        self.assertEqual([1, 3, 1], [pods['default/web-%d' % i]['attempts'] for i in (1, 2, 3)])
+        self.assertTrue(all(p['evicted_after_s'] <= p['deleted_after_s'] for p in pods.values()))
+        evictions = [r for r in self.server.requests if r[0] == 'POST']
+        self.assertEqual(5, len(evictions))
+        self.assertEqual([('POST', '/api/v1/namespaces/default/pods/web-2/eviction')] * 2, evictions[3:])
+
+    def test_drain_times_out_on_disruption_budget(self):
+        self.server.add(pod('web', 'node-1'))
+        self.server.evictions_blocked['web'] = 1000
+        manager = self.manager(nodes=['node-1'], timeout='0.3s')
+        with self.assertRaises(FailJson) as cm:
+            manager.drain()
+        self.assertIn('disruption budgets do not allow evicting 1 pod(s): default/web',
+                      cm.exception.args[0]['msg'])
+        self.assertIsNotNone(self.server.get('pods', 'default', 'web'))
+
+    def test_drain_include_not_ready(self):
+        stuck = pod('web', 'node-3')
+        stuck['metadata']['finalizers'] = ['example.com/dead-kubelet']
+        self.server.add(stuck)
+        manager = self.manager(nodes=['node-3'], state='drained')
+        self.assertEqual([], manager.drain())
+        self.assertEqual([], self.server.writes())
+
+        manager = self.manager(nodes=['node-3'], state='drained', include_not_ready=True,
+                               timeout='0.2s')
+        self.assertEqual(['node-3'], manager.drain())
+        self.assertTrue(self.unschedulable('node-3'))
+        self.assertEqual([('POST', '/api/v1/namespaces/default/pods/web/eviction')],
+                         [r for r in self.server.requests if r[0] == 'POST'])
+        self.assertTrue(manager.nodes['node-3']['drained'])
+
+    def test_uncordon(self):
+        manager = self.manager(nodes=['node-1', 'node-4'])
+        self.assertEqual(['node-4'], manager.uncordon())
+        self.assertFalse(self.unschedulable('node-4'))
+        self.assertEqual([('PATCH', '/api/v1/nodes/node-4')], self.server.requests)
+
+    def test_duration_seconds(self):
+        self.assertEqual([360, 360, 120, 0.5],
+                         [kube_node.duration_seconds(v) for v in ('360s', 360, '2m', '500ms')])
+        self.assertRaises(ValueError, kube_node.duration_seconds, 'soon')
+
+    def test_wait_ready_with_one_watch(self):
+        manager = self.manager(nodes=['node-1', 'node-3', 'node-9'], timeout='10s')
+        ready = {'status': {'conditions': [{'type': 'Ready', 'status': 'True'}]}}
+        self.later(0.2, self.server.update, 'nodes', None, 'node-3', ready)
+        self.later(0.3, self.server.add, node('node-9'))
+        self.assertEqual([], manager.wait_ready())
+        self.assertEqual([True, True, True], [r['ready'] for r in manager.results()])
+        self.assertTrue(manager.nodes['node-9']['ready_after_s'] >= 0.3)
+        # One list, then one watch for all nodes.
+        self.assertEqual([('GET', '/api/v1/nodes')] * 2, self.server.requests)
+
+    def test_wait_ready_reports_stragglers(self):
+        manager = self.manager(nodes=['node-1', 'node-3', 'node-9'], timeout='0.5s')
+        self.assertEqual(['node-3', 'node-9'], manager.wait_ready())
+        self.assertEqual(['waiting for condition Ready', 'not found'],
+                         [manager.nodes[n]['msg'] for n in ('node-3', 'node-9')])
+
+    def test_reconcile_patches_only_differing_nodes(self):
+        self.server.update('nodes', None, 'node-2', {'metadata': {'labels': {'zone': 'a', 'old': 'x'}}})
+        self.server.update('nodes', None, 'node-1', {'spec': {'taints': [
+            {'key': 'node.kubernetes.io/unreachable', 'effect': 'NoExecute'}]}})
+        desired = {
+            'node-1': {'labels': {'zone': 'b'},
+                       'taints': ['dedicated=ingress:NoSchedule']},
+            'node-2': {'labels': {'zone': 'a', 'old': None, 'absent': None}},
+            'node-5': {'labels': {'zone': 'c'}},
+        }
+        manager = self.manager(desired=desired, nodes=None, state='present')
+        self.assertEqual(['node-5'], manager.missing)
+        self.assertEqual(['node-1', 'node-2'], manager.reconcile())
+        self.assertEqual([('PATCH', '/api/v1/nodes/node-1'), ('PATCH', '/api/v1/nodes/node-2')],
+                         sorted(self.server.requests))
+        node1 = self.server.get('nodes', None, 'node-1')
+        self.assertEqual({'zone': 'b'}, node1['metadata']['labels'])
+        self.assertEqual(['node.kubernetes.io/unreachable', 'dedicated'],
+                         [t['key'] for t in node1['spec']['taints']])
+        self.assertEqual({'zone': 'a'}, self.server.get('nodes', None, 'node-2')['metadata']['labels'])
+
+        # Nothing differs any more.
+        manager = self.manager(desired=desired, nodes=None, state='present')
+        self.assertEqual([], manager.reconcile())
+        self.assertEqual([], self.server.requests)
+
+    def test_reconcile_taints_rereads_after_conflict(self):
+        desired = {'node-1': {'taints': ['dedicated=ingress:NoSchedule', 'old:NoExecute-']}}
+        manager = self.manager(desired=desired, state='present', retries=1)
+        # A taint added by the node controller after the node list.
+        self.server.update('nodes', None, 'node-1', {'spec': {'taints': [
+            {'key': 'old', 'effect': 'NoExecute'},
+            {'key': 'node.kubernetes.io/not-ready', 'effect': 'NoExecute'}]}})
+        self.assertEqual(['node-1'], manager.reconcile())
+        self.assertEqual([('PATCH', '/api/v1/nodes/node-1'), ('GET', '/api/v1/nodes/node-1'),
+                          ('PATCH', '/api/v1/nodes/node-1')], self.server.requests)
+        self.assertEqual([{'key': 'node.kubernetes.io/not-ready', 'effect': 'NoExecute'},
+                          {'key': 'dedicated', 'value': 'ingress', 'effect': 'NoSchedule'}],
+                         self.server.get('nodes', None, 'node-1')['spec']['taints'])
+
+    def test_parse_taint(self):
+        self.assertEqual({'key': 'a', 'value': 'b', 'effect': 'NoExecute'}, kube_node.parse_taint('a=b:NoExecute'))
+        self.assertEqual({'key': 'a', 'value': None, 'effect': 'NoSchedule', 'state': 'absent'},
+                         kube_node.parse_taint('a:NoSchedule-'))
+        self.assertRaises(ValueError, kube_node.parse_taint, '=b')